@@ -1,5 +1,7 @@
 import signal
 import os
+import copy
+import hashlib
 from datetime import datetime
 # import cv2
 import asyncio
@@ -11,76 +13,120 @@ import time
 from printercontroller.octoprint import Octoprint
 from printercontroller.klipper import Klipper
 from utils.helpers import parse_move_command
+from utils.gcode_cache import GcodeCache
+from utils.poll_scheduler import PollScheduler
+from utils.http_pool import HttpPool
+from utils.transport import resolve_printer_transport
+from utils.command_executor import CommandExecutor
+from utils.outbound import OutboundQueue, merge_printer_updates, PRIORITY_CONTROL, PRIORITY_UPDATE, PRIORITY_ALIVE, PRIORITY_BULK
+from utils.journal import OfflineJournal
+from utils.backoff import Backoff
+from utils.metrics import Metrics
+from utils.temperature_history import TemperatureHistory
+from utils.camera import CameraRecorder, DEFAULT_SNAPSHOT_URL, DEFAULT_MARKERS
+from utils.timelapse import TimelapseWriter
+from utils.camera_relay import CameraRelay
+from utils.gcode_analyzer import GcodeMetadataStore, StreamingAnalysis, analyze_file
+from utils.eta import EtaEstimator
+from utils.job_queue import JobQueue
 
-class BatchPrinterConnect:
-    def __init__(self):
-        self.version = 0.250715
-        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
-        self.username = os.environ.get('USER')
-        self.config_file_path = f"/home/{self.username}/batch-link/batch-link.cfg"
-        self.config = configparser.ConfigParser()
-        self.config.read(self.config_file_path)
+CONFIG_FILE_PATH = "/home/{username}/batch-link/batch-link.cfg"
+PRINTER_SECTION_PREFIX = 'printer:'
+PRINTER_DETAIL_KEYS = ('driver', 'uuid', 'api_key')
+PRINTER_ONLY_KEYS = ('octoprint_backend_url',)  # connection_settings keys a printer never inherits
+OUTBOUND_DEPTH_PER_PRINTER = 64
 
-        if not self.config.sections():
-            raise FileNotFoundError(f"Configuration file not found at {self.config_file_path}")
-        
-        self.printerdriver = self.config['printer_details']['DRIVER'].strip()
-        if self.printerdriver == 'OCTOPRINT':
-            self.printer = Octoprint(self)
-        elif self.printerdriver == 'KLIPPER':
-            self.printer = Klipper(self)
+
+def load_printer_configs(config):
+    """
+    Split the config into one (name, config) pair per printer.
+
+    Without [printer:<name>] sections the file describes a single printer and
+    is returned as is, with name None. Otherwise every printer gets a copy of
+    the shared sections with its own section laid over them: DRIVER, UUID and
+    API_KEY replace printer_details and any other key overrides
+    connection_settings (PRINTER_URL, PRINTER_DATA_DIR, ...). Addresses of a
+    single local service, like OCTOPRINT_BACKEND_URL, are only taken from the
+    printer's own section.
+    Any other shared section can be overridden per printer the same way with
+    a [<section>:<name>] section, e.g. [camera:left] or [job_queue:right].
+    """
+    printer_sections = [s for s in config.sections() if s.startswith(PRINTER_SECTION_PREFIX)]
+    if not printer_sections:
+        return [(None, config)]
+
+    names = [section[len(PRINTER_SECTION_PREFIX):].strip() for section in printer_sections]
+    overrides = {name: [] for name in names}  # printer name -> [(shared section, override section)]
+    shared = {}
+    for section in config.sections():
+        if section in printer_sections:
+            continue
+        base, separator, name = section.partition(':')
+        if not separator:
+            shared[section] = dict(config[section])
+        elif name.strip() in overrides:
+            overrides[name.strip()].append((base.strip(), section))
         else:
-            raise ValueError(f"Printer driver not defined in config")
-        
-        self.reconnect_interval = int(self.config['connection_settings']['RECONNECT_INTERVAL'])
-        self.remote_websocket_url = self.config['connection_settings']['REMOTE_WS_URL']
-        self.printer_url = 'http://localhost'
-        self.uploading_file_progress = None
-        self.uuid = self.config['printer_details']['UUID'].strip()
-        self.octo_api_key = self.config['printer_details']['API_KEY'].strip()
-        self.headers = {
-            'X-Api-Key': self.octo_api_key
-        }
-        self.update_data_changed = True
+            logging.warning(f"Ignoring [{section}]: there is no printer named {name.strip()}")
 
-        # Task tracking for non-blocking operations
-        self.current_print_task = None
-        self.current_command_task = None
+    printer_configs = []
+    for name, section in zip(names, printer_sections):
+        printer_config = configparser.ConfigParser()
+        printer_config.read_dict(shared)
+        for required in ('printer_details', 'connection_settings'):
+            if not printer_config.has_section(required):
+                printer_config.add_section(required)
+        for key in PRINTER_ONLY_KEYS:
+            printer_config.remove_option('connection_settings', key)
+        for key, value in config[section].items():
+            target = 'printer_details' if key in PRINTER_DETAIL_KEYS else 'connection_settings'
+            printer_config[target][key] = value
+        for base, override in overrides[name]:
+            if not printer_config.has_section(base):
+                printer_config.add_section(base)
+            for key, value in config[override].items():
+                printer_config[base][key] = value
+        printer_configs.append((name, printer_config))
+    return printer_configs
 
-        ## ------- CAMERA ------- ##
-        # self.current_recording_folder = None
-        # try:
-        #     self.camera = cv2.VideoCapture(0)
-        #     if not self.camera.isOpened():
-        #         logging.warning("Failed to open camera - camera may not be connected")
-        #         self.camera = None
-        # except Exception as e:
-        #     logging.warning(f"Could not initialize camera: {e}")
-        #     self.camera = None
 
-        self.last_status = None
-        self.last_gcode_command = None
+class RemoteLink:
+    """
+    The remote websocket shared by every printer this process serves.
 
-        self.printer_connection_id = None
-        self.initialUpdatesValues()
-        self.update_interval = 2
-        self.alive_interval = 10
-        
-        # Initialise Printer
-        self.printerdriver = self.config['printer_details']['DRIVER'].strip()
-        if self.printerdriver == 'OCTOPRINT':
-            self.printer = Octoprint(self)
-        elif self.printerdriver == 'KLIPPER':
-            self.printer = Klipper(self)
-        else:
-            raise ValueError(f"Printer driver not defined in config")
+    Owns the connection, its reconnect backoff and the outbound writer. With a
+    single printer the wire protocol is unchanged. When multiplexed, auth
+    carries the UUIDs of all printers, every outgoing frame is tagged with the
+    uuid of the printer it belongs to and incoming frames are routed by theirs.
+    """
 
+    def __init__(self, config, metrics, multiplexed=False):
+        self.remote_websocket_url = config['connection_settings']['REMOTE_WS_URL']
+        self.reconnect_interval = int(config['connection_settings']['RECONNECT_INTERVAL'])
+        self.backoff = Backoff(
+            self.reconnect_interval,
+            config.getint('connection_settings', 'RECONNECT_MAX_INTERVAL', fallback=300)
+        )
+        self.multiplexed = multiplexed
+        self.printers = {}  # uuid -> BatchPrinterConnect
         self.remote_websocket = None
+        self.metrics = metrics
+        self.outbound = OutboundQueue(on_send=lambda action, latency: metrics.send_latency.observe(latency, action=action))
+        metrics.add_collector(self.collect_metrics)
 
-        if not all([self.remote_websocket_url, self.printer_url, self.uuid]):
-            raise ValueError("One or more configuration parameters are missing.")
+    def collect_metrics(self):
+        stats = self.outbound.stats()
+        for result in ('sent', 'dropped', 'coalesced'):
+            self.metrics.outbound_frames.set(stats[result], result=result)
+        self.metrics.outbound_depth.set(stats['depth'])
+        self.metrics.reconnects.set(self.backoff.reconnects, connection='remote')
+
+    def add_printer(self, printer):
+        if printer.uuid in self.printers:
+            raise ValueError(f"Printer UUID {printer.uuid} is configured more than once")
+        self.printers[printer.uuid] = printer
+        self.outbound.max_depth = OUTBOUND_DEPTH_PER_PRINTER * len(self.printers)
 
-    # ************* REMOTE *************** #
     async def remote_connection(self):
         while True:
             try:
@@ -91,10 +137,17 @@ class BatchPrinterConnect:
                     ping_timeout=20
                 ) as websocket:
                     self.remote_websocket = websocket
+                    self.backoff.on_connected()
                     logging.info(f"Successfully connected to the remote websocket")
                     await self.remote_on_open(websocket)
-                    await self.send_printer_ready()
-                    self.initialUpdatesValues()
+                    # From here on the outbound writer is the only task sending on the socket
+                    self.outbound.attach(websocket)
+                    for printer in self.printers.values():
+                        await printer.on_remote_connected()
+                    self.outbound.put({
+                        'action': 'connection_stats',
+                        'content': self.backoff.stats()
+                    }, priority=PRIORITY_UPDATE)
                     async for message in websocket:
                         try:
                             await self.remote_on_message(websocket, message)
@@ -107,12 +160,19 @@ class BatchPrinterConnect:
                 logging.warning(f"Websocket connection closed normally: {e} (code: {e.code})")
             except websockets.exceptions.ConnectionClosedError as e:
                 logging.error(f"Websocket connection closed with error: {e} (code: {e.code})")
+            except websockets.exceptions.InvalidStatusCode as e:
+                logging.error(f"Remote server rejected the connection: HTTP {e.status_code}")
+                self.backoff.set_retry_after(e.headers.get('Retry-After'))
             except Exception as e:
                 logging.info("Error connecting to remote server: %s", e)
             finally:    
                 self.remote_websocket = None
-                logging.info("Attempting to reconnect in: %s seconds", self.reconnect_interval)
-                await asyncio.sleep(self.reconnect_interval)
+                self.outbound.detach()
+                self.backoff.on_disconnected()
+
+            delay = self.backoff.next_delay()
+            logging.info("Attempting to reconnect in: %.1f seconds (attempt %s)", delay, self.backoff.outage_attempts)
+            await asyncio.sleep(delay)
 
     async def remote_on_message(self, ws, message):
         try:
@@ -125,69 +185,404 @@ class BatchPrinterConnect:
             logging.error(f"Unexpected error parsing message: {e}")
             raise  # This will trigger reconnection
         
-        try:
-            if 'action' in data and 'content' in data:
-                if data['action'] == 'print':
-                    logging.info(f"File name to print: {data['content']['file_name']}")
-                    filename = data['content']['file_name']
-                    url = data['content']['url']
-                    await self.send_printer_busy()
-                    # Non-blocking: let print_file run in background
-                    if self.current_print_task and not self.current_print_task.done():
-                        self.current_print_task.cancel()
-                    self.current_print_task = asyncio.create_task(self.printer.print_file(filename, url))
-                elif data['action'] == 'stop_print':
-                    logging.info('Received stop print command for URL')
-                    await self.send_printer_busy()
-                    if self.current_print_task and not self.current_print_task.done():
-                        self.current_print_task.cancel()
-                    await self.printer.stop_print()
-                elif data['action'] == 'connect':
-                    logging.info('Received reconnect command for URL')
-                    await self.printer.reconnect_printer()
-                elif data['action'] == 'pause_print':
-                    logging.info('Received pause print command for URL')
-                    await self.printer.pause_print()
-                elif data['action'] == 'resume_print':
-                    logging.info('Received resume print command for URL')
-                    await self.printer.resume_print()
-                elif data['action'] == 'cmd':
-                    logging.info('Received command to execute')
-                    await self.send_printer_busy()
-                    if self.current_command_task and not self.current_command_task.done():
-                        self.current_command_task.cancel()
-                    self.current_command_task = asyncio.create_task(self.printer.send_command(data['content']))
-                elif data['action'] == 'heat_printer':
-                    logging.info('Receive heating command')
-                    await self.printer.set_temperatures(215, 60)
-                elif data['action'] == 'cool_printer':
-                    logging.info('Receive heating command')
-                    await self.printer.set_temperatures(0, 0)
-                elif "move" in data['action']:
-                    logging.info("ACTION")
-                    x, y, z = parse_move_command(data['action'])
-                    await self.printer.move_extruder(x, y, z)
-                elif data['action'] == 'reboot_system':
-                    logging.info('Received reboot command')
-                    asyncio.create_task(self.reboot_system())
-                elif "emergency_stop" in data['action']:
-                    logging.info('Received emergency stop command')
-                    await self.printer.emergency_stop()
-                else:
-                    logging.warning(f'Unknown command: {data.get("action", "no_action")}')
-        except Exception as e:
-            logging.error(f"Error executing command {data.get('action', 'unknown')}: {e} - will reconnect")
-            raise  # This will trigger reconnection
+        if 'action' not in data or 'content' not in data:
+            return
+        if self.multiplexed:
+            printer = self.printers.get(data.get('uuid'))
+            if printer is None:
+                logging.warning(f"Dropping {data['action']} for unknown printer {data.get('uuid')}")
+                return
+        else:
+            printer = next(iter(self.printers.values()))
+        printer.command_executor.submit(data['action'], data['content'])
 
     async def remote_on_open(self, ws):
         logging.info("Remote connection opened")
         uuid_message = {
             "action": "auth",
-            "content": self.uuid,
+            "content": list(self.printers) if self.multiplexed else next(iter(self.printers)),
         }
         await ws.send(json.dumps(uuid_message))
         logging.info('Message sent: %s', uuid_message)
 
+
+class BatchPrinterConnect:
+    def __init__(self, config, link, http_pool, name=None):
+        self.version = 0.250715
+        self.username = os.environ.get('USER')
+        self.config = config
+        self.name = name
+        self.link = link
+        self.metrics = link.metrics
+        # The UUID authenticates the remote link, so unnamed printers are labelled by a short hash of it
+        self.metrics_label = name or hashlib.sha256(self.config['printer_details']['UUID'].strip().encode()).hexdigest()[:12]
+        self.metrics_in_updates = self.config.getboolean('metrics', 'SUMMARY_IN_UPDATES', fallback=False)
+        
+        self.http_pool = http_pool
+        self.printerdriver = self.config['printer_details']['DRIVER'].strip()
+        
+        self.reconnect_interval = link.reconnect_interval
+        self.poll_scheduler = PollScheduler(self.config, self.reconnect_interval)
+        self.printer_data_dir = self.config['connection_settings'].get('PRINTER_DATA_DIR', f"/home/{self.username}/printer_data").strip()
+        self.printer_url = resolve_printer_transport(self.config, self.printerdriver)
+        self.uploading_file_progress = None
+        self.downloading_file_progress = None
+        self.uuid = self.config['printer_details']['UUID'].strip()
+        self.octo_api_key = self.config['printer_details']['API_KEY'].strip()
+        self.headers = {
+            'X-Api-Key': self.octo_api_key
+        }
+        self.update_data_changed = True
+
+        # Delta-encoded printer updates
+        self.delta_updates = self.config.getboolean('connection_settings', 'DELTA_UPDATES', fallback=False)
+        self.full_update_interval = 120
+        self.update_seq = 0
+        self.last_sent_updates = None  # What the server last received, deltas are computed against it
+        self.last_full_update_time = 0
+        self.full_update_requested = True
+
+        # Task tracking for non-blocking operations
+        self.current_print_task = None
+        self.current_command_task = None
+        self.command_executor = CommandExecutor(on_complete=self.on_command_complete)
+        self.register_commands()
+
+        ## ------- CAMERA ------- ##
+        self.camera = None
+        if self.config.getboolean('camera', 'ENABLED', fallback=False):
+            # Each printer gets its own timelapse folder and quota
+            timelapse = TimelapseWriter(
+                os.path.join(os.path.expanduser(self.config.get('camera', 'OUTPUT_DIR', fallback='~/printer-image-data').strip()), self.name or ''),
+                quota_bytes=self.config.getint('camera', 'QUOTA_MB', fallback=2048) * 1024 * 1024,
+                duplicate_threshold=self.config.getfloat('camera', 'DUPLICATE_THRESHOLD', fallback=2.0),
+            )
+            markers = self.config.get('camera', 'MARKERS', fallback=','.join(DEFAULT_MARKERS))
+            self.camera = CameraRecorder(
+                self,
+                timelapse,
+                snapshot_url=self.config.get('camera', 'SNAPSHOT_URL', fallback=DEFAULT_SNAPSHOT_URL).strip(),
+                interval=self.config.getfloat('camera', 'INTERVAL', fallback=2),
+                queue_size=self.config.getint('camera', 'QUEUE_SIZE', fallback=8),
+                trigger=self.config.get('camera', 'TRIGGER', fallback='interval').strip().lower(),
+                max_interval=self.config.getfloat('camera', 'MAX_INTERVAL', fallback=60),
+                markers=[marker.strip() for marker in markers.split(',') if marker.strip()],
+            )
+        self.camera_relay = None
+        if self.config.getboolean('camera_stream', 'ENABLED', fallback=True):
+            self.camera_relay = CameraRelay(
+                self,
+                snapshot_url=self.config.get('camera_stream', 'SNAPSHOT_URL',
+                                             fallback=self.config.get('camera', 'SNAPSHOT_URL', fallback=DEFAULT_SNAPSHOT_URL)).strip(),
+                max_fps=self.config.getfloat('camera_stream', 'MAX_FPS', fallback=5),
+                max_width=self.config.getint('camera_stream', 'MAX_WIDTH', fallback=1280),
+                max_height=self.config.getint('camera_stream', 'MAX_HEIGHT', fallback=720),
+                max_frame_bytes=self.config.getint('camera_stream', 'MAX_FRAME_KB', fallback=256) * 1024,
+                viewer_timeout=self.config.getint('camera_stream', 'VIEWER_TIMEOUT', fallback=30),
+            )
+
+        self.last_status = None
+        self.last_gcode_command = None
+
+        self.printer_connection_id = None
+        # Printers sharing a host keep their cache index and journal apart
+        self.state_dir = self.config['connection_settings'].get('STATE_DIR', f"/home/{self.username}/batch-link").strip()
+        suffix = f"-{self.name}" if self.name else ""
+        self.gcode_cache = GcodeCache(
+            os.path.join(self.state_dir, f"gcode-cache{suffix}.json"),
+            max_size_bytes=self.config.getint('gcode_cache', 'MAX_SIZE_MB', fallback=2048) * 1024 * 1024,
+            max_age_seconds=self.config.getint('gcode_cache', 'MAX_AGE_DAYS', fallback=14) * 24 * 3600,
+            enabled=self.config.getboolean('gcode_cache', 'ENABLED', fallback=True),
+        )
+        self.download_retries = self.config.getint('downloads', 'RETRIES', fallback=5)
+        self.download_parallel = self.config.getint('downloads', 'PARALLEL_RANGES', fallback=1)
+        self.download_parallel_min_part = self.config.getint('downloads', 'MIN_RANGE_MB', fallback=16) * 1024 * 1024
+        # Analyses are keyed by content hash, so printers sharing a state_dir share them too
+        self.gcode_analysis_enabled = self.config.getboolean('gcode_analysis', 'ENABLED', fallback=True)
+        self.gcode_metadata = GcodeMetadataStore(
+            os.path.join(self.state_dir, 'gcode-meta'),
+            max_files=self.config.getint('gcode_analysis', 'MAX_FILES', fallback=200),
+        )
+        self.file_metadata = None  # Analysis of the file being printed, and its layer and checkpoint index
+        self.last_transfer = None  # Size, compression and duration of the last print file download
+        self.file_index = None
+        self.eta = None
+        prefetch_mbps = self.config.getfloat('job_queue', 'PREFETCH_MAX_MBPS', fallback=2)
+        self.job_queue = JobQueue(
+            self,
+            os.path.join(self.state_dir, f"job-queue{suffix}.json"),
+            prefetch_count=self.config.getint('job_queue', 'PREFETCH', fallback=2),
+            max_rate=prefetch_mbps * 1024 * 1024 if prefetch_mbps > 0 else None,
+            enabled=self.config.getboolean('job_queue', 'ENABLED', fallback=True),
+        )
+        self.initialUpdatesValues()
+        self.update_interval = 2
+        self.alive_interval = 10
+
+        # Full-rate temperature samples, shipped in packed batches
+        sample_interval = self.config.getfloat('temperature_history', 'SAMPLE_INTERVAL', fallback=1)
+        self.temperature_history = TemperatureHistory(
+            capacity=int(self.config.getfloat('temperature_history', 'HOURS', fallback=24) * 3600 / sample_interval),
+            min_interval=sample_interval,
+        ) if self.config.getboolean('temperature_history', 'ENABLED', fallback=True) else None
+        self.temperature_upload_interval = self.config.getint('temperature_history', 'UPLOAD_INTERVAL', fallback=60)
+        self.temperature_sent_until = None  # Timestamp of the last sample the server received
+        
+        # Initialise Printer
+        if self.printerdriver == 'OCTOPRINT':
+            self.printer = Octoprint(self)
+        elif self.printerdriver == 'KLIPPER':
+            self.printer = Klipper(self)
+        else:
+            raise ValueError(f"Printer driver not defined in config")
+
+        self.outbound = link.outbound
+        self.journal = OfflineJournal(
+            os.path.join(self.state_dir, 'journal', self.name or ''),
+            max_bytes=self.config.getint('offline_journal', 'MAX_SIZE_KB', fallback=4096) * 1024,
+            enabled=self.config.getboolean('offline_journal', 'ENABLED', fallback=True),
+        )
+
+        if not all([link.remote_websocket_url, self.printer_url, self.uuid]):
+            raise ValueError("One or more configuration parameters are missing.")
+        link.add_printer(self)
+        self.metrics.add_collector(self.collect_metrics)
+
+    # ************* REMOTE *************** #
+    def queue_frame(self, msg, priority=PRIORITY_CONTROL, coalesce_key=None, merge=None, max_age=None):
+        """Queue a frame on the shared link, tagged with this printer's uuid when multiplexed"""
+        if self.link.multiplexed:
+            msg['uuid'] = self.uuid
+            if coalesce_key is not None:
+                coalesce_key = f"{self.uuid}:{coalesce_key}"
+        return self.outbound.put(msg, priority=priority, coalesce_key=coalesce_key, merge=merge, max_age=max_age)
+
+    async def on_remote_connected(self):
+        await self.replay_journal()
+        await self.send_printer_ready()
+        self.initialUpdatesValues()
+        self.full_update_requested = True
+
+    async def replay_journal(self):
+        """Send what was journaled during the outage, ahead of the fresh snapshot"""
+        if not self.journal.has_entries():
+            return
+        try:
+            await self.journal.flush()
+            loop = asyncio.get_running_loop()
+            frames = await loop.run_in_executor(None, self.journal.build_replay_frames)
+            for frame in frames:
+                if not self.queue_frame(frame, priority=PRIORITY_CONTROL):
+                    self.outbound.discard(frame)  # The journal is already cleared
+            logging.info(f"[JOURNAL] Replaying {sum(f['content']['records'] for f in frames)} journaled records")
+        except OSError as e:
+            logging.error(f"[JOURNAL] Failed to replay journal: {e}")
+
+    # ************* COMMANDS *************** #
+    def register_commands(self):
+        """
+        Dispatch table for remote actions. Emergency stop and the other safety
+        commands run on lanes of their own; bookkeeping survives an emergency stop.
+        """
+        executor = self.command_executor
+        executor.register('emergency_stop', 'emergency', self.handle_emergency_stop, preempt=True, substring=True)
+        executor.register('stop_print', 'safety', self.handle_stop_print)
+        executor.register('pause_print', 'safety', self.handle_pause_print)
+        executor.register('resume_print', 'control', self.handle_resume_print)
+        executor.register('connect', 'control', self.handle_connect, preemptible=False)
+        executor.register('cmd', 'control', self.handle_cmd)
+        executor.register('heat_printer', 'control', self.handle_heat_printer)
+        executor.register('cool_printer', 'control', self.handle_cool_printer)
+        executor.register('move', 'control', self.handle_move, substring=True)
+        executor.register('resync', 'control', self.handle_resync, preemptible=False)
+        executor.register('retry_after', 'control', self.handle_retry_after, preemptible=False)
+        executor.register('reboot_system', 'control', self.handle_reboot_system)
+        executor.register('temperature_history', 'control', self.handle_temperature_history, preemptible=False)
+        executor.register('camera_stream', 'control', self.handle_camera_stream, preemptible=False)
+        executor.register('print', 'transfer', self.handle_print)
+        executor.register('enqueue_print', 'control', self.handle_enqueue_print, preemptible=False)
+        executor.register('dequeue_print', 'control', self.handle_dequeue_print, preemptible=False)
+        executor.register('bed_cleared', 'control', self.handle_bed_cleared, preemptible=False)
+
+    def on_command_complete(self, action, lane, wait_time, exec_time, outcome):
+        # Re-poll straight away so the result of the command shows up quickly
+        self.poll_scheduler.wake()
+        self.metrics.command_time.observe(exec_time, printer=self.metrics_label, action=action, lane=lane)
+        self.metrics.commands.inc(printer=self.metrics_label, action=action, outcome=outcome)
+        if outcome == 'error':
+            self.record_error('command')
+
+    # ************* METRICS *************** #
+    def observe_poll(self, endpoint, seconds):
+        self.metrics.poll_latency.observe(seconds, printer=self.metrics_label, driver=self.printerdriver, endpoint=endpoint)
+
+    def observe_transfer(self, size_bytes, seconds, wire_bytes=None, encoding=None):
+        """size_bytes is the file as printed, wire_bytes what was downloaded for it if compressed"""
+        wire_bytes = wire_bytes or size_bytes
+        if seconds > 0:
+            self.metrics.transfer_throughput.observe(
+                size_bytes / seconds / 1024 / 1024, printer=self.metrics_label, driver=self.printerdriver
+            )
+        ratio = size_bytes / wire_bytes if wire_bytes else 1.0
+        self.metrics.transfer_compression.set(ratio, printer=self.metrics_label)
+        if encoding:
+            logging.info(f"[TRANSFER] {encoding} download: {wire_bytes / (1024 * 1024):.1f}MB on the wire, "
+                         f"{size_bytes / (1024 * 1024):.1f}MB of G-code ({ratio:.1f}x)")
+        self.last_transfer = {
+            'bytes': size_bytes,
+            'wire_bytes': wire_bytes,
+            'encoding': encoding,
+            'compression_ratio': round(ratio, 2),
+            'seconds': round(seconds, 2),
+        }
+        self.updates['last_transfer'] = self.last_transfer
+        self.update_data_changed = True
+
+    def record_error(self, source):
+        self.metrics.errors.inc(printer=self.metrics_label, driver=self.printerdriver, source=source)
+
+    def collect_metrics(self):
+        if self.printerdriver == 'OCTOPRINT':
+            connection, backoff = 'push_api', self.printer.push_backoff
+        else:
+            connection, backoff = 'moonraker_websocket', self.printer.websocket_backoff
+        self.metrics.reconnects.set(backoff.reconnects, printer=self.metrics_label, connection=connection)
+        if self.camera:
+            for result, count in self.camera.stats().items():
+                self.metrics.camera_frames.set(count, printer=self.metrics_label, result=result)
+        if self.camera_relay:
+            for result, count in self.camera_relay.stats().items():
+                self.metrics.camera_frames.set(count, printer=self.metrics_label, result=result)
+
+    async def handle_print(self, action, content):
+        logging.info(f"File name to print: {content['file_name']}")
+        await self.start_print(content['file_name'], content['url'], content.get('hash'))
+
+    async def start_print(self, filename, url, file_hash=None, cache_key=None):
+        await self.send_printer_busy()
+        self.job_queue.yield_to(filename)
+        # Non-blocking: let print_file run in background
+        if self.current_print_task and not self.current_print_task.done():
+            self.current_print_task.cancel()
+        self.current_print_task = asyncio.create_task(self.printer.print_file(filename, url, file_hash, cache_key=cache_key))
+        self.current_print_task.add_done_callback(lambda _: self.poll_scheduler.wake())
+
+    async def handle_enqueue_print(self, action, content):
+        """Queue content['file_name'] from content['url'], optionally with an id, hash and position"""
+        if not self.job_queue.enabled:
+            logging.warning('Received enqueue_print but the job queue is disabled')
+            return
+        self.job_queue.enqueue(content['file_name'], content['url'], content.get('hash'),
+                               job_id=content.get('id'), position=content.get('position'))
+
+    async def handle_dequeue_print(self, action, content):
+        """Drop the queued job content['id'], or every queued job without one"""
+        content = content if isinstance(content, dict) else {}
+        self.job_queue.remove(content.get('id'))
+
+    async def handle_bed_cleared(self, action, content):
+        self.job_queue.mark_bed_cleared()
+
+    async def handle_stop_print(self, action, content):
+        logging.info('Received stop print command for URL')
+        await self.send_printer_busy()
+        if self.current_print_task and not self.current_print_task.done():
+            self.current_print_task.cancel()
+        await self.printer.stop_print()
+
+    async def handle_connect(self, action, content):
+        logging.info('Received reconnect command for URL')
+        await self.printer.reconnect_printer()
+
+    async def handle_pause_print(self, action, content):
+        logging.info('Received pause print command for URL')
+        await self.printer.pause_print()
+
+    async def handle_resume_print(self, action, content):
+        logging.info('Received resume print command for URL')
+        await self.printer.resume_print()
+
+    async def handle_cmd(self, action, content):
+        logging.info('Received command to execute')
+        await self.send_printer_busy()
+        if self.current_command_task and not self.current_command_task.done():
+            self.current_command_task.cancel()
+        self.current_command_task = asyncio.create_task(self.printer.send_command(content))
+        self.current_command_task.add_done_callback(lambda _: self.poll_scheduler.wake())
+
+    async def handle_heat_printer(self, action, content):
+        logging.info('Receive heating command')
+        await self.printer.set_temperatures(215, 60)
+
+    async def handle_cool_printer(self, action, content):
+        logging.info('Receive cooling command')
+        await self.printer.set_temperatures(0, 0)
+
+    async def handle_move(self, action, content):
+        logging.info("ACTION")
+        x, y, z = parse_move_command(action)
+        await self.printer.move_extruder(x, y, z)
+
+    async def handle_resync(self, action, content):
+        logging.info('Received resync request, sending full update')
+        self.full_update_requested = True
+        self.update_data_changed = True
+
+    async def handle_retry_after(self, action, content):
+        logging.info(f'Server asked to retry after {content} seconds on the next reconnect')
+        self.link.backoff.set_retry_after(content.get('seconds') if isinstance(content, dict) else content)
+
+    async def handle_temperature_history(self, action, content):
+        """Send the history since content['since'], downsampled into content['buckets'] if given"""
+        content = content if isinstance(content, dict) else {}
+        if self.temperature_history is None:
+            series = None
+        elif content.get('buckets'):
+            series = self.temperature_history.downsample(int(content['buckets']), since=content.get('since'), until=content.get('until'))
+        else:
+            series = self.temperature_history.pack(since=content.get('since'))
+        msg = {'action': 'temperature_history', 'content': series}
+        if not self.queue_frame(msg, priority=PRIORITY_BULK):
+            self.outbound.discard(msg)
+
+    async def handle_camera_stream(self, action, content):
+        """Subscribe, renew or (with stop) end content['viewer']'s live camera stream"""
+        content = content if isinstance(content, dict) else {}
+        if self.camera_relay is None:
+            logging.warning('Received camera_stream but camera streaming is disabled')
+            return
+        viewer = content.get('viewer', 'default')
+        if content.get('stop'):
+            self.camera_relay.unsubscribe(viewer)
+        else:
+            self.camera_relay.subscribe(viewer, fps=content.get('fps'), width=content.get('max_width'), height=content.get('max_height'))
+
+    async def handle_reboot_system(self, action, content):
+        logging.info('Received reboot command')
+        asyncio.create_task(self.reboot_system())
+
+    async def handle_emergency_stop(self, action, content):
+        logging.info('Received emergency stop command')
+        # The print and command handlers return once their task is spawned, so
+        # preempting them is not enough: a finishing download would still start the print
+        for task in (self.current_print_task, self.current_command_task, self.job_queue.prefetch_task):
+            if task and not task.done():
+                task.cancel()
+        await self.printer.emergency_stop()
+
+    # **** SHUTDOWN **** #
+    async def shutdown(self):
+        """Cancel in-flight work and close the printer sessions"""
+        logging.info("Shutting down batch-link")
+        for task in (self.current_print_task, self.current_command_task):
+            if task and not task.done():
+                task.cancel()
+        if self.camera_relay:
+            await self.camera_relay.close()
+        await self.job_queue.close()
+        await self.journal.flush()
+        await self.printer.close()
+
     # **** REBOOT SYSTEM **** #
     async def reboot_system(self):
         try:
@@ -198,6 +593,7 @@ class BatchPrinterConnect:
             
             await asyncio.sleep(self.update_interval)
             await self.send_printer_ready()
+            await self.outbound.drain(timeout=5)
             result = os.system('sudo /sbin/shutdown -r now')
             
             if result == 0:
@@ -209,6 +605,80 @@ class BatchPrinterConnect:
             logging.error(f"Failed to execute reboot: {e}")
 
     
+    def record_temperatures(self, nozzle, nozzle_target, bed, bed_target, timestamp=None):
+        if self.temperature_history is not None:
+            self.temperature_history.record(timestamp or time.time(), nozzle, nozzle_target, bed, bed_target)
+
+    def on_layer_change(self, layer=None):
+        if self.camera:
+            self.camera.on_layer_change(layer)
+
+    def on_gcode(self, line):
+        """A G-code line sent to or reported by the printer"""
+        if self.camera:
+            self.camera.on_gcode(line)
+
+    # ************* G-CODE ANALYSIS *************** #
+    def new_gcode_analysis(self):
+        """A streaming analysis for the driver to feed a transfer into, or None if analysis is off"""
+        return StreamingAnalysis() if self.gcode_analysis_enabled else None
+
+    async def _resolve_file_analysis(self, cache_key, analysis=None, local_path=None):
+        """
+        The analysis of the file cached under cache_key: the streaming analysis
+        of its transfer if it kept up, else the one stored for its content
+        hash, else a fresh pass over local_path. Stored for later, or None.
+        """
+        loop = asyncio.get_running_loop()
+        entry = self.gcode_cache.lookup(cache_key) or {}
+        try:
+            result = await analysis.result(entry.get('size')) if analysis else None
+            if result is None:
+                result = await loop.run_in_executor(None, self.gcode_metadata.load, entry.get('sha256'))
+            if result is None and local_path:
+                logging.info(f"[ANALYZER] No analysis of {local_path} yet, reading it back")
+                result = await loop.run_in_executor(None, analyze_file, local_path)
+            if result is None:
+                logging.info("[ANALYZER] No analysis available for this file")
+                return None
+            await loop.run_in_executor(None, self.gcode_metadata.save, *result)
+        except OSError as e:
+            logging.error(f"[ANALYZER] Failed to analyze {local_path or cache_key}: {e}")
+            return None
+        self.gcode_cache.set_content_hash(cache_key, result[0]['sha256'])
+        return result
+
+    async def store_file_analysis(self, cache_key, analysis=None):
+        """Keep the analysis of a prefetched file for when it is printed, without publishing it"""
+        if self.gcode_analysis_enabled:
+            await self._resolve_file_analysis(cache_key, analysis)
+
+    async def publish_file_analysis(self, cache_key, analysis=None, local_path=None):
+        """Publish the analysis of the file cached under cache_key, see _resolve_file_analysis"""
+        if not self.gcode_analysis_enabled:
+            return
+        result = await self._resolve_file_analysis(cache_key, analysis, local_path)
+        self.set_file_analysis(*(result or (None, None)))
+
+    def set_file_analysis(self, metadata, index):
+        self.file_metadata = metadata
+        self.file_index = index
+        self.eta = EtaEstimator(metadata, index) if metadata and index['checkpoints'] else None
+        self.updates['file_metadata'] = metadata
+        self.update_data_changed = True
+        if metadata:
+            logging.info(f"[ANALYZER] {metadata['layers']} layers, {metadata['filament_mm'] / 1000:.2f}m of filament, "
+                         f"slicer estimate {metadata['slicer'].get('estimated_time')}s")
+
+    def estimate_progress(self, file_position, file_size, elapsed):
+        """
+        ETA, layer and filament left from the printer's position in the file,
+        or None when the file being printed is not the one analyzed
+        """
+        if self.eta is None or file_position is None or not self.eta.matches(file_size):
+            return None
+        return self.eta.update(file_position, elapsed)
+
     def get_current_gcode_command(self):
         if self.last_gcode_command:
             return self.last_gcode_command
@@ -238,16 +708,67 @@ class BatchPrinterConnect:
             'progress': None,
             'print_time': None,
             'print_time_left': None,
+            'eta': None,
             'uploading_file_progress': None,
+            'downloading_file_progress': None,
             'terminal_output': None,
+            'gcode_cache': self.gcode_cache.stats(),
+            'file_metadata': self.file_metadata,
+            'last_transfer': self.last_transfer,
+            'job_queue': self.job_queue.state(),
         }
 
         self.update_data_changed = True
 
+    def build_printer_update(self):
+        """
+        Build the next printer update frame.
+
+        Every frame carries a monotonically increasing seq. A full snapshot is
+        sent on connect, on a server resync request, every full_update_interval
+        seconds, or always when DELTA_UPDATES is off. Otherwise only the keys
+        that changed since the last frame are sent, along with the base_seq they
+        apply to. Returns None when a delta would be empty.
+        """
+        now = time.time()
+        snapshot = copy.deepcopy(self.updates)
+        send_full = (
+            not self.delta_updates
+            or self.full_update_requested
+            or self.last_sent_updates is None
+            or now - self.last_full_update_time >= self.full_update_interval
+        )
+
+        if send_full:
+            msg = {
+                'action': 'printer_update',
+                'seq': self.update_seq + 1,
+                'content': snapshot
+            }
+            self.full_update_requested = False
+            self.last_full_update_time = now
+        else:
+            changes = {
+                key: value for key, value in snapshot.items()
+                if key not in self.last_sent_updates or self.last_sent_updates[key] != value
+            }
+            if not changes:
+                return None
+            msg = {
+                'action': 'printer_update_delta',
+                'seq': self.update_seq + 1,
+                'base_seq': self.update_seq,
+                'content': changes
+            }
+
+        self.update_seq += 1
+        self.last_sent_updates = snapshot
+        return msg
+
     async def send_printer_update(self):
         last_sent_time = time.time()
         while True:
-            logging.info(f"[UPDATE] Called")
+            logging.debug(f"[UPDATE] Called")
             try:
                 time_since_last = time.time() - last_sent_time
                 if any(value is not None for value in self.updates.values()):
@@ -255,27 +776,32 @@ class BatchPrinterConnect:
                         await asyncio.sleep(self.update_interval)
                         continue
                     
-                    # Check websocket and send atomically to avoid race condition
-                    websocket = self.remote_websocket
-                    if websocket is not None:
-                        logging.info(f"[UPDATE] Sending update, printer status: {self.updates['status']}")
-                        msg = {
-                            'action': 'printer_update',
-                            'content': self.updates
-                        }
-                        serialised_json = json.dumps(msg)
+                    if self.metrics_in_updates:
+                        # Rides along with real changes, never triggers an update by itself
+                        self.updates['metrics'] = self.metrics.summary(self.metrics_label)
+                    if self.outbound.connected:
+                        msg = self.build_printer_update()
+                        if msg is not None:
+                            logging.info(f"[UPDATE] Queueing {msg['action']} #{msg['seq']}, printer status: {self.updates['status']}")
+                            self.queue_frame(
+                                msg,
+                                priority=PRIORITY_UPDATE,
+                                coalesce_key='printer_update',
+                                merge=merge_printer_updates
+                            )
+                            self.updates['cancelled'] = None
+                            self.updates['uploading_file_progress'] = self.uploading_file_progress
+                            self.updates['downloading_file_progress'] = self.downloading_file_progress
+                    else:
+                        # Keep a timeline of the outage to replay once reconnected
+                        self.journal.record_update(self.updates)
                         self.updates['cancelled'] = None
-                        self.updates['uploading_file_progress'] = self.uploading_file_progress
-                        await websocket.send(serialised_json)
 
                     self.update_data_changed = False
                     last_sent_time = time.time()
                 else:
                     logging.warning(f"[UPDATE] Either the websocket isnt initialised or a value is None")
 
-            except websockets.exceptions.ConnectionClosed as e:
-                logging.info(f"[UPDATE] Websocket error, connection closed: {e}")
-                self.remote_websocket = None
             except Exception as e:
                 logging.info(f"[PRINTER-UPDATE] Error: {e}")
             
@@ -284,84 +810,126 @@ class BatchPrinterConnect:
     async def send_printer_alive(self):
         while True:
             logging.info(f"[VERSION] {self.version}")
-            logging.info(f"[ALIVE] Called")
+            logging.debug(f"[ALIVE] Called")
+            logging.info(f"[OUTBOUND] {self.outbound.stats()}")
             try:
-                # Check websocket and send atomically to avoid race condition
-                websocket = self.remote_websocket
-                if websocket is not None:
+                if self.outbound.connected:
                     msg = {
                             'action': 'printer_alive',
                             'content': {} 
                     }
-                    serialised_json = json.dumps(msg)
                     logging.info(f"[ALIVE] Sending")
-                    await websocket.send(serialised_json)
+                    # A heartbeat that waited longer than one interval is worthless
+                    self.queue_frame(msg, priority=PRIORITY_ALIVE, coalesce_key='printer_alive', max_age=self.alive_interval)
                 else:
                     logging.warning(f"[ALIVE] Either the websocket isnt initialised or a value is None")
 
-            except websockets.exceptions.ConnectionClosed as e:
-                logging.info(f"[ALIVE] Websocket error, connection closed: {e}")
-                self.remote_websocket = None
             except Exception as e:
                 logging.info(f"[ALIVE] Error: {e}")
 
             await asyncio.sleep(self.alive_interval)
     
-    async def send_printer_busy(self):
-        websocket = self.remote_websocket
-        if websocket is not None:
+    async def send_temperature_history(self):
+        """Ship new temperature samples in packed batches, catching up after an outage"""
+        if self.temperature_history is None:
+            return
+        while True:
+            await asyncio.sleep(self.temperature_upload_interval)
             try:
-                msg = {
-                    'action': 'printer_busy',
-                    'content': {}
-                }
-                await websocket.send(json.dumps(msg))
-                logging.info('Sent printer_busy update')
+                while self.outbound.connected:
+                    batch = self.temperature_history.pack(since=self.temperature_sent_until, limit=3600)
+                    if batch is None or not self.queue_frame({'action': 'temperature_history', 'content': batch}, priority=PRIORITY_BULK):
+                        break
+                    self.temperature_sent_until = batch['until']
+                    if not batch['remaining']:
+                        break
             except Exception as e:
-                logging.warning(f"Failed to send printer_busy: {e}")
+                logging.error(f"[TEMPERATURE] Error: {e}")
+
+    def send_event(self, msg):
+        """Queue a state transition frame, or journal it while disconnected"""
+        if self.queue_frame(msg, priority=PRIORITY_CONTROL):
+            logging.info(f"Queued {msg['action']} update")
         else:
-            logging.warning("WebSocket not connected — cannot send printer_busy")
-    
+            self.journal.record_event(msg)
+
+    async def send_printer_busy(self):
+        msg = {
+            'action': 'printer_busy',
+            'content': {}
+        }
+        self.send_event(msg)
+
     async def send_printer_ready(self):
-        websocket = self.remote_websocket
-        if websocket is not None:
-            try:
-                msg = {
-                    'action': 'printer_ready',
-                    'content': {}
-                }
-                await websocket.send(json.dumps(msg))
-                logging.info('Sent printer_ready update')
-            except Exception as e:
-                logging.warning(f"Failed to send printer_ready: {e}")
-        else:
-            logging.warning("WebSocket not connected — cannot send printer_ready")
+        msg = {
+            'action': 'printer_ready',
+            'content': {}
+        }
+        self.send_event(msg)
 
 
 
 def main():
-    communicator = BatchPrinterConnect()
-    loop = asyncio.get_event_loop()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    config_file_path = os.environ.get('BATCH_LINK_CONFIG') or CONFIG_FILE_PATH.format(username=os.environ.get('USER'))
+    config = configparser.ConfigParser()
+    config.read(config_file_path)
+    if not config.sections():
+        raise FileNotFoundError(f"Configuration file not found at {config_file_path}")
 
-    for sig in (signal.SIGINT, signal.SIGTERM):
-        loop.add_signal_handler(sig, loop.stop)
+    # Every printer shares one HTTP pool and one remote websocket
+    printer_configs = load_printer_configs(config)
+    http_pool = HttpPool()
+    metrics = Metrics()
+    link = RemoteLink(config, metrics, multiplexed=printer_configs[0][0] is not None)
+    printers = [BatchPrinterConnect(printer_config, link, http_pool, name) for name, printer_config in printer_configs]
+    logging.info(f"Serving {len(printers)} printer(s): {', '.join(p.name or p.uuid for p in printers)}")
+    loop = asyncio.get_event_loop()
 
     try:
         # Build list of tasks to run
         task_list = [
-            communicator.remote_connection(),
-            communicator.printer.printer_connection(),
-            communicator.send_printer_update(),
-            communicator.send_printer_alive(),
+            link.remote_connection(),
+            link.outbound.run(),
         ]
-        
-        # Add OctoPrint-specific push API listener if using OctoPrint
-        if communicator.printerdriver == 'OCTOPRINT':
-            task_list.append(communicator.printer.listen_to_printer_push_api())
+        if config.getboolean('metrics', 'ENABLED', fallback=True):
+            task_list.append(metrics.serve(
+                config.get('metrics', 'HOST', fallback='127.0.0.1').strip(),
+                config.getint('metrics', 'PORT', fallback=9101)
+            ))
+        for communicator in printers:
+            task_list += [
+                communicator.printer.printer_connection(),
+                communicator.send_printer_update(),
+                communicator.send_printer_alive(),
+                communicator.send_temperature_history(),
+                communicator.command_executor.run(),
+                communicator.job_queue.run(),
+            ]
+            if communicator.camera:
+                task_list.append(communicator.camera.run())
+            # Add OctoPrint-specific push API listener if using OctoPrint
+            if communicator.printerdriver == 'OCTOPRINT':
+                task_list.append(communicator.printer.listen_to_printer_push_api())
+            # Add Moonraker websocket subscription if using Klipper
+            elif communicator.printerdriver == 'KLIPPER':
+                task_list.append(communicator.printer.listen_to_moonraker_websocket())
         
         tasks = asyncio.gather(*task_list)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, tasks.cancel)
         loop.run_until_complete(tasks)
+    except asyncio.CancelledError:
+        logging.info("Received shutdown signal")
     finally:
+        for communicator in printers:
+            loop.run_until_complete(communicator.shutdown())
+        loop.run_until_complete(http_pool.close())
+        # Let websockets and other helpers finish closing before the loop goes away
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
         loop.close()
 
 
@@ -2,191 +2,371 @@ import logging
 import os
 import time
 import asyncio
-import aiohttp  # <-- Use aiohttp
-import io
+import aiohttp
 import json
+import websockets
 from utils.helpers import parse_move_command, has_significant_difference
-# websockets is not used in this file, so it can be removed if not needed elsewhere.
+from utils.transfer import download_to_file, probe_etag, strip_compression_suffix
+from utils.http_pool import REQUEST_TIMEOUTS
+from utils.backoff import Backoff
 
 class Klipper:
+    SUBSCRIBED_OBJECTS = ('extruder', 'heater_bed', 'print_stats', 'virtual_sdcard')
+
     def __init__(self, parent):
         # Corrected typo: __init__ instead of __init_
         # Corrected typo: self.parent = parent
         self.parent = parent
+        self.websocket_enabled = self.parent.config['connection_settings'].getboolean('KLIPPER_WEBSOCKET', fallback=True)
+        self.websocket_connected = False  # True while Moonraker pushes status updates
+        self.printer_objects = {}  # Last known state of the subscribed printer objects
+        self.current_layer = None  # From print_stats.info, set by slicers or SET_PRINT_STATS_INFO
+        self._rpc_id = 0
+        self.websocket_backoff = Backoff(base=1, cap=60)  # Reconnect delays for the Moonraker websocket
+        self.session: aiohttp.ClientSession | None = None  # Pooled HTTP session for all Moonraker requests
+
+    async def _ensure_session(self) -> aiohttp.ClientSession:
+        """
+        Lazily create one keep-alive session on the shared connection pool.
+        """
+        if self.session is None or self.session.closed:
+            self.session = self.parent.http_pool.session()
+        return self.session
+
+    async def close(self):
+        """
+        Cleanly close the HTTP session when shutting down.
+        """
+        if self.session and not self.session.closed:
+            await self.session.close()
 
     async def printer_connection(self):
-        # Create a single session that is reused for all requests in this loop
-        async with aiohttp.ClientSession() as session:
-            while True:
-                try:
-                    logging.info("[KLIPPER] Pulling data from Moonraker")
-                    # Perform GET request for printer status
-                    url = f"{self.parent.printer_url}/printer/objects/query?extruder&heater_bed&print_stats&virtual_sdcard"
-                    async with session.get(url, timeout=10) as response:
-                        response.raise_for_status()
-                        printer_data = await response.json()
-
-                    result = printer_data.get('result', {})
-                    status = result.get('status', {})
-
-                    temp_updates = {}
-
-                    extruder = status.get('extruder', {})
-                    temp_updates['nozzle_temperature'] = extruder.get('temperature', 0.0)
-                    temp_updates['nozzle_temperature_target'] = extruder.get('target', 0.0)
-
-                    heater_bed = status.get('heater_bed', {})
-                    temp_updates['bed_temperature'] = heater_bed.get('temperature', 0.0)
-                    temp_updates['bed_temperature_target'] = heater_bed.get('target', 0.0)
-
-                    print_stats = status.get('print_stats', {})
-                    virtual_sdcard = status.get('virtual_sdcard', {})
-
-                    klipper_state = print_stats.get('state', '').lower()
-
-                    state_map = {
-                        'printing': ('printing', 'Printing'),
-                        'paused': ('paused', 'Paused'),
-                        'complete': ('complete', 'Complete'),
-                        'standby': ('operational', 'Operational'),
-                        'error': ('error', 'Error'),
-                    }
-                    temp_updates['status'], temp_updates['job_state'] = state_map.get(klipper_state, (klipper_state, klipper_state.capitalize()))
-
-                    temp_updates['file_name'] = print_stats.get('filename')
-                    temp_updates['progress'] = virtual_sdcard.get('progress', 0.0) * 100
-                    temp_updates['print_time'] = print_stats.get('print_duration', 0.0)
-
-                    if temp_updates['progress'] > 0 and temp_updates['print_time'] > 0:
-                        time_left = (temp_updates['print_time'] / temp_updates['progress']) * (100 - temp_updates['progress'])
-                        temp_updates['print_time_left'] = time_left
-                    else:
-                        temp_updates['print_time_left'] = 0.0
-
-                    update_needed = False
-                    for key, new_value in temp_updates.items():
-                        old_value = self.parent.updates.get(key)
-                        if has_significant_difference(key, old_value, new_value):
-                            self.parent.updates[key] = new_value
-                            update_needed = True
-
-                    if update_needed:
-                        self.parent.update_data_changed = True
-                        logging.info(f"Update data changed flagged as True")
-
-                    logging.info(f"Got data from API, printer status is: {temp_updates['status']}")
-
-                except aiohttp.ClientResponseError as e:
-                    if e.status == 409:
-                        logging.warning("409 Conflict Error: Printer is busy or disconnected. Retrying in 10 seconds.")
-                        self.parent.updates['status'] = 'error'
-                        self.parent.update_data_changed = True
-                        await self.reconnect_printer()
-                        await asyncio.sleep(10)
-                        continue
-                    else:
-                        logging.error(f"HTTP Error: {e.status} - {e.message}")
-                except Exception as e:
+        session = await self._ensure_session()
+        while True:
+            if self.websocket_connected:
+                # Moonraker is pushing status updates, no need to poll
+                await self.parent.poll_scheduler.wait(self.parent.updates)
+                continue
+            try:
+                logging.info("[KLIPPER] Pulling data from Moonraker")
+                # Perform GET request for printer status
+                url = f"{self.parent.printer_url}/printer/objects/query?extruder&heater_bed&print_stats&virtual_sdcard"
+                start = time.monotonic()
+                async with session.get(url, timeout=REQUEST_TIMEOUTS['status']) as response:
+                    response.raise_for_status()
+                    printer_data = await response.json()
+                self.parent.observe_poll('objects', time.monotonic() - start)
+
+                result = printer_data.get('result', {})
+                status = result.get('status', {})
+                printer_status = self._apply_status(status)
+                logging.info(f"Got data from API, printer status is: {printer_status}")
+
+            except aiohttp.ClientResponseError as e:
+                if e.status == 409:
+                    logging.warning("409 Conflict Error: Printer is busy or disconnected. Retrying in 10 seconds.")
                     self.parent.updates['status'] = 'error'
                     self.parent.update_data_changed = True
-                    logging.error("Error connecting to Moonraker: %s", e)
-
-                await asyncio.sleep(self.parent.reconnect_interval)
+                    await self.reconnect_printer()
+                    await asyncio.sleep(10)
+                    continue
+                else:
+                    self.parent.record_error('poll')
+                    logging.error(f"HTTP Error: {e.status} - {e.message}")
+            except Exception as e:
+                self.parent.updates['status'] = 'error'
+                self.parent.update_data_changed = True
+                self.parent.record_error('poll')
+                logging.error("Error connecting to Moonraker: %s", e)
+
+            await self.parent.poll_scheduler.wait(self.parent.updates)
+
+    def _apply_status(self, status):
+        """Map a Moonraker printer objects status into parent.updates."""
+        temp_updates = {}
+
+        extruder = status.get('extruder', {})
+        temp_updates['nozzle_temperature'] = extruder.get('temperature', 0.0)
+        temp_updates['nozzle_temperature_target'] = extruder.get('target', 0.0)
+
+        heater_bed = status.get('heater_bed', {})
+        temp_updates['bed_temperature'] = heater_bed.get('temperature', 0.0)
+        temp_updates['bed_temperature_target'] = heater_bed.get('target', 0.0)
+
+        # Every sample goes into the history, before the update deadband filters it
+        self.parent.record_temperatures(
+            temp_updates['nozzle_temperature'], temp_updates['nozzle_temperature_target'],
+            temp_updates['bed_temperature'], temp_updates['bed_temperature_target']
+        )
+
+        print_stats = status.get('print_stats', {})
+        virtual_sdcard = status.get('virtual_sdcard', {})
+
+        klipper_state = print_stats.get('state', '').lower()
+
+        state_map = {
+            'printing': ('printing', 'Printing'),
+            'paused': ('paused', 'Paused'),
+            'complete': ('complete', 'Complete'),
+            'standby': ('operational', 'Operational'),
+            'error': ('error', 'Error'),
+        }
+        temp_updates['status'], temp_updates['job_state'] = state_map.get(klipper_state, (klipper_state, klipper_state.capitalize()))
+
+        current_layer = (print_stats.get('info') or {}).get('current_layer')
+        if current_layer is not None and current_layer != self.current_layer:
+            self.current_layer = current_layer
+            self.parent.on_layer_change(current_layer)
+
+        temp_updates['file_name'] = print_stats.get('filename')
+        temp_updates['progress'] = virtual_sdcard.get('progress', 0.0) * 100
+        temp_updates['print_time'] = print_stats.get('print_duration', 0.0)
+
+        eta = self.parent.estimate_progress(
+            virtual_sdcard.get('file_position'), virtual_sdcard.get('file_size'), temp_updates['print_time']
+        )
+        if eta is not None:
+            if self.current_layer is not None:
+                eta['current_layer'] = self.current_layer  # Reported by the slicer, more reliable than the index
+            temp_updates['print_time_left'] = eta['print_time_left']
+        elif temp_updates['progress'] > 0 and temp_updates['print_time'] > 0:
+            # Without an analysis of the file, extrapolate linearly
+            time_left = (temp_updates['print_time'] / temp_updates['progress']) * (100 - temp_updates['progress'])
+            temp_updates['print_time_left'] = time_left
+        else:
+            temp_updates['print_time_left'] = 0.0
+        temp_updates['eta'] = eta
+
+        update_needed = False
+        for key, new_value in temp_updates.items():
+            old_value = self.parent.updates.get(key)
+            if has_significant_difference(key, old_value, new_value):
+                self.parent.updates[key] = new_value
+                update_needed = True
+
+        if update_needed:
+            self.parent.update_data_changed = True
+            logging.info(f"Update data changed flagged as True")
+
+        return temp_updates['status']
+
+    async def listen_to_moonraker_websocket(self):
+        """Subscribe to Moonraker status notifications over its JSON-RPC websocket.
+
+        While the socket is up, notify_status_update deltas are applied straight
+        into parent.updates and printer_connection stops polling. When the socket
+        drops, polling takes over again until the subscription is re-established.
+        """
+        if not self.websocket_enabled:
+            logging.info("[KLIPPER-WS] Websocket subscriptions disabled, using polling only")
+            return
+
+        ws_url = self.parent.printer_url.replace('http', 'ws', 1) + "/websocket"
+        while True:
+            try:
+                async with websockets.connect(ws_url, ping_interval=20, ping_timeout=20) as ws:
+                    logging.info(f"[KLIPPER-WS] Connected to Moonraker at {ws_url}")
+                    self.websocket_backoff.on_connected()
+                    self._rpc_id += 1
+                    subscribe_id = self._rpc_id
+                    subscribe_msg = {
+                        "jsonrpc": "2.0",
+                        "method": "printer.objects.subscribe",
+                        "params": {"objects": {name: None for name in self.SUBSCRIBED_OBJECTS}},
+                        "id": subscribe_id,
+                    }
+                    await ws.send(json.dumps(subscribe_msg))
+
+                    async for raw in ws:
+                        try:
+                            msg = json.loads(raw)
+                        except json.JSONDecodeError:
+                            logging.warning(f"[KLIPPER-WS] Unhandled frame: {raw!r}")
+                            continue
+
+                        if msg.get('id') == subscribe_id:
+                            if 'error' in msg:
+                                raise RuntimeError(f"Subscription failed: {msg['error']}")
+                            self.printer_objects = msg.get('result', {}).get('status', {})
+                            self.websocket_connected = True
+                            logging.info("[KLIPPER-WS] Subscribed to printer objects, polling paused")
+                            self._apply_status(self.printer_objects)
+                            continue
+
+                        method = msg.get('method')
+                        if method == 'notify_status_update' and self.websocket_connected:
+                            delta = msg.get('params', [{}])[0]
+                            for name, fields in delta.items():
+                                self.printer_objects.setdefault(name, {}).update(fields)
+                            self._apply_status(self.printer_objects)
+                        elif method == 'notify_gcode_response':
+                            # Console output, e.g. a timelapse macro's RESPOND marker
+                            for line in msg.get('params', []):
+                                self.parent.on_gcode(line)
+                        elif method in ('notify_klippy_disconnected', 'notify_klippy_shutdown'):
+                            logging.warning(f"[KLIPPER-WS] {method}, falling back to polling")
+                            break
+
+            except Exception as e:
+                self.parent.record_error('printer_websocket')
+                logging.error(f"[KLIPPER-WS] Connection error: {e}")
+            finally:
+                self.websocket_connected = False
+                self.printer_objects = {}
+                self.websocket_backoff.on_disconnected()
+
+            delay = self.websocket_backoff.next_delay()
+            logging.info("[KLIPPER-WS] Reconnecting to Moonraker websocket in %.1f seconds", delay)
+            await asyncio.sleep(delay)
 
     async def send_command(self, command):
         payload = {"script": command}
         url = f"{self.parent.printer_url}/printer/gcode/script"
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload) as response:
-                    response.raise_for_status()
-                    logging.info("Command executed successfully: %s", command)
-                    await self.parent.send_printer_ready()
-        except aiohttp.ClientError as e:
+            session = await self._ensure_session()
+            async with session.post(url, json=payload, timeout=REQUEST_TIMEOUTS['gcode']) as response:
+                response.raise_for_status()
+                logging.info("Command executed successfully: %s", command)
+                await self.parent.send_printer_ready()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logging.error("Error executing command: %s", e)
+            await self.parent.send_printer_ready()
 
     async def emergency_stop(self):
         url = f"{self.parent.printer_url}/printer/emergency_stop"
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json={}, timeout=15) as response:
-                    response.raise_for_status()
-                    logging.info("Emergency stop executed via Moonraker")
-                    await self.parent.send_printer_ready()
-        except aiohttp.ClientError as e:
+            session = await self._ensure_session()
+            async with session.post(url, json={}, timeout=REQUEST_TIMEOUTS['emergency']) as response:
+                response.raise_for_status()
+                logging.info("Emergency stop executed via Moonraker")
+                await self.parent.send_printer_ready()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logging.error("Error executing emergency stop: %s", e)
             await self.parent.send_printer_ready()
             
-    def _save_file_to_disk(self, file_content, file_path):
-        """Synchronous helper to run blocking disk I/O in an executor."""
-        logging.info(f"Saving file to {file_path}")
-        with open(file_path, 'wb') as f:
-            f.write(file_content)
-        logging.info(f"File saved successfully.")
-
-    async def print_file(self, filename, url):
+    def _on_download_progress(self, bytes_downloaded, total_size):
+        if total_size > 0:
+            self.parent.uploading_file_progress = (bytes_downloaded / total_size) * 100
+            self.parent.downloading_file_progress = self.parent.uploading_file_progress
+            self.parent.update_data_changed = True
+
+    def _is_cached(self, cache_key, file_path):
+        entry = self.parent.gcode_cache.lookup(cache_key)
+        if entry is None:
+            return False
+        try:
+            return os.path.getsize(file_path) == entry['size']
+        except OSError:
+            self.parent.gcode_cache.discard(cache_key)
+            return False
+
+    def _evict_cached_files(self, gcodes_dir, current_file):
+        cache = self.parent.gcode_cache
+        protected = {current_file, self.parent.updates.get('file_name')} | self.parent.job_queue.protected_names()
+        for entry in cache.evict(protected_names=protected):
+            try:
+                os.remove(os.path.join(gcodes_dir, entry['name']))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"[CACHE] Failed to remove {entry['name']}: {e}")
+        self.parent.updates['gcode_cache'] = cache.stats()
+        self.parent.update_data_changed = True
+
+    async def _place_file(self, filename, url, file_hash=None, cache_key=None, on_progress=None, parallel=None, max_rate=None):
+        """
+        Make filename available in printer_data/gcodes, reusing the cached copy
+        if there is one and streaming it there otherwise. Returns the stored
+        name, its path, its cache key and the streaming analysis of the
+        download (None on a cache hit).
+        """
+        filename_safe = strip_compression_suffix(os.path.basename(filename))  # Stored decompressed
+        gcodes_dir = os.path.join(self.parent.printer_data_dir, "gcodes")
+        os.makedirs(gcodes_dir, exist_ok=True)
+        file_path = os.path.join(gcodes_dir, filename_safe)
+
+        download_session = self.parent.http_pool.download_session()
+        cache = self.parent.gcode_cache
+        if cache_key is None:
+            etag = None if file_hash or not cache.enabled else await probe_etag(download_session, url, timeout=REQUEST_TIMEOUTS['probe'])
+            cache_key = cache.make_key(filename_safe, url, etag, file_hash)
+        analysis = None
+        if self._is_cached(cache_key, file_path):
+            cache.record_hit(cache_key)
+            logging.info('Cache hit for %s, skipping download', filename_safe)
+        else:
+            cache.record_miss()
+            analysis = self.parent.new_gcode_analysis()
+            stats = {}
+            start_time = time.time()
+            bytes_downloaded = await download_to_file(
+                download_session, url, file_path, on_progress=on_progress or self._on_download_progress,
+                timeout=REQUEST_TIMEOUTS['download'], on_chunk=analysis.feed if analysis else None, file_hash=file_hash,
+                retries=self.parent.download_retries, parallel=parallel or self.parent.download_parallel,
+                parallel_min_part=self.parent.download_parallel_min_part, stats=stats, max_rate=max_rate
+            )
+            cache.store(cache_key, filename_safe, bytes_downloaded)
+            self.parent.observe_transfer(bytes_downloaded, time.time() - start_time,
+                                         wire_bytes=stats.get('wire_bytes'), encoding=stats.get('encoding'))
+            logging.info('Download of %.1fMB completed', bytes_downloaded / (1024 * 1024))
+        return filename_safe, file_path, cache_key, analysis
+
+    async def prefetch_file(self, filename, url, file_hash=None, on_progress=None, max_rate=None):
+        """
+        Download a queued file ahead of its print without starting it. Runs
+        sequentially and leaves the transfer progress alone. Returns the
+        stored name and cache key.
+        """
+        filename_safe, file_path, cache_key, analysis = await self._place_file(
+            filename, url, file_hash, on_progress=on_progress or (lambda done, total: None), parallel=1, max_rate=max_rate
+        )
+        await self.parent.store_file_analysis(cache_key, analysis)
+        self._evict_cached_files(os.path.dirname(file_path), filename_safe)
+        return filename_safe, cache_key
+
+    async def print_file(self, filename, url, file_hash=None, cache_key=None):
         try:
             start_time = time.time()
             logging.info('Starting file transfer process from %s', url)
-            download_headers = {'User-Agent': 'Mozilla/5.0 (compatible; PiPrinter/1.0)'}
 
             self.parent.uploading_file_progress = 0.0
+            self.parent.downloading_file_progress = 0.0
             self.parent.update_data_changed = True
 
-            async with aiohttp.ClientSession() as session:
-                # 1. Asynchronously download the file into a memory buffer
-                file_stream = io.BytesIO()
-                async with session.get(url, headers=download_headers, timeout=60) as file_response:
-                    file_response.raise_for_status()
-                    total_size = int(file_response.headers.get('content-length', 0))
-                    bytes_downloaded = 0
-                    last_log_time = time.time()
-
-                    async for chunk in file_response.content.iter_chunked(1024 * 1024 * 4): # 4MB chunks
-                        file_stream.write(chunk)
-                        bytes_downloaded += len(chunk)
-                        if total_size > 0:
-                            self.parent.uploading_file_progress = (bytes_downloaded / total_size) * 100
-                            self.parent.update_data_changed = True
-
-                        current_time = time.time()
-                        if current_time - last_log_time > 5:
-                            speed = bytes_downloaded / (current_time - start_time) / 1024 / 1024 if (current_time - start_time) > 0 else 0
-                            logging.info(f'Downloaded {bytes_downloaded/(1024*1024):.1f}MB of {total_size/(1024*1024):.1f}MB ({speed:.2f} MB/s)')
-                            last_log_time = current_time
-
-                download_time = time.time() - start_time
-                logging.info('Download completed in %.2f seconds', download_time)
-
-                # 2. Save the file to disk using an executor to avoid blocking
-                filename_safe = os.path.basename(filename)
-                gcodes_dir = f"/home/{self.parent.username}/printer_data/gcodes"
-                os.makedirs(gcodes_dir, exist_ok=True)
-                file_path = os.path.join(gcodes_dir, filename_safe)
-
-                loop = asyncio.get_running_loop()
-                await loop.run_in_executor(None, self._save_file_to_disk, file_stream.getvalue(), file_path)
-
-                # 3. Asynchronously tell the printer to start printing the file
-                upload_start = time.time()
-                print_url = f"{self.parent.printer_url}/printer/print/start"
-                print_payload = {"filename": filename_safe}
-                async with session.post(print_url, json=print_payload) as print_response:
-                    print_response.raise_for_status()
-                    response_text = await print_response.text()
-
-                self.parent.updates['cancelled'] = None
-                upload_time = time.time() - upload_start
-                total_time = time.time() - start_time
-                logging.info('Download: %.2fs, Upload/Save: %.2fs, Total: %.2fs', download_time, upload_time, total_time)
-                logging.info('File transfer successful, print started: %s', response_text)
+            session = await self._ensure_session()
+            # 1. Reuse the file if it is already cached, otherwise stream it into printer_data/gcodes
+            filename_safe, file_path, cache_key, analysis = await self._place_file(filename, url, file_hash, cache_key)
+
+            download_time = time.time() - start_time
+            logging.info('File ready in %.2f seconds', download_time)
+
+            # 2. Asynchronously tell the printer to start printing the file
+            upload_start = time.time()
+            print_url = f"{self.parent.printer_url}/printer/print/start"
+            print_payload = {"filename": filename_safe}
+            async with session.post(print_url, json=print_payload, timeout=REQUEST_TIMEOUTS['command']) as print_response:
+                print_response.raise_for_status()
+                response_text = await print_response.text()
+
+            self.parent.updates['cancelled'] = None
+            upload_time = time.time() - upload_start
+            total_time = time.time() - start_time
+            logging.info('Download: %.2fs, Start print: %.2fs, Total: %.2fs', download_time, upload_time, total_time)
+            logging.info('File transfer successful, print started: %s', response_text)
+            # After the print started, so reading back a file that was never analyzed delays nothing
+            await self.parent.publish_file_analysis(cache_key, analysis, local_path=file_path)
+
+            self._evict_cached_files(os.path.dirname(file_path), filename_safe)
 
         except aiohttp.ClientError as e:
+            self.parent.record_error('transfer')
             logging.error('Network operation failed: %s', e)
         except IOError as e:
+            self.parent.record_error('transfer')
             logging.error(f'Failed during disk operation: {e}')
         finally:
             self.parent.uploading_file_progress = None
+            self.parent.downloading_file_progress = None
             self.parent.update_data_changed = True
 
         await self.parent.send_printer_ready()
@@ -195,46 +375,46 @@ class Klipper:
         url = f"{self.parent.printer_url}/printer/print/cancel"
         try:
             logging.info('Stopping print')
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url) as response:
-                    response.raise_for_status()
-                    logging.info('Successfully stopped print')
-                    await self.parent.send_printer_ready()
-        except aiohttp.ClientError as e:
+            session = await self._ensure_session()
+            async with session.post(url, timeout=REQUEST_TIMEOUTS['command']) as response:
+                response.raise_for_status()
+                logging.info('Successfully stopped print')
+                await self.parent.send_printer_ready()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logging.error('Stopping print failed: %s', e)
 
     async def reconnect_printer(self):
         url = f"{self.parent.printer_url}/printer/restart"
         try:
             logging.info('Reconnecting printer')
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url) as response:
-                    response.raise_for_status()
-                    await self.parent.send_printer_ready()
-                    logging.info('Successfully sent reconnect command')
-        except aiohttp.ClientError as e:
+            session = await self._ensure_session()
+            async with session.post(url, timeout=REQUEST_TIMEOUTS['command']) as response:
+                response.raise_for_status()
+                await self.parent.send_printer_ready()
+                logging.info('Successfully sent reconnect command')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logging.error('Reconnect failed: %s', e)
 
     async def pause_print(self):
         url = f"{self.parent.printer_url}/printer/print/pause"
         try:
             logging.info('Pausing Print')
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url) as response:
-                    response.raise_for_status()
-                    logging.info('Successfully paused print')
-        except aiohttp.ClientError as e:
+            session = await self._ensure_session()
+            async with session.post(url, timeout=REQUEST_TIMEOUTS['command']) as response:
+                response.raise_for_status()
+                logging.info('Successfully paused print')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logging.error('Pausing print failed: %s', e)
 
     async def resume_print(self):
         url = f"{self.parent.printer_url}/printer/print/resume"
         try:
             logging.info('Resuming Print')
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url) as response:
-                    response.raise_for_status()
-                    logging.info('Successfully resumed print')
-        except aiohttp.ClientError as e:
+            session = await self._ensure_session()
+            async with session.post(url, timeout=REQUEST_TIMEOUTS['command']) as response:
+                response.raise_for_status()
+                logging.info('Successfully resumed print')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logging.error('Resuming print failed: %s', e)
 
     async def move_extruder(self, x, y, z):
@@ -242,31 +422,31 @@ class Klipper:
         gcode_command = f"G91\nG1 X{x} Y{y} Z{z} F1000\nG90"
         payload = {"script": gcode_command}
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload) as response:
-                    response.raise_for_status()
-                    logging.info(f"Successfully moved extruder X:{x} Y:{y} Z:{z}")
-                    await self.parent.send_printer_ready()
-        except aiohttp.ClientError as e:
+            session = await self._ensure_session()
+            async with session.post(url, json=payload, timeout=REQUEST_TIMEOUTS['gcode']) as response:
+                response.raise_for_status()
+                logging.info(f"Successfully moved extruder X:{x} Y:{y} Z:{z}")
+                await self.parent.send_printer_ready()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logging.error(f"Failed to move extruder: {e}")
 
     async def set_temperatures(self, tool_temp: int, bed_temp: int):
         url = f"{self.parent.printer_url}/printer/gcode/script"
         try:
-            async with aiohttp.ClientSession() as session:
-                # Set extruder temp
-                extruder_command = f"M104 S{tool_temp}"
-                extruder_payload = {"script": extruder_command}
-                async with session.post(url, json=extruder_payload) as r1:
-                    r1.raise_for_status()
-                    logging.info(f"Successfully set tool temperature to {tool_temp}°C")
-
-                # Set bed temp
-                bed_command = f"M140 S{bed_temp}"
-                bed_payload = {"script": bed_command}
-                async with session.post(url, json=bed_payload) as r2:
-                    r2.raise_for_status()
-                    logging.info(f"Successfully set bed temperature to {bed_temp}°C")
+            session = await self._ensure_session()
+            # Set extruder temp
+            extruder_command = f"M104 S{tool_temp}"
+            extruder_payload = {"script": extruder_command}
+            async with session.post(url, json=extruder_payload, timeout=REQUEST_TIMEOUTS['gcode']) as r1:
+                r1.raise_for_status()
+                logging.info(f"Successfully set tool temperature to {tool_temp}°C")
+
+            # Set bed temp
+            bed_command = f"M140 S{bed_temp}"
+            bed_payload = {"script": bed_command}
+            async with session.post(url, json=bed_payload, timeout=REQUEST_TIMEOUTS['gcode']) as r2:
+                r2.raise_for_status()
+                logging.info(f"Successfully set bed temperature to {bed_temp}°C")
             await self.parent.send_printer_ready()
-        except aiohttp.ClientError as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logging.error(f"Failed to set temperatures: {e}")
\ No newline at end of file
@@ -3,13 +3,18 @@ import time
 import websockets
 import asyncio
 import aiohttp  # Use aiohttp for all HTTP interactions
-import io
 import json
+from urllib.parse import quote
 from datetime import datetime
 from utils.helpers import parse_move_command, has_significant_difference
+from utils.backoff import Backoff
+from utils.transfer import PIPE_QUEUE_SIZE, download_to_queue, iter_queue, probe_etag, strip_compression_suffix
+from utils.http_pool import REQUEST_TIMEOUTS
 
 
 class Octoprint:
+    STATUS_TIMEOUTS = {'printer': 5, 'job': 10}  # Seconds, per status endpoint
+
     def __init__(self, parent):
         self.parent = parent  # Reference to BatchPrinterConnect
         self.terminal_buffer = []  # Buffer to store terminal output lines
@@ -17,13 +22,16 @@ class Octoprint:
         self.session_key = None  # Store session key for WebSocket auth
         self.username = None  # Store username for WebSocket auth
         self.session: aiohttp.ClientSession | None = None  # Reusable HTTP session
+        self.transfer_total_size = 0  # Size of the file currently being transferred
+        self.endpoint_latency = {}  # Last request latency per status endpoint, in seconds
+        self.push_backoff = Backoff(base=1, cap=60)  # Reconnect delays for the push API
 
     async def _ensure_session(self) -> aiohttp.ClientSession:
         """
-        Lazily initialize a single aiohttp.ClientSession for all requests.
+        Lazily initialize a single aiohttp.ClientSession on the shared connection pool.
         """
         if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession(headers=self.parent.headers)
+            self.session = self.parent.http_pool.session(headers=self.parent.headers)
         return self.session
 
     async def close(self):
@@ -52,41 +60,70 @@ class Octoprint:
             logging.error(f"Error getting session key: {e}")
             return False
 
+    async def _fetch_status(self, session, endpoint):
+        """GET one status endpoint with its own timeout, recording how long it took"""
+        start = time.monotonic()
+        try:
+            url = f"{self.parent.printer_url}/api/{endpoint}"
+            async with session.get(url, timeout=self.STATUS_TIMEOUTS[endpoint]) as response:
+                response.raise_for_status()
+                return await response.json()
+        finally:
+            self.endpoint_latency[endpoint] = time.monotonic() - start
+            self.parent.observe_poll(endpoint, self.endpoint_latency[endpoint])
+
     async def printer_connection(self):
         """Poll OctoPrint for status updates in a loop"""
-        octoprint_url = self.parent.printer_url + "/api/"
         session = await self._ensure_session()
 
         while True:
             try:
                 logging.info("[PRINTER] Pull data")
 
-                # Printer status
-                async with session.get(octoprint_url + 'printer', timeout=10) as response_printer:
-                    response_printer.raise_for_status()
-                    printer_info = await response_printer.json()
-
-                temp_updates = {
-                    'status': printer_info.get('state', {}).get('text', 'unknown').lower(),
-                    'bed_temperature': printer_info.get('temperature', {}).get('bed', {}).get('actual', 0.0),
-                    'nozzle_temperature': printer_info.get('temperature', {}).get('tool0', {}).get('actual', 0.0),
-                    'bed_temperature_target': printer_info.get('temperature', {}).get('bed', {}).get('target', 0.0),
-                    'nozzle_temperature_target': printer_info.get('temperature', {}).get('tool0', {}).get('target', 0.0)
-                }
-
-                # Job status
-                async with session.get(octoprint_url + 'job', timeout=10) as response_job:
-                    response_job.raise_for_status()
-                    printer_job = await response_job.json()
-
-                temp_updates.update({
-                    'job_state': printer_job.get('state'),
-                    'job_error': printer_job.get('error'),
-                    'file_name': printer_job.get('job', {}).get('file', {}).get('name'),
-                    'progress': printer_job.get('progress', {}).get('completion', 0.0),
-                    'print_time': printer_job.get('progress', {}).get('printTime', 0.0),
-                    'print_time_left': printer_job.get('progress', {}).get('printTimeLeft', 0.0)
-                })
+                # Printer and job status are fetched concurrently and merged into one snapshot
+                printer_info, printer_job = await asyncio.gather(
+                    self._fetch_status(session, 'printer'),
+                    self._fetch_status(session, 'job'),
+                    return_exceptions=True
+                )
+                temp_updates = {}
+                failures = {}
+
+                if isinstance(printer_info, Exception):
+                    failures['printer'] = printer_info
+                else:
+                    temp_updates.update({
+                        'status': printer_info.get('state', {}).get('text', 'unknown').lower(),
+                        'bed_temperature': printer_info.get('temperature', {}).get('bed', {}).get('actual', 0.0),
+                        'nozzle_temperature': printer_info.get('temperature', {}).get('tool0', {}).get('actual', 0.0),
+                        'bed_temperature_target': printer_info.get('temperature', {}).get('bed', {}).get('target', 0.0),
+                        'nozzle_temperature_target': printer_info.get('temperature', {}).get('tool0', {}).get('target', 0.0)
+                    })
+                    self.parent.record_temperatures(
+                        temp_updates['nozzle_temperature'], temp_updates['nozzle_temperature_target'],
+                        temp_updates['bed_temperature'], temp_updates['bed_temperature_target']
+                    )
+
+                if isinstance(printer_job, Exception):
+                    failures['job'] = printer_job
+                else:
+                    temp_updates.update({
+                        'job_state': printer_job.get('state'),
+                        'job_error': printer_job.get('error'),
+                        'file_name': printer_job.get('job', {}).get('file', {}).get('name'),
+                        'progress': printer_job.get('progress', {}).get('completion', 0.0),
+                        'print_time': printer_job.get('progress', {}).get('printTime', 0.0),
+                        'print_time_left': printer_job.get('progress', {}).get('printTimeLeft', 0.0)
+                    })
+                    # OctoPrint's own estimate is replaced when the file being printed was analyzed
+                    eta = self.parent.estimate_progress(
+                        (printer_job.get('progress') or {}).get('filepos'),
+                        ((printer_job.get('job') or {}).get('file') or {}).get('size'),
+                        temp_updates['print_time']
+                    )
+                    if eta is not None:
+                        temp_updates['print_time_left'] = eta['print_time_left']
+                    temp_updates['eta'] = eta
 
                 # Terminal output
                 async with self.terminal_buffer_lock:
@@ -105,7 +142,13 @@ class Octoprint:
                 if update_needed:
                     self.parent.update_data_changed = True
 
-                logging.info(f"[PRINTER] Data received: {temp_updates['status']}")
+                latency = ', '.join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.endpoint_latency.items())
+                logging.info(f"[PRINTER] Data received: {temp_updates.get('status')} ({latency})")
+
+                if failures:
+                    logging.warning(f"[PRINTER] Partial snapshot, failed endpoints: {', '.join(failures)}")
+                    # Printer endpoint errors (e.g. 409 when disconnected) are handled below
+                    raise failures.get('printer') or failures['job']
 
             except aiohttp.ClientResponseError as e:
                 if e.status == 409:
@@ -116,68 +159,188 @@ class Octoprint:
                     await asyncio.sleep(10)
                     continue
                 else:
+                    self.parent.record_error('poll')
                     logging.error(f"HTTP Error: {e.status} - {e.message}")
             except Exception as e:
+                self.parent.record_error('poll')
                 logging.error("Error connecting to OctoPrint: %s", e)
 
-            await asyncio.sleep(self.parent.reconnect_interval)
+            await self.parent.poll_scheduler.wait(self.parent.updates)
 
-    async def print_file(self, filename, url):
-        """Download a file from URL and upload to OctoPrint for printing"""
-        upload_headers = {'X-Api-Key': self.parent.octo_api_key}
-        download_headers = {'User-Agent': 'Mozilla/5.0 (compatible; PiPrinter/1.0)'}
+    def _on_download_progress(self, bytes_downloaded, total_size):
+        self.transfer_total_size = total_size
+        if total_size:
+            self.parent.downloading_file_progress = (bytes_downloaded / total_size) * 100
+            self.parent.update_data_changed = True
 
-        try:
-            start_time = time.time()
-            logging.info('Starting file transfer from %s', url)
-            self.parent.uploading_file_progress = 0.0
+    def _on_upload_progress(self, bytes_uploaded):
+        if self.transfer_total_size:
+            # The total is the size on the wire, which a decompressed upload outgrows; it never outruns the download
+            self.parent.uploading_file_progress = min(
+                (bytes_uploaded / self.transfer_total_size) * 100, self.parent.downloading_file_progress or 0.0
+            )
             self.parent.update_data_changed = True
 
-            session = await self._ensure_session()
-            # Download
-            async with session.get(url, headers=download_headers, timeout=60) as file_response:
-                file_response.raise_for_status()
-                file_stream = io.BytesIO()
-                total_size = int(file_response.headers.get('content-length', 0))
-                bytes_downloaded = 0
-                last_log = time.time()
-
-                async for chunk in file_response.content.iter_chunked(4 * 1024 * 1024):
-                    file_stream.write(chunk)
-                    bytes_downloaded += len(chunk)
-                    if total_size:
-                        self.parent.uploading_file_progress = (bytes_downloaded / total_size) * 100
-                        self.parent.update_data_changed = True
-                    if time.time() - last_log > 5:
-                        speed = bytes_downloaded / (time.time() - start_time) / 1024 / 1024
-                        logging.info(f'Downloaded {bytes_downloaded/(1024*1024):.1f}MB of {total_size/(1024*1024):.1f}MB ({speed:.2f} MB/s)')
-                        last_log = time.time()
-
-            download_time = time.time() - start_time
-            logging.info('Download completed in %.2f seconds', download_time)
-            file_stream.seek(0)
-
-            # Upload
-            upload_start = time.time()
-            data = aiohttp.FormData()
-            data.add_field('file', file_stream, filename=filename, content_type='application/octet-stream')
-            data.add_field('print', 'true')
+    def _file_url(self, name):
+        """Files API URL of a stored file, its path quoted so spaces, # and ? survive"""
+        return f"{self.parent.printer_url}/api/files/local/{quote(name, safe='/')}"
+
+    async def _select_cached_file(self, cache_key):
+        """Start printing a previously uploaded file if it is still in OctoPrint's storage"""
+        entry = self.parent.gcode_cache.lookup(cache_key)
+        if entry is None:
+            return False
+        session = await self._ensure_session()
+        file_url = self._file_url(entry['name'])
+        async with session.get(file_url, timeout=10) as response:
+            if response.status == 404:
+                self.parent.gcode_cache.discard(cache_key)
+                return False
+            response.raise_for_status()
+            file_info = await response.json()
+        if file_info.get('size') != entry['size']:
+            self.parent.gcode_cache.discard(cache_key)
+            return False
+
+        async with session.post(file_url, json={'command': 'select', 'print': True}, timeout=15) as response:
+            response.raise_for_status()
+        return True
+
+    async def _evict_cached_files(self, current_file):
+        """Delete uploads the cache no longer wants to keep"""
+        cache = self.parent.gcode_cache
+        protected = {current_file, self.parent.updates.get('file_name')} | self.parent.job_queue.protected_names()
+        session = await self._ensure_session()
+        for entry in cache.evict(protected_names=protected):
+            try:
+                file_url = self._file_url(entry['name'])
+                async with session.delete(file_url, timeout=15) as response:
+                    if response.status not in (204, 404):
+                        logging.warning(f"[CACHE] Failed to delete {entry['name']}: {response.status}")
+            except aiohttp.ClientError as e:
+                logging.warning(f"[CACHE] Failed to delete {entry['name']}: {e}")
+        self.parent.updates['gcode_cache'] = cache.stats()
+        self.parent.update_data_changed = True
+
+    async def _upload_file(self, filename, url, on_chunk=None, file_hash=None, stats=None, print_after=True,
+                           on_progress=None, max_rate=None):
+        """
+        Pipe a download into OctoPrint's upload API, printing it once stored
+        unless print_after is False. on_progress replaces the transfer progress
+        reporting. Returns (stored name, size)
+        """
+        upload_headers = {'X-Api-Key': self.parent.octo_api_key}
+        download_task = None
+        session = await self._ensure_session()
+
+        try:
+            # Download and upload run concurrently, joined by a bounded queue
+            queue = asyncio.Queue(maxsize=PIPE_QUEUE_SIZE)
+            download_task = asyncio.create_task(
+                download_to_queue(self.parent.http_pool.download_session(), url, queue,
+                                  on_progress=on_progress or self._on_download_progress, timeout=REQUEST_TIMEOUTS['download'],
+                                  on_chunk=on_chunk, file_hash=file_hash, retries=self.parent.download_retries, stats=stats,
+                                  max_rate=max_rate)
+            )
+
+            data = aiohttp.MultipartWriter('form-data')
+            file_part = data.append(
+                iter_queue(queue, on_progress=None if on_progress else self._on_upload_progress),
+                {'Content-Type': 'application/octet-stream'}
+            )
+            file_part.set_content_disposition('form-data', name='file', filename=filename)
+            print_part = data.append('true' if print_after else 'false')
+            print_part.set_content_disposition('form-data', name='print')
 
             upload_url = f"{self.parent.printer_url}/api/files/local"
             async with session.post(upload_url, data=data, headers=upload_headers, timeout=300) as response:
                 response.raise_for_status()
-                self.parent.updates['cancelled'] = None
-                resp_text = await response.text()
+                resp_json = await response.json()
 
-            upload_time = time.time() - upload_start
-            total = time.time() - start_time
-            logging.info('Download: %.2fs, Upload: %.2fs, Total: %.2fs', download_time, upload_time, total)
-            logging.info('File transfer successful: %s', resp_text)
+            bytes_transferred = await download_task
+        finally:
+            if download_task and not download_task.done():
+                download_task.cancel()
+
+        logging.info('File transfer successful: %s', resp_json)
+        stored_name = resp_json.get('files', {}).get('local', {}).get('path', filename)
+        return stored_name, bytes_transferred
+
+    async def _upload_uncached(self, filename, url, file_hash, cache_key, start_time, **upload_options):
+        """Upload a file the cache does not have and record it. Returns the stored name and its streaming analysis"""
+        cache = self.parent.gcode_cache
+        cache.record_miss()
+        analysis = self.parent.new_gcode_analysis()
+        stats = {}
+        stored_name, bytes_transferred = await self._upload_file(
+            filename, url, on_chunk=analysis.feed if analysis else None, file_hash=file_hash, stats=stats, **upload_options
+        )
+        cache.store(cache_key, stored_name, bytes_transferred)
+        total = time.time() - start_time
+        speed = bytes_transferred / total / 1024 / 1024 if total > 0 else 0
+        self.parent.observe_transfer(bytes_transferred, total,
+                                     wire_bytes=stats.get('wire_bytes'), encoding=stats.get('encoding'))
+        logging.info('Transferred %.1fMB in %.2fs (%.2f MB/s)', bytes_transferred / (1024 * 1024), total, speed)
+        return stored_name, analysis
+
+    async def _make_cache_key(self, filename, url, file_hash):
+        cache = self.parent.gcode_cache
+        etag = None if file_hash or not cache.enabled else await probe_etag(self.parent.http_pool.download_session(), url)
+        return cache.make_key(filename, url, etag, file_hash)
+
+    async def prefetch_file(self, filename, url, file_hash=None, on_progress=None, max_rate=None):
+        """
+        Upload a queued file to OctoPrint ahead of its print without starting
+        it, leaving the transfer progress alone. Returns the stored name and
+        cache key.
+        """
+        start_time = time.time()
+        filename = strip_compression_suffix(filename)  # Uploaded decompressed
+        cache_key = await self._make_cache_key(filename, url, file_hash)
+        entry = self.parent.gcode_cache.lookup(cache_key)
+        if entry is not None:
+            return entry['name'], cache_key
+        stored_name, analysis = await self._upload_uncached(
+            filename, url, file_hash, cache_key, start_time, print_after=False,
+            on_progress=on_progress or (lambda done, total: None), max_rate=max_rate
+        )
+        await self.parent.store_file_analysis(cache_key, analysis)
+        await self._evict_cached_files(stored_name)
+        return stored_name, cache_key
+
+    async def print_file(self, filename, url, file_hash=None, cache_key=None):
+        """Print a file from URL, reusing OctoPrint's copy if it is cached"""
+        try:
+            start_time = time.time()
+            logging.info('Starting file transfer from %s', url)
+            self.parent.uploading_file_progress = 0.0
+            self.parent.downloading_file_progress = 0.0
+            self.transfer_total_size = 0
+            self.parent.update_data_changed = True
 
-        except aiohttp.ClientError as e:
+            filename = strip_compression_suffix(filename)  # Uploaded decompressed
+            cache = self.parent.gcode_cache
+            cache_key = cache_key or await self._make_cache_key(filename, url, file_hash)
+
+            if await self._select_cached_file(cache_key):
+                cache.record_hit(cache_key)
+                stored_name = cache.lookup(cache_key)['name']
+                logging.info('Cache hit for %s, printing stored copy %s', filename, stored_name)
+                # The stored copy lives in OctoPrint, only the analysis kept from its upload can be reused
+                await self.parent.publish_file_analysis(cache_key)
+            else:
+                stored_name, analysis = await self._upload_uncached(filename, url, file_hash, cache_key, start_time)
+                await self.parent.publish_file_analysis(cache_key, analysis)
+
+            self.parent.updates['cancelled'] = None
+            await self._evict_cached_files(stored_name)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.parent.record_error('transfer')
             logging.error('File transfer failed: %s', e)
         finally:
             self.parent.uploading_file_progress = None
+            self.parent.downloading_file_progress = None
             self.parent.update_data_changed = True
 
         await self.parent.send_printer_ready()
@@ -297,18 +460,20 @@ class Octoprint:
 
     async def listen_to_printer_push_api(self):
         """Connect to OctoPrint's WebSocket push API for live events/logs"""
-        ws_url = "ws://localhost:5000/sockjs/websocket"
+        ws_url = self.parent.printer_url.replace('http', 'ws', 1) + "/sockjs/websocket"
         while True:
             try:
                 if not self.session_key:
                     logging.info("Getting session key for WebSocket auth…")
                     if not await self.get_session_key():
-                        logging.error("Failed to get session key, retrying in 10s…")
-                        await asyncio.sleep(10)
+                        delay = self.push_backoff.next_delay()
+                        logging.error(f"Failed to get session key, retrying in {delay:.1f}s…")
+                        await asyncio.sleep(delay)
                         continue
 
                 async with websockets.connect(ws_url, ping_interval=20, ping_timeout=20) as ws:
                     logging.info(f"Connected to Push API at {ws_url}")
+                    self.push_backoff.on_connected()
 
                     # AUTH
                     auth_msg = {"auth": f"{self.username}:{self.session_key}"}
@@ -319,7 +484,7 @@ class Octoprint:
                     sub_msg = {
                         "subscribe": {
                             "state": {"logs": True, "messages": False},
-                            "events": ["GcodeSending", "GcodeSent"]
+                            "events": ["GcodeSending", "GcodeSent", "ZChange"]
                         }
                     }
                     await ws.send(json.dumps(sub_msg))
@@ -348,6 +513,13 @@ class Octoprint:
                             mtype, payload = next(iter(msg.items()))
 
                             if mtype in ("current", "history"):
+                                # Push updates carry temperatures more often than we poll
+                                for sample in payload.get("temps", []):
+                                    self.parent.record_temperatures(
+                                        sample.get("tool0", {}).get("actual"), sample.get("tool0", {}).get("target"),
+                                        sample.get("bed", {}).get("actual"), sample.get("bed", {}).get("target"),
+                                        timestamp=sample.get("time")
+                                    )
                                 logs = payload.get("logs", [])
                                 if logs:
                                     async with self.terminal_buffer_lock:
@@ -367,12 +539,20 @@ class Octoprint:
                                     if cmd:
                                         self.parent.last_gcode_command = cmd
                                         logging.info(f"Last G-code: {cmd}")
+                                        if event_name == "GcodeSent":
+                                            self.parent.on_gcode(cmd)
+                                elif event_name == "ZChange":
+                                    # OctoPrint only reports the new Z height, not a layer number
+                                    self.parent.on_layer_change()
                             else:
                                 logging.debug(f"[PUSH-API] Other ({mtype}): {payload}")
 
             except Exception as e:
+                self.parent.record_error('printer_websocket')
                 logging.error(f"[PUSH-API] Connection error: {e}")
                 self.session_key = None
                 self.username = None
-            logging.info("Reconnecting to Push API in 5s…")
-            await asyncio.sleep(5)
+            self.push_backoff.on_disconnected()
+            delay = self.push_backoff.next_delay()
+            logging.info(f"Reconnecting to Push API in {delay:.1f}s…")
+            await asyncio.sleep(delay)
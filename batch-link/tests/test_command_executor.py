@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+from utils.command_executor import CommandExecutor
+
+
+def test_emergency_stop_does_not_wait_for_a_running_safety_command():
+    async def main():
+        started = time.monotonic()
+        ran = {}
+        outcomes = []
+
+        async def slow(action, content):
+            await asyncio.sleep(2)
+
+        async def record(action, content):
+            ran[action] = time.monotonic() - started
+
+        executor = CommandExecutor(on_complete=lambda name, lane, wait, run, outcome: outcomes.append((name, outcome)))
+        executor.register('emergency_stop', 'emergency', record, preempt=True, substring=True)
+        executor.register('stop_print', 'safety', slow)
+        executor.register('cmd', 'control', slow)
+        executor.register('enqueue_print', 'control', record, preemptible=False)
+        worker = asyncio.create_task(executor.run())
+        try:
+            executor.submit('stop_print', {})
+            executor.submit('cmd', {})
+            executor.submit('cmd', {})
+            executor.submit('enqueue_print', {})
+            await asyncio.sleep(0.05)
+            executor.submit('emergency_stop', {})
+            await asyncio.sleep(0.2)
+        finally:
+            worker.cancel()
+        return ran, outcomes
+
+    ran, outcomes = asyncio.run(main())
+    assert ran['emergency_stop'] < 0.5
+    assert 'enqueue_print' in ran  # Bookkeeping is neither dropped nor cancelled
+    assert outcomes.count(('cmd', 'preempted')) == 2
+    assert ('stop_print', 'preempted') in outcomes
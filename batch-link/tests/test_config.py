@@ -0,0 +1,55 @@
+import configparser
+import importlib.util
+import os
+
+spec = importlib.util.spec_from_file_location(
+    'batch_link', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'batch-link.py')
+)
+batch_link = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(batch_link)
+
+CONFIG = """
+[connection_settings]
+PRINTER_URL=http://localhost
+OCTOPRINT_BACKEND_URL=http://127.0.0.1:5000
+
+[printer_details]
+DRIVER=KLIPPER
+
+[camera]
+ENABLED=true
+SNAPSHOT_URL=http://localhost:8080/?action=snapshot
+
+[printer:left]
+UUID=left-uuid
+
+[printer:right]
+UUID=right-uuid
+PRINTER_URL=http://localhost:7126
+OCTOPRINT_BACKEND_URL=http://127.0.0.1:5001
+
+[camera:right]
+SNAPSHOT_URL=http://localhost:8081/?action=snapshot
+
+[job_queue:right]
+PREFETCH=0
+"""
+
+
+def test_sections_are_overridden_per_printer():
+    config = configparser.ConfigParser()
+    config.read_string(CONFIG)
+    printers = dict(batch_link.load_printer_configs(config))
+
+    assert set(printers) == {'left', 'right'}
+    left, right = printers['left'], printers['right']
+    assert left['printer_details']['UUID'] == 'left-uuid'
+    assert right['connection_settings']['PRINTER_URL'] == 'http://localhost:7126'
+    assert right['connection_settings']['OCTOPRINT_BACKEND_URL'] == 'http://127.0.0.1:5001'
+    assert not left.has_option('connection_settings', 'OCTOPRINT_BACKEND_URL')  # Never shared
+    assert left['camera']['SNAPSHOT_URL'] == 'http://localhost:8080/?action=snapshot'
+    assert right['camera']['SNAPSHOT_URL'] == 'http://localhost:8081/?action=snapshot'
+    assert right.getboolean('camera', 'ENABLED')  # Keys not overridden stay shared
+    assert right.getint('job_queue', 'PREFETCH') == 0
+    assert not left.has_section('job_queue')
+    assert not any(':' in section for section in right.sections())
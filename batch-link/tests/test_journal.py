@@ -0,0 +1,27 @@
+import asyncio
+import base64
+import gzip
+import json
+
+from utils.journal import OfflineJournal
+
+
+def test_records_are_written_in_the_background_and_replayed(tmp_path):
+    async def main():
+        journal = OfflineJournal(str(tmp_path), segment_bytes=200)
+        for status in ('printing', 'paused', 'printing'):
+            journal.record_update({'status': status, 'progress': 1.0})
+        journal.record_event({'action': 'printer_ready', 'content': {}})
+        assert journal.has_entries()  # Before anything reached the disk
+        await journal.flush()
+        return await asyncio.get_running_loop().run_in_executor(None, journal.build_replay_frames), journal
+
+    frames, journal = asyncio.run(main())
+    records = [
+        json.loads(line)
+        for frame in frames
+        for line in gzip.decompress(base64.b64decode(frame['content']['data'])).splitlines()
+    ]
+    assert [r.get('content', {}).get('status') for r in records] == ['printing', 'paused', 'printing', None]
+    assert records[-1]['action'] == 'printer_ready'
+    assert not journal.has_entries()
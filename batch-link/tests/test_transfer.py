@@ -0,0 +1,158 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from utils import transfer
+from utils.transfer import TransferVerificationError, download_to_file, download_to_queue, iter_queue
+
+OLD = b'o' * 200000
+NEW = b'n' * 200000
+DROP_AT = 100000
+
+
+def serve(versions, honour_ranges=True):
+    """
+    A file server that drops the first response halfway, then serves
+    versions[1]: the file was replaced on the server between the two requests.
+    Returns (app, requests) where requests records the Range header of each.
+    """
+    requests = []
+
+    async def handler(request):
+        body, etag = versions[min(len(requests), len(versions) - 1)]
+        requests.append(request.headers.get('Range'))
+        start, status, headers = 0, 200, {'ETag': etag, 'Accept-Ranges': 'bytes'}
+        rng = request.headers.get('Range')
+        if rng and honour_ranges and request.headers.get('If-Range') == etag:
+            start = int(rng[len('bytes='):].split('-')[0])
+            status = 206
+            headers['Content-Range'] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_length = len(body) - start
+        await response.prepare(request)
+        if len(requests) == 1:
+            await response.write(body[:DROP_AT])
+            request.transport.close()
+            return response
+        await response.write(body[start:])
+        return response
+
+    app = web.Application()
+    app.router.add_get('/file.gcode', handler)
+    return app, requests
+
+
+async def run_server(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/file.gcode"
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(transfer, 'RETRY_BASE_DELAY', 0)
+
+
+def test_file_changed_on_resume_starts_over(tmp_path):
+    async def main():
+        app, requests = serve([(OLD, '"v1"'), (NEW, '"v2"')])
+        runner, url = await run_server(app)
+        try:
+            async with aiohttp.ClientSession(auto_decompress=False) as session:
+                size = await download_to_file(session, url, str(tmp_path / 'file.gcode'))
+        finally:
+            await runner.cleanup()
+        return size, requests
+
+    size, requests = asyncio.run(main())
+    assert (tmp_path / 'file.gcode').read_bytes() == NEW
+    assert size == len(NEW)
+    assert requests[1] == f"bytes={DROP_AT}-"
+
+
+def test_unchanged_file_resumes_from_where_it_dropped(tmp_path):
+    async def main():
+        app, requests = serve([(OLD, '"v1"')])
+        runner, url = await run_server(app)
+        try:
+            async with aiohttp.ClientSession(auto_decompress=False) as session:
+                await download_to_file(session, url, str(tmp_path / 'file.gcode'))
+        finally:
+            await runner.cleanup()
+        return requests
+
+    requests = asyncio.run(main())
+    assert (tmp_path / 'file.gcode').read_bytes() == OLD
+    assert requests == [None, f"bytes={DROP_AT}-"]
+
+
+def test_file_changed_on_resume_fails_a_queued_download():
+    async def main():
+        app, _ = serve([(OLD, '"v1"'), (NEW, '"v2"')])
+        runner, url = await run_server(app)
+        queue = asyncio.Queue(maxsize=transfer.PIPE_QUEUE_SIZE)
+        try:
+            async with aiohttp.ClientSession(auto_decompress=False) as session:
+                producer = asyncio.create_task(download_to_queue(session, url, queue))
+                with pytest.raises(TransferVerificationError):
+                    async for _ in iter_queue(queue):
+                        pass
+                with pytest.raises(TransferVerificationError):
+                    await producer
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(main())
+
+
+def test_file_changed_under_parallel_ranges_fails(tmp_path):
+    seen = []
+
+    async def handler(request):
+        # The probe sees v1, the ranges that follow get v2 back whole as If-Range no longer matches
+        seen.append(request.headers.get('Range'))
+        if len(seen) == 1:
+            start, end = (int(n) for n in request.headers['Range'][len('bytes='):].split('-'))
+            return web.Response(status=206, body=OLD[start:end + 1], headers={
+                'ETag': '"v1"', 'Accept-Ranges': 'bytes', 'Content-Range': f"bytes {start}-{end}/{len(OLD)}",
+            })
+        return web.Response(body=NEW, headers={'ETag': '"v2"', 'Accept-Ranges': 'bytes'})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/file.gcode', handler)
+        runner, url = await run_server(app)
+        try:
+            async with aiohttp.ClientSession(auto_decompress=False) as session:
+                with pytest.raises(TransferVerificationError):
+                    await download_to_file(session, url, str(tmp_path / 'file.gcode'), parallel=2, parallel_min_part=DROP_AT)
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(main())
+    assert len(seen) > 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_corrupt_compressed_download_fails_verification(tmp_path):
+    async def handler(request):
+        return web.Response(body=b'\x1f\x8b\x08\x00' + b'not really gzip' * 100)
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/file.gcode.gz', handler)
+        runner, url = await run_server(app)
+        try:
+            async with aiohttp.ClientSession(auto_decompress=False) as session:
+                with pytest.raises(TransferVerificationError):
+                    await download_to_file(session, url + '.gz', str(tmp_path / 'file.gcode'))
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(main())
+    assert list(tmp_path.iterdir()) == []
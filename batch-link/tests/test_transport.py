@@ -0,0 +1,29 @@
+import configparser
+import socket
+
+from utils.transport import resolve_printer_transport
+
+
+def make_config(**settings):
+    config = configparser.ConfigParser()
+    config['connection_settings'] = {'PRINTER_URL': 'http://printer.local', **settings}
+    return config
+
+
+def test_tcp_is_the_default_transport():
+    assert resolve_printer_transport(make_config(), 'KLIPPER') == 'http://printer.local'
+
+
+def test_unix_transport_falls_back_to_tcp():
+    assert resolve_printer_transport(make_config(PRINTER_TRANSPORT='unix'), 'KLIPPER') == 'http://printer.local'
+
+
+def test_auto_transport_keeps_an_explicit_printer_url():
+    with socket.socket() as backend:
+        backend.bind(('127.0.0.1', 0))
+        backend.listen()
+        backend_url = f"http://127.0.0.1:{backend.getsockname()[1]}"
+        config = make_config(PRINTER_TRANSPORT='auto', OCTOPRINT_BACKEND_URL=backend_url)
+        assert resolve_printer_transport(config, 'OCTOPRINT') == 'http://printer.local'
+        del config['connection_settings']['PRINTER_URL']
+        assert resolve_printer_transport(config, 'OCTOPRINT') == backend_url
@@ -0,0 +1,79 @@
+import random
+import time
+
+# Upper bounds in seconds for the downtime histogram
+DOWNTIME_BUCKETS = (5, 15, 60, 300, 900, 3600, float('inf'))
+
+
+class Backoff:
+    """
+    Reconnect delays with exponential backoff and full jitter.
+
+    Each failed attempt doubles the ceiling (base * 2^attempt, capped at cap)
+    and the actual delay is drawn uniformly below it, so a fleet of printers
+    reconnecting to a restarted server spreads out instead of arriving in
+    lockstep. A retry-after hint from the server overrides the next delay.
+    The attempt counter only resets once a connection has stayed up for
+    stable_after seconds, so a flapping server keeps being backed off.
+    """
+
+    def __init__(self, base, cap, stable_after=60):
+        self.base = base
+        self.cap = cap
+        self.stable_after = stable_after
+        self.attempt = 0
+        self.retry_after = None
+        self.connected_at = None
+        self.disconnected_at = time.time()
+        self.outage_attempts = 0
+        self.reconnects = 0
+        self.last_downtime = None
+        self.downtime_histogram = {bucket: 0 for bucket in DOWNTIME_BUCKETS}
+
+    def set_retry_after(self, seconds):
+        """Honour a server-provided hint for the next delay."""
+        try:
+            self.retry_after = max(0.0, float(seconds))
+        except (TypeError, ValueError):
+            pass
+
+    def next_delay(self):
+        if self.retry_after is not None:
+            # Spread clients that got the same hint over an extra 10%
+            delay = self.retry_after * random.uniform(1.0, 1.1)
+            self.retry_after = None
+        else:
+            delay = random.uniform(0, min(self.cap, self.base * 2 ** self.attempt))
+        self.attempt += 1
+        self.outage_attempts += 1
+        return delay
+
+    def on_connected(self):
+        now = time.time()
+        self.connected_at = now
+        if self.disconnected_at is not None:
+            self.last_downtime = now - self.disconnected_at
+            bucket = next(b for b in DOWNTIME_BUCKETS if self.last_downtime <= b)
+            self.downtime_histogram[bucket] += 1
+            self.reconnects += 1
+        self.disconnected_at = None
+
+    def on_disconnected(self):
+        now = time.time()
+        if self.connected_at is not None and now - self.connected_at >= self.stable_after:
+            self.attempt = 0
+        self.connected_at = None
+        if self.disconnected_at is None:
+            self.disconnected_at = now
+            self.outage_attempts = 0
+
+    def stats(self):
+        return {
+            'attempts': self.outage_attempts,
+            'reconnects': self.reconnects,
+            'last_downtime': self.last_downtime,
+            'downtime_histogram': {
+                ('+Inf' if bucket == float('inf') else str(bucket)): count
+                for bucket, count in self.downtime_histogram.items()
+            },
+        }
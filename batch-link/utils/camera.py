@@ -1,62 +1,161 @@
 import logging
-import os
-import requests
 import asyncio
+import aiohttp
+import time
 from datetime import datetime
 
+DEFAULT_SNAPSHOT_URL = 'http://localhost:8080/?action=snapshot'
+DEFAULT_MARKERS = ('TIMELAPSE_TAKE_FRAME',)
+
+
 # ************* CAMERA *************** #
-def fetch_snapshot(self):
-    try:
-        response = requests.get(
-            f"{self.printer_url}:8080/?action=snapshot",
-            headers=self.headers,
-            stream=True
-        )
-        response.raise_for_status()
-        return response.content  # Returns the image as bytes
-    except Exception as e:
-        logging.error(f"Failed to fetch snapshot: {e}")
-        return None
-    
-async def capture_images(self):
-    while True:
-        if self.updates['status'] == 'printing' and self.last_status != 'printing':
-            self.start_new_recording()
-        elif self.updates['status'] != 'printing' and self.last_status == 'printing':
-            self.current_recording_folder = None
-
-        if self.current_recording_folder:
-            # ret, frame = self.camera.read()
-            # logging.info(f"Ret: {ret} and frame: {frame} from camera read")
-            # if ret:
-            #     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            #     gcode_command = self.get_current_gcode_command()
-            #     if gcode_command:
-            #         filename = f"{gcode_command}_{timestamp}.jpg"
-            #     else:
-            #         filename = f"{timestamp}.jpg"
-            #     image_path = os.path.join(self.current_recording_folder, filename)
-            #     cv2.imwrite(image_path, frame)
-            #     logging.info(f"Saved image: {image_path}")
-            snapshot = self.fetch_snapshot()
-            if snapshot:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                gcode_command = self.get_current_gcode_command()
-                if gcode_command:
-                    filename = f"{gcode_command}_{timestamp}.jpg"
-                else:
-                    filename = f"{timestamp}.jpg"
-                image_path = os.path.join(self.current_recording_folder, filename)
-                with open(image_path, "wb") as image_file:
-                    image_file.write(snapshot)
-                logging.info(f"Saved image: {image_path}")
-
-        self.last_status = self.updates['status']
-        await asyncio.sleep(2)  # Capture images every second
-
-def start_new_recording(self):
-    # Create a new folder for the recording
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    self.current_recording_folder = os.path.expanduser(f"~/printer-image-data/{timestamp}")
-    os.makedirs(self.current_recording_folder, exist_ok=True)
-    logging.info(f"Started new recording in folder: {self.current_recording_folder}")
\ No newline at end of file
+class CameraRecorder:
+    """
+    Records a timelapse of every print without blocking the loop.
+
+    Snapshots are fetched with aiohttp on the shared connection pool and
+    handed to a writer task through a small bounded queue; the writer appends
+    them to the print's timelapse container from an executor. If the disk
+    falls behind, the oldest queued frame is dropped instead of stalling the
+    capture, and a slow or dead camera only delays the next snapshot, never
+    the websocket or printer polling.
+
+    With trigger 'interval' a frame is taken every interval seconds. With
+    'layer' frames are taken on layer changes and G-code markers reported by
+    the driver, and at least every max_interval seconds.
+    """
+
+    def __init__(self, parent, timelapse, snapshot_url=DEFAULT_SNAPSHOT_URL, interval=2, queue_size=8,
+                 trigger='interval', max_interval=60, markers=DEFAULT_MARKERS):
+        self.parent = parent  # Reference to BatchPrinterConnect
+        self.timelapse = timelapse
+        self.snapshot_url = snapshot_url
+        self.interval = interval
+        self.trigger_mode = trigger
+        self.max_interval = max_interval
+        self.markers = tuple(markers)
+        self.frames = asyncio.Queue(maxsize=queue_size)  # (recording, jpeg bytes or None to close, timestamp, layer, reason)
+        self.triggered = asyncio.Event()
+        self.trigger_reason = None
+        self.layer = None
+        self.current_recording = None
+        self.last_status = None
+        self.session: aiohttp.ClientSession | None = None
+        self.captured = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def stats(self):
+        return {
+            'captured': self.captured, 'written': self.written, 'dropped': self.dropped, 'failed': self.failed,
+            'duplicates': self.timelapse.skipped,
+        }
+
+    # Driver hooks
+    def on_layer_change(self, layer=None):
+        self.layer = layer
+        self._trigger('layer')
+
+    def on_gcode(self, line):
+        if line and any(marker in line for marker in self.markers):
+            self._trigger('marker')
+
+    def _trigger(self, reason):
+        if self.trigger_mode != 'interval' and self.current_recording:
+            self.trigger_reason = reason
+            self.triggered.set()
+
+    async def fetch_snapshot(self):
+        """Fetch one JPEG, or None if the camera did not deliver one in time"""
+        if self.session is None or self.session.closed:
+            self.session = self.parent.http_pool.session(headers=self.parent.headers)
+        try:
+            timeout = aiohttp.ClientTimeout(total=max(1, self.interval * 2))
+            async with self.session.get(self.snapshot_url, timeout=timeout) as response:
+                response.raise_for_status()
+                return await response.read()  # Returns the image as bytes
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.failed += 1
+            logging.error(f"[CAMERA] Failed to fetch snapshot: {e}")
+            return None
+
+    def start_new_recording(self):
+        self.current_recording = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.layer = None
+        logging.info(f"[CAMERA] Started new recording {self.current_recording}")
+
+    def stop_recording(self):
+        # Closing goes through the queue so it happens after the recording's last frame
+        self._enqueue((self.current_recording, None, None, None, None))
+        self.current_recording = None
+
+    def _enqueue(self, frame):
+        if self.frames.full():
+            # Never wait for the disk, the newest frame is worth more than the oldest
+            self.frames.get_nowait()
+            self.dropped += 1
+            logging.warning("[CAMERA] Writer is behind, dropped the oldest frame")
+        self.frames.put_nowait(frame)
+
+    async def _wait_for_trigger(self, started):
+        if self.trigger_mode == 'interval' or not self.current_recording:
+            await asyncio.sleep(max(0, self.interval - (time.monotonic() - started)))
+            return 'interval'
+        try:
+            await asyncio.wait_for(self.triggered.wait(), self.max_interval)
+            return self.trigger_reason
+        except asyncio.TimeoutError:
+            return 'interval'
+        finally:
+            self.triggered.clear()
+
+    async def capture_images(self):
+        reason = 'interval'
+        while True:
+            started = time.monotonic()
+            try:
+                status = self.parent.updates['status']
+                if status == 'printing' and self.last_status != 'printing':
+                    self.start_new_recording()
+                elif status != 'printing' and self.last_status == 'printing':
+                    self.stop_recording()
+                self.last_status = status
+
+                if self.current_recording:
+                    recording, layer = self.current_recording, self.layer
+                    snapshot = await self.fetch_snapshot()
+                    if snapshot:
+                        self.captured += 1
+                        self._enqueue((recording, snapshot, time.time(), layer, reason))
+            except Exception as e:
+                logging.error(f"[CAMERA] Capture error: {e}")
+
+            reason = await self._wait_for_trigger(started)
+
+    async def write_frames(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            recording, snapshot, timestamp, layer, reason = await self.frames.get()
+            try:
+                if snapshot is None:
+                    if recording == self.timelapse.recording:
+                        await loop.run_in_executor(None, self.timelapse.close)
+                    continue
+                # Triggered frames are the point of the timelapse, only periodic ones are deduplicated
+                if await loop.run_in_executor(None, self.timelapse.append, recording, snapshot, timestamp, layer, reason == 'interval'):
+                    self.written += 1
+            except OSError as e:
+                logging.error(f"[CAMERA] Failed to save frame of {recording}: {e}")
+
+    async def run(self):
+        """Capture and write until cancelled"""
+        try:
+            await asyncio.gather(self.capture_images(), self.write_frames())
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+        await asyncio.get_running_loop().run_in_executor(None, self.timelapse.close)
@@ -0,0 +1,160 @@
+import asyncio
+import base64
+import io
+import logging
+import time
+import aiohttp
+from utils.outbound import PRIORITY_BULK
+
+try:
+    from PIL import Image  # Optional, enables downscaling to the requested resolution
+except ImportError:
+    Image = None
+
+
+def _downscale(jpeg, max_width, max_height, quality=75):
+    """Shrink a JPEG to fit max_width x max_height. Returns (jpeg, width, height)."""
+    with Image.open(io.BytesIO(jpeg)) as image:
+        width, height = image.size
+        if width <= max_width and height <= max_height:
+            return jpeg, width, height
+        image.draft('RGB', (max_width, max_height))  # Let the JPEG decoder do most of the scaling
+        image = image.convert('RGB')
+        image.thumbnail((max_width, max_height))
+        out = io.BytesIO()
+        image.save(out, format='JPEG', quality=quality)
+        return out.getvalue(), image.width, image.height
+
+
+class CameraRelay:
+    """
+    Relays live camera snapshots over the remote websocket while someone watches.
+
+    Viewers subscribe with the camera_stream action, asking for a frame rate
+    and a resolution cap, and must renew within viewer_timeout seconds. All
+    viewers share one upstream fetch loop running at the highest frame rate
+    and resolution any of them asked for, bounded by max_fps and
+    max_width x max_height. The loop starts with the first viewer and stops
+    when the last one leaves or its subscription lapses.
+
+    Frames go out as camera_frame at bulk priority, coalesced so that a slow
+    link only ever carries the newest frame. Without Pillow frames cannot be
+    resized, so frames larger than max_frame_bytes are dropped instead.
+    """
+
+    def __init__(self, parent, snapshot_url, max_fps=5, max_width=1280, max_height=720, max_frame_bytes=256 * 1024,
+                 viewer_timeout=30):
+        self.parent = parent  # Reference to BatchPrinterConnect
+        self.snapshot_url = snapshot_url
+        self.max_fps = max_fps
+        self.max_width = max_width
+        self.max_height = max_height
+        self.max_frame_bytes = max_frame_bytes
+        self.viewer_timeout = viewer_timeout
+        self.viewers = {}  # viewer id -> {'fps', 'width', 'height', 'expires'}
+        self.task = None
+        self.session: aiohttp.ClientSession | None = None
+        self.seq = 0
+        self.relayed = 0
+        self.oversized = 0
+        self.failed = 0
+
+    def stats(self):
+        return {'relayed': self.relayed, 'oversized': self.oversized, 'relay_failed': self.failed}
+
+    def subscribe(self, viewer, fps=None, width=None, height=None):
+        """Add or renew a viewer, starting the relay if it is the first"""
+        self.viewers[viewer] = {
+            'fps': min(float(fps or self.max_fps), self.max_fps),
+            'width': min(int(width or self.max_width), self.max_width),
+            'height': min(int(height or self.max_height), self.max_height),
+            'expires': time.monotonic() + self.viewer_timeout,
+        }
+        if self.task is None or self.task.done():
+            logging.info(f"[CAMERA-RELAY] Starting relay for viewer {viewer}")
+            self.task = asyncio.create_task(self.relay())
+
+    def unsubscribe(self, viewer):
+        if self.viewers.pop(viewer, None) is not None:
+            logging.info(f"[CAMERA-RELAY] Viewer {viewer} left, {len(self.viewers)} remaining")
+
+    def _active_viewers(self):
+        now = time.monotonic()
+        for viewer in [v for v, s in self.viewers.items() if s['expires'] < now]:
+            logging.info(f"[CAMERA-RELAY] Subscription of viewer {viewer} lapsed")
+            del self.viewers[viewer]
+        return self.viewers.values()
+
+    async def fetch_snapshot(self, timeout):
+        if self.session is None or self.session.closed:
+            self.session = self.parent.http_pool.session(headers=self.parent.headers)
+        try:
+            async with self.session.get(self.snapshot_url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                response.raise_for_status()
+                return await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.failed += 1
+            logging.warning(f"[CAMERA-RELAY] Failed to fetch snapshot: {e}")
+            return None
+
+    async def _encode(self, jpeg, width, height):
+        """Fit the frame to the requested size, or None if it cannot be sent"""
+        if Image is not None:
+            try:
+                jpeg, width, height = await asyncio.get_running_loop().run_in_executor(None, _downscale, jpeg, width, height)
+            except Exception as e:
+                logging.warning(f"[CAMERA-RELAY] Could not resize frame: {e}")
+                width = height = None
+        else:
+            width = height = None  # Unknown without decoding
+        if len(jpeg) > self.max_frame_bytes:
+            self.oversized += 1
+            logging.warning(f"[CAMERA-RELAY] Dropped a {len(jpeg)} byte frame, the limit is {self.max_frame_bytes}")
+            return None
+        return {
+            'encoding': 'jpeg+base64',
+            'width': width,
+            'height': height,
+            'data': base64.b64encode(jpeg).decode('ascii'),
+        }
+
+    async def relay(self):
+        """Fetch and send frames until nobody is watching"""
+        try:
+            while True:
+                viewers = list(self._active_viewers())
+                if not viewers or not self.parent.outbound.connected:
+                    # A reconnected server resubscribes its viewers
+                    self.viewers.clear()
+                    logging.info("[CAMERA-RELAY] No viewers left, stopping relay")
+                    return
+                started = time.monotonic()
+                period = 1 / max(max(v['fps'] for v in viewers), 0.1)
+                snapshot = await self.fetch_snapshot(timeout=max(1, period * 2))
+                if snapshot:
+                    frame = await self._encode(
+                        snapshot, max(v['width'] for v in viewers), max(v['height'] for v in viewers)
+                    )
+                    if frame is not None:
+                        self.seq += 1
+                        frame.update({'seq': self.seq, 'timestamp': time.time(), 'viewers': len(viewers)})
+                        # Only the newest frame is worth sending, and not once it is a few periods old
+                        msg = {'action': 'camera_frame', 'content': frame}
+                        if self.parent.queue_frame(msg, priority=PRIORITY_BULK, coalesce_key='camera_frame',
+                                                   max_age=max(1, period * 3)):
+                            self.relayed += 1
+                        else:
+                            self.parent.outbound.discard(msg)
+                await asyncio.sleep(max(0, period - (time.monotonic() - started)))
+        except Exception as e:
+            logging.error(f"[CAMERA-RELAY] Relay error: {e}")
+        finally:
+            if self.session and not self.session.closed:
+                await self.session.close()
+            self.session = None
+
+    async def close(self):
+        self.viewers.clear()
+        if self.task and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+
+# Lanes in priority order with their queue bounds. Each lane has its own
+# worker, so a slow command in one lane never delays another lane.
+DEFAULT_LANES = {
+    'emergency': 4,
+    'safety': 16,
+    'control': 32,
+    'transfer': 4,
+}
+
+
+class CommandExecutor:
+    """
+    Runs remote commands on separate priority lanes.
+
+    Actions are routed through a dispatch table to a (lane, handler) pair.
+    Routes registered with preempt=True cancel the command running on every
+    lower-priority lane and drop whatever is still queued there, so an
+    emergency stop is never held up by, or followed by, stale commands.
+    Routes registered with preemptible=False (bookkeeping that never moves
+    or heats the printer) are neither cancelled nor dropped.
+    Queue wait time and execution time are recorded per route, so actions
+    carrying parameters (move_x:10...) share one entry.
+    """
+
+    def __init__(self, lanes=None, on_complete=None):
+        self.lanes = list((lanes or DEFAULT_LANES).keys())
+        self.queues = {lane: asyncio.Queue(maxsize=size) for lane, size in (lanes or DEFAULT_LANES).items()}
+        self.running = {}  # lane -> task of the command currently executing
+        self.running_preemptible = {}  # lane -> whether its running command may be cancelled
+        self.exact_routes = {}  # action -> (lane, handler, preempt, preemptible)
+        self.substring_routes = []  # (fragment, lane, handler, preempt, preemptible), for actions carrying parameters
+        self.on_complete = on_complete  # on_complete(route, lane, wait_time, exec_time, outcome)
+        self.stats = {}  # route -> timing counters
+
+    def register(self, action, lane, handler, preempt=False, substring=False, preemptible=True):
+        """Route an action to handler(action, content) on lane. substring=True matches any action containing it."""
+        if substring:
+            self.substring_routes.append((action, lane, handler, preempt, preemptible))
+        else:
+            self.exact_routes[action] = (lane, handler, preempt, preemptible)
+
+    def _route(self, action):
+        if action in self.exact_routes:
+            return (action,) + self.exact_routes[action]
+        for fragment, lane, handler, preempt, preemptible in self.substring_routes:
+            if fragment in action:
+                return fragment, lane, handler, preempt, preemptible
+        return None
+
+    def _preempt_below(self, lane):
+        for lower_lane in self.lanes[self.lanes.index(lane) + 1:]:
+            queue = self.queues[lower_lane]
+            kept = []
+            dropped = 0
+            while not queue.empty():
+                item = queue.get_nowait()
+                if item[-1]:
+                    dropped += 1
+                    if self.on_complete:
+                        self.on_complete(item[1], lower_lane, time.monotonic() - item[0], 0.0, 'preempted')
+                else:
+                    kept.append(item)
+            for item in kept:
+                queue.put_nowait(item)  # Back in their original order
+            task = self.running.get(lower_lane)
+            if task and not task.done() and self.running_preemptible.get(lower_lane, True):
+                task.cancel()
+                dropped += 1
+            if dropped:
+                logging.warning(f"[COMMAND] Preempted {dropped} command(s) on the {lower_lane} lane")
+
+    def submit(self, action, content):
+        """Queue an action for execution. Returns False if it is unknown or its lane is full."""
+        route = self._route(action)
+        if route is None:
+            logging.warning(f'Unknown command: {action}')
+            return False
+        name, lane, handler, preempt, preemptible = route
+        if preempt:
+            self._preempt_below(lane)
+        try:
+            self.queues[lane].put_nowait((time.monotonic(), name, action, content, handler, preemptible))
+        except asyncio.QueueFull:
+            logging.error(f"[COMMAND] {lane} lane is full, dropping {action}")
+            return False
+        return True
+
+    def _record(self, name, wait_time, exec_time):
+        stats = self.stats.setdefault(name, {'count': 0, 'wait_total': 0.0, 'wait_max': 0.0, 'exec_total': 0.0, 'exec_max': 0.0})
+        stats['count'] += 1
+        stats['wait_total'] += wait_time
+        stats['wait_max'] = max(stats['wait_max'], wait_time)
+        stats['exec_total'] += exec_time
+        stats['exec_max'] = max(stats['exec_max'], exec_time)
+
+    async def _worker(self, lane):
+        queue = self.queues[lane]
+        while True:
+            queued_at, name, action, content, handler, preemptible = await queue.get()
+            started_at = time.monotonic()
+            task = asyncio.create_task(handler(action, content))
+            self.running[lane] = task
+            self.running_preemptible[lane] = preemptible
+            try:
+                await asyncio.wait({task})
+            finally:
+                self.running.pop(lane, None)
+                if not task.done():
+                    task.cancel()
+
+            wait_time = started_at - queued_at
+            exec_time = time.monotonic() - started_at
+            self._record(name, wait_time, exec_time)
+            if task.cancelled():
+                outcome = 'preempted'
+                logging.warning(f"[COMMAND] {action} was preempted after {exec_time * 1000:.0f}ms")
+            elif task.exception():
+                outcome = 'error'
+                logging.error(f"[COMMAND] Error executing {action}: {task.exception()}")
+            else:
+                outcome = 'ok'
+                logging.info(f"[COMMAND] {action} on {lane} lane: waited {wait_time * 1000:.0f}ms, ran {exec_time * 1000:.0f}ms")
+
+            if self.on_complete:
+                self.on_complete(name, lane, wait_time, exec_time, outcome)
+
+    async def run(self):
+        """Run one worker per lane until cancelled."""
+        await asyncio.gather(*(self._worker(lane) for lane in self.lanes))
@@ -0,0 +1,83 @@
+import bisect
+from collections import deque
+
+WARMUP_SECONDS = 300  # Estimated print time after which the observed speed is fully trusted
+WINDOW_SECONDS = 600  # How far back the observed speed is measured
+
+
+class EtaEstimator:
+    """
+    Remaining print time from the byte the printer is at, not from percent done.
+
+    The G-code analysis maps byte offsets to the estimated time and filament
+    consumed up to them, so a slow first layer or dense infill near the top
+    are already accounted for. What it cannot know is how fast this printer
+    really runs the file (acceleration, speed factor overrides), so the
+    estimate is scaled by a speed factor: at first the slicer's own estimate
+    over the analyzer's, then more and more the observed ratio of real to
+    estimated time over the last WINDOW_SECONDS of printing.
+    """
+
+    def __init__(self, metadata, index):
+        self.size = metadata['size']
+        checkpoints = index['checkpoints']
+        self.offsets = [c[0] for c in checkpoints]
+        self.times = [c[1] for c in checkpoints]
+        self.filament = [c[2] for c in checkpoints]
+        layers = index['layers']
+        self.layer_offsets = [layer[0] for layer in layers]
+        self.layer_z = [layer[1] for layer in layers]
+        self.total_time = self.times[-1]
+        self.total_filament = metadata['filament_mm']
+
+        slicer_time = metadata['slicer'].get('estimated_time')
+        self.prior_factor = slicer_time / self.total_time if slicer_time and self.total_time else 1.0
+        self.samples = deque(maxlen=1024)  # (elapsed, estimated elapsed) over the recent window
+
+    def matches(self, file_size):
+        """Whether the printer is running the file this estimator was built from"""
+        return file_size == self.size
+
+    def _interpolate(self, values, position):
+        i = bisect.bisect_right(self.offsets, position) - 1
+        if i < 0:
+            return values[0]
+        if i >= len(self.offsets) - 1:
+            return values[-1]
+        span = self.offsets[i + 1] - self.offsets[i]
+        fraction = (position - self.offsets[i]) / span if span else 0
+        return values[i] + (values[i + 1] - values[i]) * fraction
+
+    def _speed_factor(self, elapsed, estimated):
+        samples = self.samples
+        if not samples or estimated >= samples[-1][1]:
+            samples.append((elapsed, estimated))
+        else:
+            samples.clear()  # The file position went back, start over
+            samples.append((elapsed, estimated))
+        while len(samples) > 2 and samples[-1][1] - samples[1][1] >= WINDOW_SECONDS:
+            samples.popleft()
+
+        first_elapsed, first_estimated = samples[0]
+        if estimated - first_estimated > 1:
+            observed = (elapsed - first_elapsed) / (estimated - first_estimated)
+        elif estimated > 1:
+            observed = elapsed / estimated
+        else:
+            return self.prior_factor
+        trust = min(1.0, estimated / WARMUP_SECONDS)
+        return self.prior_factor * (1 - trust) + observed * trust
+
+    def update(self, file_position, elapsed):
+        """Progress at file_position after elapsed seconds of printing"""
+        estimated = self._interpolate(self.times, file_position)
+        factor = self._speed_factor(elapsed or 0.0, estimated)
+        layer = bisect.bisect_right(self.layer_offsets, file_position)
+        return {
+            'print_time_left': round(max(0.0, self.total_time - estimated) * factor),
+            'current_layer': layer,
+            'total_layers': len(self.layer_offsets),
+            'layer_z': self.layer_z[layer - 1] if layer else None,
+            'filament_remaining': round(max(0.0, self.total_filament - self._interpolate(self.filament, file_position)), 1),
+            'speed_factor': round(factor, 3),
+        }
@@ -0,0 +1,360 @@
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import re
+from collections import deque
+
+CHECKPOINT_BYTES = 64 * 1024  # Distance between byte offset checkpoints
+ANALYZE_CHUNK_SIZE = 4 * 1024 * 1024
+MAX_PENDING_BYTES = 16 * 1024 * 1024  # Transfer data waiting for a streaming analysis before it gives up
+
+# Comments that start a new layer, for the slicers that write one
+LAYER_MARKERS = (b';LAYER_CHANGE', b';LAYER:', b'; CHANGE_LAYER', b'; layer ')
+
+_DURATION = re.compile(r'(?:(\d+)d)?\s*(?:(\d+)h)?\s*(?:(\d+)m)?\s*(?:(\d+)s)?')
+
+
+def _number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _parse_duration(text):
+    """'1d 2h 3m 4s' or plain seconds"""
+    text = text.strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    match = _DURATION.fullmatch(text)
+    if not match or not any(match.groups()):
+        return None
+    days, hours, minutes, seconds = (int(g or 0) for g in match.groups())
+    return float(days * 86400 + hours * 3600 + minutes * 60 + seconds)
+
+
+def _parse_first_number(text):
+    try:
+        return float(text.strip().split(',')[0].split()[0].rstrip('m'))
+    except (ValueError, IndexError):
+        return None
+
+
+# Comments in which slicers leave their own estimates: (pattern, key, parser)
+SLICER_COMMENTS = (
+    (re.compile(rb'^; estimated printing time \(normal mode\) = (.+)$'), 'estimated_time', _parse_duration),
+    (re.compile(rb'^; model printing time: ([^;]+)'), 'estimated_time', _parse_duration),
+    (re.compile(rb'^;TIME:(\d+)'), 'estimated_time', _parse_duration),
+    (re.compile(rb'^; filament used \[mm\] = (.+)$'), 'filament_mm', _parse_first_number),
+    (re.compile(rb'^; filament used \[g\] = (.+)$'), 'filament_g', _parse_first_number),
+    (re.compile(rb'^; total filament used \[g\] = (.+)$'), 'filament_g', _parse_first_number),
+    (re.compile(rb'^;Filament used: ([\d.]+)m'), 'filament_m', _parse_first_number),
+    (re.compile(rb'^;Layer count: (\d+)'), 'layers', _parse_first_number),
+    (re.compile(rb'^; total layers count = (\d+)'), 'layers', _parse_first_number),
+    (re.compile(rb'^; total layer number: (\d+)'), 'layers', _parse_first_number),
+    (re.compile(rb'^; generated by (\S+)'), 'name', lambda text: text.strip()),
+    (re.compile(rb'^;Generated with (\S+)'), 'name', lambda text: text.strip()),
+)
+
+
+class GcodeAnalyzer:
+    """
+    Single-pass G-code analyzer, fed with chunks in file order.
+
+    Tracks the toolhead through G0/G1 moves to count layers, net filament
+    use, the bounding box of extruding moves and a rough kinematic time
+    estimate (distance over feedrate, no acceleration), and picks up the
+    estimates slicers leave in comments. Along the way it records where each
+    layer starts and, every CHECKPOINT_BYTES, how much time and filament the
+    file has consumed up to that byte, so a file position reported by the
+    printer can be turned into progress.
+
+    Only the current position and the indexes are kept, never the file, so
+    memory stays flat no matter how large the G-code is. feed() is CPU bound,
+    run it in an executor.
+    """
+
+    def __init__(self, checkpoint_bytes=CHECKPOINT_BYTES):
+        self.checkpoint_bytes = checkpoint_bytes
+        self.sha256 = hashlib.sha256()
+        self.offset = 0  # Bytes fed so far
+        self.pending = b''  # Incomplete last line of the previous chunk
+        self.position = [0.0, 0.0, 0.0]
+        self.e = 0.0
+        self.feedrate = 0.0  # mm/min
+        self.absolute = True
+        self.absolute_e = True
+        self.filament = 0.0
+        self.time = 0.0
+        self.bbox_min = [math.inf] * 3
+        self.bbox_max = [-math.inf] * 3
+        self.marker_layers = []  # [offset, z, time, filament] per slicer layer marker
+        self.z_layers = []  # Same, from the first extrusion at each new height
+        self.layer_z = None
+        self.checkpoints = [[0, 0.0, 0.0]]  # [offset, time, filament]
+        self.next_checkpoint = checkpoint_bytes
+        self.slicer = {}
+
+    def feed(self, chunk):
+        self.sha256.update(chunk)
+        data = self.pending + chunk
+        lines = data.split(b'\n')
+        self.pending = lines.pop()
+        offset = self.offset - (len(data) - len(chunk))  # File offset of data[0]
+        for line in lines:
+            self._line(line, offset)
+            offset += len(line) + 1
+        self.offset += len(chunk)
+
+    def _line(self, line, offset):
+        if offset >= self.next_checkpoint:
+            self.checkpoints.append([offset, round(self.time, 1), round(self.filament, 1)])
+            self.next_checkpoint = offset + self.checkpoint_bytes
+        comment = line.find(b';')
+        if comment >= 0:
+            if not line[:comment].strip():
+                self._comment(line.strip(), offset)
+                return
+            line = line[:comment]
+        words = line.split()
+        if not words:
+            return
+        command = words[0].upper()
+        if command == b'G1' or command == b'G0':
+            self._move(words, offset)
+        elif command == b'G92':
+            for word in words[1:]:
+                axis, value = word[:1].upper(), _number(word[1:])
+                if value is None:
+                    continue
+                if axis == b'E':
+                    self.e = value
+                elif axis and axis in b'XYZ':
+                    self.position[b'XYZ'.index(axis)] = value
+        elif command == b'G90':
+            self.absolute = True  # Like Klipper, the extruder keeps its own M82/M83 mode
+        elif command == b'G91':
+            self.absolute = False
+        elif command == b'M82':
+            self.absolute_e = True
+        elif command == b'M83':
+            self.absolute_e = False
+        elif command == b'G4':
+            for word in words[1:]:
+                value = _number(word[1:])
+                if value is not None:
+                    self.time += value / 1000 if word[:1].upper() == b'P' else value
+        elif command == b'G28':
+            self.position = [0.0, 0.0, 0.0]
+
+    def _move(self, words, offset):
+        # The hot path, most lines of a file are moves: axes are compared as byte values
+        x, y, z = position = self.position
+        extruded = 0.0
+        for word in words[1:]:
+            try:
+                value = float(word[1:])
+            except ValueError:
+                continue
+            axis = word[0] & 0xDF  # Upper case
+            if axis == 88:  # X
+                x = value if self.absolute else x + value
+            elif axis == 89:  # Y
+                y = value if self.absolute else y + value
+            elif axis == 69:  # E
+                if self.absolute_e:
+                    extruded = value - self.e
+                    self.e = value
+                else:
+                    extruded = value
+            elif axis == 90:  # Z
+                z = value if self.absolute else z + value
+            elif axis == 70:  # F
+                self.feedrate = value
+
+        dx, dy, dz = x - position[0], y - position[1], z - position[2]
+        if self.feedrate > 0:
+            distance = math.sqrt(dx * dx + dy * dy + dz * dz) or abs(extruded)
+            self.time += distance * 60 / self.feedrate
+        self.position = [x, y, z]
+        if not extruded:
+            return
+        self.filament += extruded
+        if extruded > 0 and (dx or dy):
+            low, high = self.bbox_min, self.bbox_max
+            if x < low[0]:
+                low[0] = x
+            if x > high[0]:
+                high[0] = x
+            if y < low[1]:
+                low[1] = y
+            if y > high[1]:
+                high[1] = y
+            if z < low[2]:
+                low[2] = z
+            if z > high[2]:
+                high[2] = z
+            if self.marker_layers and self.marker_layers[-1][1] is None:
+                self.marker_layers[-1][1] = round(z, 3)
+            if self.layer_z is None or z > self.layer_z:
+                self.layer_z = z
+                self.z_layers.append([offset, round(z, 3), round(self.time, 1), round(self.filament, 1)])
+
+    def _comment(self, line, offset):
+        if line.startswith(LAYER_MARKERS):
+            self.marker_layers.append([offset, None, round(self.time, 1), round(self.filament, 1)])
+            return
+        for pattern, key, parse in SLICER_COMMENTS:
+            match = pattern.match(line)
+            if match:
+                value = parse(match.group(1).decode('utf-8', 'replace'))
+                if value is not None and key not in self.slicer:
+                    self.slicer[key] = value
+                return
+
+    def finish(self):
+        """Flush the last line and return (metadata, index)"""
+        if self.pending:
+            self._line(self.pending, self.offset - len(self.pending))
+            self.pending = b''
+        layers = self.marker_layers or self.z_layers
+        slicer = dict(self.slicer)
+        if 'filament_m' in slicer:
+            slicer.setdefault('filament_mm', slicer.pop('filament_m') * 1000)
+        has_bbox = self.bbox_min[0] != math.inf
+        metadata = {
+            'sha256': self.sha256.hexdigest(),
+            'size': self.offset,
+            'layers': len(layers),
+            'filament_mm': round(self.filament, 1),
+            'estimated_time': round(self.time),
+            'bbox': {
+                'min': [round(v, 2) for v in self.bbox_min],
+                'max': [round(v, 2) for v in self.bbox_max],
+            } if has_bbox else None,
+            'slicer': slicer,
+        }
+        index = {
+            'layers': layers,
+            'checkpoints': self.checkpoints + [[self.offset, round(self.time, 1), round(self.filament, 1)]],
+        }
+        return metadata, index
+
+
+def analyze_file(path, checkpoint_bytes=CHECKPOINT_BYTES):
+    """Analyze a G-code file already on disk through a read-only memory map"""
+    analyzer = GcodeAnalyzer(checkpoint_bytes)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for start in range(0, len(mapped), ANALYZE_CHUNK_SIZE):
+                    analyzer.feed(mapped[start:start + ANALYZE_CHUNK_SIZE])
+    return analyzer.finish()
+
+
+class StreamingAnalysis:
+    """
+    Runs a GcodeAnalyzer alongside a transfer without ever slowing it down.
+
+    feed() only queues the chunk, a worker hands queued chunks to the
+    analyzer in an executor. If more than max_pending_bytes pile up because
+    parsing is slower than the link, the analysis is abandoned instead of
+    throttling the transfer, and result() returns None so the caller can
+    analyze the finished file instead.
+    """
+
+    def __init__(self, max_pending_bytes=MAX_PENDING_BYTES, checkpoint_bytes=CHECKPOINT_BYTES):
+        self.analyzer = GcodeAnalyzer(checkpoint_bytes)
+        self.max_pending_bytes = max_pending_bytes
+        self.chunks = deque()
+        self.fed_bytes = 0
+        self.pending_bytes = 0
+        self.worker = None
+        self.abandoned = False
+
+    def feed(self, chunk):
+        if self.abandoned:
+            return
+        if self.pending_bytes + len(chunk) > self.max_pending_bytes:
+            logging.warning(f"[ANALYZER] Analysis fell {self.pending_bytes} bytes behind the transfer, giving up on it")
+            self.abandoned = True
+            self.chunks.clear()
+            return
+        self.chunks.append(chunk)
+        self.fed_bytes += len(chunk)
+        self.pending_bytes += len(chunk)
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while self.chunks:
+            chunk = self.chunks.popleft()
+            await loop.run_in_executor(None, self.analyzer.feed, chunk)
+            self.pending_bytes -= len(chunk)
+
+    async def result(self, size=None):
+        """
+        Wait for the queued chunks and return (metadata, index), or None if
+        the analysis was abandoned or did not see all size bytes of the file
+        """
+        if self.worker:
+            await self.worker
+        if self.abandoned or (size is not None and self.fed_bytes != size):
+            return None
+        return await asyncio.get_running_loop().run_in_executor(None, self.analyzer.finish)
+
+
+class GcodeMetadataStore:
+    """
+    Analysis results on disk, one JSON file per content hash.
+
+    The same G-code is usually printed many times, so its analysis is kept
+    next to the G-code cache and reused instead of recomputed. Only the
+    newest max_files results are kept.
+    """
+
+    def __init__(self, directory, max_files=200):
+        self.directory = directory
+        self.max_files = max_files
+
+    def _path(self, sha256):
+        return os.path.join(self.directory, f"{sha256}.json")
+
+    def load(self, sha256):
+        """Return (metadata, index) for a content hash, or None. Blocks on disk."""
+        if not sha256:
+            return None
+        try:
+            with open(self._path(sha256), 'r') as f:
+                record = json.load(f)
+            return record['metadata'], record['index']
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning(f"[ANALYZER] Ignoring unreadable analysis of {sha256}: {e}")
+            return None
+
+    def save(self, metadata, index):
+        """Blocks on disk"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(metadata['sha256'])
+            with open(f"{path}.tmp", 'w') as f:
+                json.dump({'metadata': metadata, 'index': index}, f, separators=(',', ':'))
+            os.replace(f"{path}.tmp", path)
+            self._prune()
+        except OSError as e:
+            logging.warning(f"[ANALYZER] Failed to save analysis: {e}")
+
+    def _prune(self):
+        paths = sorted(glob.glob(os.path.join(self.directory, '*.json')), key=os.path.getmtime)
+        for path in paths[:-self.max_files]:
+            os.remove(path)
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+
+class GcodeCache:
+    """
+    LRU index of the G-code files batch-link has placed on the printer.
+
+    The cache only tracks entries; the files themselves live wherever the
+    driver put them (printer_data/gcodes for Klipper, OctoPrint's uploads
+    folder for OctoPrint). Evicted entries are handed back to the driver,
+    which is responsible for deleting the underlying file.
+    """
+
+    def __init__(self, index_path, max_size_bytes, max_age_seconds, enabled=True):
+        self.index_path = index_path
+        self.max_size_bytes = max_size_bytes
+        self.max_age_seconds = max_age_seconds
+        self.enabled = enabled
+        self.entries = OrderedDict()  # key -> {'name', 'size', 'sha256', 'created', 'last_used'}, oldest first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+
+    @staticmethod
+    def make_key(filename, url, etag=None, file_hash=None):
+        """
+        Build a cache key from the file name plus the most stable identity available.
+
+        A content hash supplied by the server wins, then the URL (without its
+        query string, which is usually a signature) plus ETag. Without either
+        the full URL is used.
+        """
+        if file_hash:
+            identity = f"hash:{file_hash}"
+        elif etag:
+            parts = urlsplit(url)
+            identity = f"etag:{parts.netloc}{parts.path}:{etag}"
+        else:
+            identity = f"url:{url}"
+        return hashlib.sha256(f"{filename}\n{identity}".encode()).hexdigest()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                entries = json.load(f)
+            self.entries = OrderedDict(sorted(entries.items(), key=lambda item: item[1]['last_used']))
+            logging.info(f"[CACHE] Loaded {len(self.entries)} cached files from {self.index_path}")
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning(f"[CACHE] Ignoring unreadable cache index {self.index_path}: {e}")
+
+    def _save(self):
+        tmp_path = f"{self.index_path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logging.warning(f"[CACHE] Failed to save cache index: {e}")
+
+    def lookup(self, key):
+        """Return the entry for key, or None. Does not count as a hit until record_hit."""
+        if not self.enabled:
+            return None
+        return self.entries.get(key)
+
+    def record_hit(self, key):
+        entry = self.entries[key]
+        entry['last_used'] = time.time()
+        self.entries.move_to_end(key)
+        self.hits += 1
+        self._save()
+
+    def record_miss(self):
+        self.misses += 1
+
+    def store(self, key, name, size):
+        """Record a freshly placed file. Entries sharing the same name were overwritten, so drop them."""
+        if not self.enabled:
+            return
+        for stale_key in [k for k, e in self.entries.items() if e['name'] == name and k != key]:
+            del self.entries[stale_key]
+        now = time.time()
+        self.entries[key] = {'name': name, 'size': size, 'sha256': None, 'created': now, 'last_used': now}
+        self.entries.move_to_end(key)
+        self._save()
+
+    def set_content_hash(self, key, content_hash):
+        """Attach a content hash learned after the file was stored"""
+        entry = self.entries.get(key)
+        if entry is not None and entry.get('sha256') != content_hash:
+            entry['sha256'] = content_hash
+            self._save()
+
+    def discard(self, key):
+        """Forget an entry whose file has disappeared from the printer."""
+        if self.entries.pop(key, None) is not None:
+            self._save()
+
+    def evict(self, protected_names=()):
+        """
+        Drop entries past the age limit, then least recently used entries until
+        the size limit is met. Returns the evicted entries so the driver can
+        delete their files. Entries named in protected_names are never evicted.
+        """
+        if not self.enabled:
+            return []
+        now = time.time()
+        evicted = []
+        for key, entry in list(self.entries.items()):
+            if entry['name'] in protected_names:
+                continue
+            if now - entry['last_used'] > self.max_age_seconds:
+                evicted.append(self.entries.pop(key))
+
+        total_size = sum(entry['size'] for entry in self.entries.values())
+        for key, entry in list(self.entries.items()):
+            if total_size <= self.max_size_bytes:
+                break
+            if entry['name'] in protected_names:
+                continue
+            evicted.append(self.entries.pop(key))
+            total_size -= entry['size']
+
+        if evicted:
+            self.evictions += len(evicted)
+            self._save()
+            logging.info(f"[CACHE] Evicted {len(evicted)} files: {[entry['name'] for entry in evicted]}")
+        return evicted
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'files': len(self.entries),
+            'size': sum(entry['size'] for entry in self.entries.values()),
+        }
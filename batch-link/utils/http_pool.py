@@ -0,0 +1,74 @@
+import logging
+import aiohttp
+
+# Central per-request timeouts, referenced by name from the printer drivers
+REQUEST_TIMEOUTS = {
+    'status': aiohttp.ClientTimeout(total=10),
+    'command': aiohttp.ClientTimeout(total=15),
+    'gcode': aiohttp.ClientTimeout(total=None, sock_connect=15),  # Scripts like G28 or M190 can run for minutes
+    'emergency': aiohttp.ClientTimeout(total=5),
+    'probe': aiohttp.ClientTimeout(total=10),
+    'download': aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=60),
+    'upload': aiohttp.ClientTimeout(total=300),
+}
+
+
+class HttpPool:
+    """
+    Keep-alive connection pool shared by every HTTP session batch-link opens.
+
+    Sessions handed out by session() borrow the pooled connector, so commands
+    reuse an open TCP connection to the printer instead of paying for a new
+    handshake each time. close() tears down the sessions and the connector.
+    """
+
+    def __init__(self, limit=16, limit_per_host=8, keepalive_timeout=60):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self._connector = None
+        self._sessions = []
+        self._download_session = None
+
+    def _ensure_connector(self):
+        if self._connector is None or self._connector.closed:
+            self._connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+        return self._connector
+
+    def session(self, headers=None, auto_decompress=True):
+        """
+        Create a session on the shared connector. The pool closes it on shutdown.
+        """
+        session = aiohttp.ClientSession(
+            connector=self._ensure_connector(),
+            connector_owner=False,
+            headers=headers,
+            auto_decompress=auto_decompress,
+        )
+        self._sessions = [s for s in self._sessions if not s.closed]
+        self._sessions.append(session)
+        return session
+
+    def download_session(self):
+        """
+        Session for fetching print files from external URLs, always over TCP
+        without printer credentials. Bodies arrive as sent, compressed or not,
+        so resumed ranges line up and utils.transfer decompresses them itself.
+        """
+        if self._download_session is None or self._download_session.closed:
+            self._download_session = self.session(auto_decompress=False)
+        return self._download_session
+
+    async def close(self):
+        for session in self._sessions:
+            if not session.closed:
+                await session.close()
+        self._sessions = []
+        if self._connector is not None and not self._connector.closed:
+            await self._connector.close()
+        logging.info("HTTP connection pool closed")
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from utils.transfer import strip_compression_suffix
+
+# Printer states, as the drivers report them in updates['status']
+IDLE_STATES = ('operational', 'ready', 'standby', 'complete', 'cancelled')
+PRINTING_STATES = ('printing', 'printing from sd', 'starting', 'paused', 'pausing', 'resuming', 'finishing', 'cancelling')
+CHECK_INTERVAL = 1  # Seconds between checks of the printer state
+
+
+class JobQueue:
+    """
+    Local queue of print jobs, started one after another as the bed is cleared.
+
+    Jobs arrive with the enqueue_print action. While the current print runs,
+    the next prefetch_count jobs are fetched through the driver's
+    prefetch_file, one at a time, rate limited to max_rate bytes per second
+    and never while a foreground print transfer is running. A prefetched file
+    sits in the G-code cache, so once bed_cleared arrives and the printer is
+    idle the next job starts from it within seconds. A job whose prefetch
+    failed is simply downloaded when it starts.
+
+    A print that starts leaves the bed occupied until the next bed_cleared.
+    The queue and the bed state survive restarts in a small JSON file.
+    """
+
+    def __init__(self, parent, path, prefetch_count=2, max_rate=None, enabled=True):
+        self.parent = parent  # Reference to BatchPrinterConnect
+        self.path = path
+        self.prefetch_count = prefetch_count
+        self.max_rate = max_rate
+        self.enabled = enabled
+        self.jobs = []  # {'id', 'file_name', 'url', 'hash', 'state', 'progress', 'error', 'stored_name', 'cache_key', 'added'}
+        self.bed_clear = False
+        self.started = 0
+        self.wake = asyncio.Event()
+        self.prefetch_task = None
+        self.prefetching = None  # The job prefetch_task is fetching
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+            self.jobs = saved['jobs']
+            self.bed_clear = saved['bed_clear']
+            for job in self.jobs:
+                if job['state'] == 'prefetching':
+                    job.update(state='queued', progress=None)  # Interrupted, starts over
+            if self.jobs:
+                logging.info(f"[QUEUE] Loaded {len(self.jobs)} queued jobs from {self.path}")
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning(f"[QUEUE] Ignoring unreadable job queue {self.path}: {e}")
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump({'jobs': self.jobs, 'bed_clear': self.bed_clear}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"[QUEUE] Failed to save job queue: {e}")
+
+    def state(self):
+        """Queue state for printer updates"""
+        return {
+            'enabled': self.enabled,
+            'bed_clear': self.bed_clear,
+            'started': self.started,
+            'jobs': [
+                {key: job[key] for key in ('id', 'file_name', 'state', 'progress', 'error')}
+                for job in self.jobs
+            ],
+        }
+
+    def _changed(self):
+        self._save()
+        self.parent.updates['job_queue'] = self.state()
+        self.parent.update_data_changed = True
+        self.wake.set()
+
+    def protected_names(self):
+        """Stored names of prefetched files, which cache eviction must keep"""
+        return {job['stored_name'] for job in self.jobs if job.get('stored_name')}
+
+    def enqueue(self, file_name, url, file_hash=None, job_id=None, position=None):
+        """Add a job, at the end or at index position. Returns its id."""
+        job = {
+            'id': str(job_id or uuid.uuid4()),
+            'file_name': file_name,
+            'url': url,
+            'hash': file_hash,
+            'state': 'queued',
+            'progress': None,
+            'error': None,
+            'stored_name': None,
+            'cache_key': None,
+            'added': time.time(),
+        }
+        self.remove(job['id'])  # Enqueueing a known id again replaces it
+        self.jobs.insert(len(self.jobs) if position is None else int(position), job)
+        logging.info(f"[QUEUE] Queued {file_name} as job {job['id']}, {len(self.jobs)} job(s) waiting")
+        self._changed()
+        return job['id']
+
+    def remove(self, job_id=None):
+        """Drop the job with job_id, or every job when job_id is None. Returns how many were dropped."""
+        dropped = [job for job in self.jobs if job_id is None or job['id'] == str(job_id)]
+        if not dropped:
+            return 0
+        if self.prefetching in dropped and self.prefetch_task and not self.prefetch_task.done():
+            self.prefetch_task.cancel()
+        self.jobs = [job for job in self.jobs if job not in dropped]
+        logging.info(f"[QUEUE] Removed {len(dropped)} job(s), {len(self.jobs)} waiting")
+        self._changed()
+        return len(dropped)
+
+    def mark_bed_cleared(self):
+        logging.info("[QUEUE] Bed cleared")
+        self.bed_clear = True
+        self._changed()
+
+    async def _prefetch(self, job):
+        last_reported = 0
+
+        def on_progress(done, total):
+            nonlocal last_reported
+            if total:
+                job['progress'] = round(done / total * 100, 1)
+                if job['progress'] - last_reported >= 5:
+                    last_reported = job['progress']
+                    self.parent.updates['job_queue'] = self.state()
+                    self.parent.update_data_changed = True
+
+        logging.info(f"[QUEUE] Prefetching {job['file_name']} for job {job['id']}")
+        job.update(state='prefetching', progress=0.0, error=None)
+        self._changed()
+        try:
+            job['stored_name'], job['cache_key'] = await self.parent.printer.prefetch_file(
+                job['file_name'], job['url'], job['hash'], on_progress=on_progress, max_rate=self.max_rate
+            )
+            job.update(state='ready', progress=100.0)
+            logging.info(f"[QUEUE] {job['file_name']} is ready to print")
+        except asyncio.CancelledError:
+            job.update(state='queued', progress=None)
+            raise
+        except Exception as e:
+            # Not fatal, the file is downloaded when the job starts
+            self.parent.record_error('prefetch')
+            logging.error(f"[QUEUE] Prefetch of {job['file_name']} failed: {e}")
+            job.update(state='failed', progress=None, error=str(e))
+        finally:
+            self.prefetching = None
+            self._changed()
+
+    def yield_to(self, file_name):
+        """
+        Cancel the prefetch of a file with the same name as file_name, which
+        is about to be printed: both would land on the same path.
+        """
+        job = self.prefetching
+        if job is None or not self.prefetch_task or self.prefetch_task.done():
+            return
+        if strip_compression_suffix(os.path.basename(job['file_name'])) == strip_compression_suffix(os.path.basename(file_name)):
+            logging.info(f"[QUEUE] Cancelling prefetch of {job['file_name']}, a print of the same name is starting")
+            self.prefetch_task.cancel()
+
+    def _prefetch_next(self):
+        if self.prefetch_task and not self.prefetch_task.done():
+            return
+        if self.parent.current_print_task and not self.parent.current_print_task.done():
+            return  # A print transfer has the link
+        # Fetching over the file being printed would replace it under the printer
+        printing = strip_compression_suffix(os.path.basename(self.parent.updates.get('file_name') or ''))
+        for job in self.jobs[:self.prefetch_count]:
+            if job['state'] == 'queued' and strip_compression_suffix(os.path.basename(job['file_name'])) != printing:
+                self.prefetching = job
+                self.prefetch_task = asyncio.create_task(self._prefetch(job))
+                return
+
+    async def _start_next(self):
+        job = self.jobs.pop(0)
+        if self.prefetching is job and self.prefetch_task and not self.prefetch_task.done():
+            self.prefetch_task.cancel()  # Fetched in the foreground instead, at full speed
+        self.bed_clear = False  # This print will occupy it
+        self.started += 1
+        logging.info(f"[QUEUE] Starting job {job['id']}: {job['file_name']} ({job['state']}), {len(self.jobs)} left")
+        self._changed()
+        await self.parent.start_print(job['file_name'], job['url'], job['hash'], cache_key=job.get('cache_key'))
+
+    async def _check(self):
+        status = (self.parent.updates.get('status') or '').lower()
+        if status in PRINTING_STATES and self.bed_clear:
+            self.bed_clear = False  # Something was started outside the queue
+            self._changed()
+        transferring = self.parent.current_print_task and not self.parent.current_print_task.done()
+        if self.jobs and self.bed_clear and status in IDLE_STATES and not transferring:
+            await self._start_next()
+        if self.prefetch_count > 0:
+            self._prefetch_next()
+
+    async def run(self):
+        """Start queued jobs as the bed is cleared, and prefetch the next ones, until cancelled"""
+        if not self.enabled:
+            return
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            try:
+                await self._check()
+            except Exception as e:
+                logging.error(f"[QUEUE] Error: {e}")
+
+    async def close(self):
+        if self.prefetch_task and not self.prefetch_task.done():
+            self.prefetch_task.cancel()
+            await asyncio.gather(self.prefetch_task, return_exceptions=True)
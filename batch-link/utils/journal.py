@@ -0,0 +1,138 @@
+import asyncio
+import base64
+import copy
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+
+class OfflineJournal:
+    """
+    Bounded, append-only on-disk journal of what happened while the remote
+    websocket was down.
+
+    Records are JSON lines split across small segment files. Printer updates
+    are stored as the keys that changed since the previous record, events
+    (printer_busy, printer_ready, ...) as the frame itself. Once the journal
+    grows past max_bytes the oldest segment is deleted, so a long outage costs
+    a fixed amount of SD card space. On reconnect every segment is replayed as
+    one gzip-compressed frame and the journal is cleared.
+
+    Records are serialized as they come in but written by a background task
+    in an executor, so a slow SD card never stalls the event loop.
+    """
+
+    def __init__(self, directory, max_bytes=4 * 1024 * 1024, segment_bytes=512 * 1024, enabled=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.enabled = enabled
+        self.last_snapshot = None  # Printer updates as of the last journaled record
+        self.dropped_segments = 0
+        self.pending = []  # Serialized records not yet on disk
+        self.flush_task = None
+        self.lock = threading.Lock()  # Between the writer and the replay reader, both in executors
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'journal-*.jsonl')))
+
+    def _current_segment(self):
+        segments = self._segments()
+        if segments and os.path.getsize(segments[-1]) < self.segment_bytes:
+            return segments[-1]
+        index = int(os.path.basename(segments[-1])[8:-6]) + 1 if segments else 1
+        return os.path.join(self.directory, f'journal-{index:06d}.jsonl')
+
+    def _enforce_limit(self):
+        segments = self._segments()
+        total = sum(os.path.getsize(segment) for segment in segments)
+        while total > self.max_bytes and len(segments) > 1:
+            oldest = segments.pop(0)
+            total -= os.path.getsize(oldest)
+            os.remove(oldest)
+            self.dropped_segments += 1
+            logging.warning(f"[JOURNAL] Journal full, dropped oldest segment {oldest}")
+
+    def _write(self, lines):
+        try:
+            with self.lock:
+                with open(self._current_segment(), 'a') as f:
+                    f.write(''.join(lines))
+                self._enforce_limit()
+        except OSError as e:
+            logging.error(f"[JOURNAL] Failed to write journal: {e}")
+
+    async def _flush_pending(self):
+        loop = asyncio.get_running_loop()
+        while self.pending:
+            lines, self.pending = self.pending, []
+            await loop.run_in_executor(None, self._write, lines)
+
+    def _append(self, record):
+        if not self.enabled:
+            return
+        self.pending.append(json.dumps(record) + '\n')
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_pending())
+
+    async def flush(self):
+        """Wait until every journaled record is on disk"""
+        if self.flush_task is not None:
+            await self.flush_task
+
+    def record_update(self, updates):
+        """Journal the printer update keys that changed since the last record."""
+        if self.last_snapshot is None:
+            changes = updates
+        else:
+            changes = {
+                key: value for key, value in updates.items()
+                if key not in self.last_snapshot or self.last_snapshot[key] != value
+            }
+        if not changes:
+            return
+        self._append({'t': time.time(), 'type': 'update', 'content': changes})
+        self.last_snapshot = copy.deepcopy(updates)
+
+    def record_event(self, msg):
+        self._append({'t': time.time(), 'type': 'event', 'action': msg.get('action'), 'content': msg.get('content')})
+
+    def has_entries(self):
+        return self.enabled and bool(self.pending or self._segments())
+
+    def build_replay_frames(self):
+        """
+        Read the journal into printer_journal frames, one per segment, then
+        clear it. Blocking, run it in an executor after flush().
+        """
+        with self.lock:
+            return self._read_and_clear()
+
+    def _read_and_clear(self):
+        segments = self._segments()
+        frames = []
+        for part, segment in enumerate(segments, start=1):
+            with open(segment, 'rb') as f:
+                raw = f.read()
+            frames.append({
+                'action': 'printer_journal',
+                'content': {
+                    'part': part,
+                    'parts': len(segments),
+                    'records': raw.count(b'\n'),
+                    'dropped_segments': self.dropped_segments,
+                    'encoding': 'jsonl+gzip+base64',
+                    'data': base64.b64encode(gzip.compress(raw)).decode('ascii'),
+                }
+            })
+        for segment in segments:
+            os.remove(segment)
+        self.last_snapshot = None
+        self.dropped_segments = 0
+        return frames
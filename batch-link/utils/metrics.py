@@ -0,0 +1,200 @@
+import asyncio
+import logging
+from aiohttp import web
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COMMAND_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+THROUGHPUT_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100)  # MB/s
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Mirror a total that is already counted elsewhere, e.g. Backoff.reconnects"""
+        self.values[tuple(labels.get(name, '') for name in self.labelnames)] = value
+
+    def render(self):
+        for key, value in self.values.items():
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Gauge(Counter):
+    """A value that can go up and down."""
+
+    type = 'gauge'
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, with their sum and count."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.values = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[i] += 1
+                break
+        entry[-2] += value
+        entry[-1] += 1
+
+    def mean(self, **labels):
+        entry = self.values.get(tuple(labels.get(name, '') for name in self.labelnames))
+        return entry[-2] / entry[-1] if entry and entry[-1] else None
+
+    def render(self):
+        for key, entry in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_value(entry[-2])}'
+            yield f'{self.name}_count{labels} {entry[-1]}'
+
+
+class Metrics:
+    """
+    Process-wide metrics, rendered in the Prometheus text format.
+
+    Timings are observed where they happen. Totals that other components
+    already keep (reconnects, dropped frames, ...) are mirrored in by
+    collectors, which run right before every render.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+        self.poll_latency = self.histogram(
+            'batch_link_printer_poll_seconds', 'Latency of printer status requests',
+            ('printer', 'driver', 'endpoint'))
+        self.send_latency = self.histogram(
+            'batch_link_websocket_send_seconds', 'Time to send one frame on the remote websocket',
+            ('action',))
+        self.command_time = self.histogram(
+            'batch_link_command_seconds', 'Execution time of remote commands',
+            ('printer', 'action', 'lane'), buckets=COMMAND_BUCKETS)
+        self.transfer_throughput = self.histogram(
+            'batch_link_transfer_mb_per_second', 'Throughput of print_file transfers',
+            ('printer', 'driver'), buckets=THROUGHPUT_BUCKETS)
+        self.transfer_compression = self.gauge(
+            'batch_link_transfer_compression_ratio', 'Plain over transferred size of the last print_file download',
+            ('printer',))
+        self.errors = self.counter(
+            'batch_link_errors_total', 'Errors by printer, driver and where they happened',
+            ('printer', 'driver', 'source'))
+        self.commands = self.counter(
+            'batch_link_commands_total', 'Remote commands by outcome',
+            ('printer', 'action', 'outcome'))
+        self.reconnects = self.counter(
+            'batch_link_reconnects_total', 'Successful reconnects per connection',
+            ('printer', 'connection'))
+        self.outbound_frames = self.counter(
+            'batch_link_outbound_frames_total', 'Frames handled by the outbound queue',
+            ('result',))
+        self.camera_frames = self.counter(
+            'batch_link_camera_frames_total', 'Camera snapshots by what happened to them',
+            ('printer', 'result'))
+        self.outbound_depth = self.gauge(
+            'batch_link_outbound_queue_depth', 'Frames waiting to be sent')
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logging.error(f"[METRICS] Collector failed: {e}")
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, printer):
+        """The compact per-printer summary that can ride along in printer_update"""
+        polls = [entry for key, entry in self.poll_latency.values.items() if key[0] == printer]
+        poll_count = sum(entry[-1] for entry in polls)
+        return {
+            'poll_latency_avg': sum(entry[-2] for entry in polls) / poll_count if poll_count else None,
+            'send_latency_avg': self.send_latency.mean(action='printer_update'),
+            'errors': sum(v for k, v in self.errors.values.items() if k[0] == printer),
+            'commands': sum(v for k, v in self.commands.values.items() if k[0] == printer),
+        }
+
+    async def serve(self, host, port):
+        """Serve GET /metrics until cancelled"""
+        async def handle_metrics(request):
+            return web.Response(text=self.render(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+        app = web.Application()
+        app.add_routes([web.get('/metrics', handle_metrics)])
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            try:
+                await web.TCPSite(runner, host, port).start()
+            except OSError as e:
+                # Metrics are optional, the agent keeps running without them
+                logging.error(f"[METRICS] Cannot listen on {host}:{port}: {e}")
+                return
+            logging.info(f"[METRICS] Serving /metrics on {host}:{port}")
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
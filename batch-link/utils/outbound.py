@@ -0,0 +1,161 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import time
+import websockets
+
+# Lower numbers are sent first
+PRIORITY_CONTROL = 0  # printer_busy / printer_ready and other state transitions
+PRIORITY_UPDATE = 1  # printer_update frames
+PRIORITY_ALIVE = 2  # keep-alive heartbeats
+PRIORITY_BULK = 3  # large, best-effort payloads
+
+
+def merge_printer_updates(pending, newer):
+    """
+    Coalesce two queued printer update frames into one.
+
+    A newer full snapshot replaces whatever is pending. A newer delta is folded
+    into the pending frame, keeping the pending frame's base so the server can
+    still check it against the last frame it received.
+    """
+    if newer['action'] == 'printer_update':
+        return newer
+    merged = dict(pending)
+    merged['seq'] = newer['seq']
+    merged['content'] = {**pending['content'], **newer['content']}
+    return merged
+
+
+class OutboundQueue:
+    """
+    Single writer for the remote websocket.
+
+    Every outgoing frame goes through put() and is sent by run(), the only task
+    that calls websocket.send. Frames leave in priority order. Frames sharing a
+    coalesce key are merged while they wait, so at most one printer update is
+    ever pending. Frames past their max_age are dropped instead of sent, and
+    under congestion the lowest priority frames are shed first.
+    """
+
+    def __init__(self, max_depth=64, on_send=None):
+        self.max_depth = max_depth
+        self.on_send = on_send  # on_send(action, latency) after every successful send
+        self.websocket = None
+        self._heap = []  # [priority, order, queued_at, max_age, msg, coalesce_key]
+        self._pending = {}  # coalesce_key -> heap entry
+        self._order = itertools.count()
+        self._ready = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.last_send_latency = 0.0
+        self.max_send_latency = 0.0
+
+    @property
+    def connected(self):
+        return self.websocket is not None
+
+    def attach(self, websocket):
+        """Hand the socket to the writer once the connection is authenticated."""
+        self.websocket = websocket
+        self._ready.set()
+
+    def detach(self):
+        self.websocket = None
+        if self._heap:
+            logging.info(f"[OUTBOUND] Discarding {len(self._heap)} frames queued for a closed connection")
+            self.dropped += len(self._heap)
+        self._heap = []
+        self._pending = {}
+
+    def put(self, msg, priority=PRIORITY_CONTROL, coalesce_key=None, merge=None, max_age=None):
+        """
+        Queue a frame for sending. Returns False, without queueing it, if the
+        websocket is not connected: the caller decides whether to keep the frame
+        for later or give it up with discard().
+        """
+        if self.websocket is None:
+            return False
+
+        if coalesce_key is not None and coalesce_key in self._pending:
+            entry = self._pending[coalesce_key]
+            entry[4] = merge(entry[4], msg) if merge else msg
+            self.coalesced += 1
+            return True
+
+        entry = [priority, next(self._order), time.monotonic(), max_age, msg, coalesce_key]
+        heapq.heappush(self._heap, entry)
+        if coalesce_key is not None:
+            self._pending[coalesce_key] = entry
+        self._shed_load()
+        self._ready.set()
+        return True
+
+    def discard(self, msg):
+        """Count a frame put() refused and the caller has no other way to deliver."""
+        self.dropped += 1
+        logging.warning(f"WebSocket not connected — cannot send {msg.get('action')}")
+
+    def _shed_load(self):
+        while len(self._heap) > self.max_depth:
+            # Drop the oldest frame of the lowest priority
+            victim = max(self._heap, key=lambda entry: (entry[0], -entry[1]))
+            self._heap.remove(victim)
+            heapq.heapify(self._heap)
+            if victim[5] is not None:
+                self._pending.pop(victim[5], None)
+            self.dropped += 1
+            logging.warning(f"[OUTBOUND] Queue congested, dropped {victim[4].get('action')}")
+
+    async def drain(self, timeout):
+        """Wait up to timeout seconds for the queued frames to be sent."""
+        deadline = time.monotonic() + timeout
+        while self._heap and self.websocket is not None and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+    def stats(self):
+        return {
+            'depth': len(self._heap),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'last_send_latency': self.last_send_latency,
+            'max_send_latency': self.max_send_latency,
+        }
+
+    async def run(self):
+        """Writer task: drain the queue onto whichever websocket is attached."""
+        while True:
+            await self._ready.wait()
+            websocket = self.websocket
+            if websocket is None or not self._heap:
+                self._ready.clear()
+                continue
+
+            priority, _, queued_at, max_age, msg, coalesce_key = heapq.heappop(self._heap)
+            if coalesce_key is not None:
+                self._pending.pop(coalesce_key, None)
+            if max_age is not None and time.monotonic() - queued_at > max_age:
+                self.dropped += 1
+                logging.info(f"[OUTBOUND] Dropped outdated {msg.get('action')}")
+                continue
+
+            try:
+                start = time.monotonic()
+                await websocket.send(json.dumps(msg))
+                self.last_send_latency = time.monotonic() - start
+                self.max_send_latency = max(self.max_send_latency, self.last_send_latency)
+                self.sent += 1
+                if self.on_send:
+                    self.on_send(msg.get('action'), self.last_send_latency)
+            except websockets.exceptions.ConnectionClosed as e:
+                logging.info(f"[OUTBOUND] Websocket error, connection closed: {e}")
+                self.dropped += 1
+                if self.websocket is websocket:
+                    self.detach()
+            except Exception as e:
+                self.dropped += 1
+                logging.error(f"[OUTBOUND] Failed to send {msg.get('action')}: {e}")
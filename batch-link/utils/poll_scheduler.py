@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+
+OFFLINE_STATES = {None, 'unresponsive', 'offline', 'error', 'closed', 'connecting', 'offline after error'}
+HEATING_TOLERANCE = 2.0  # °C away from target still counts as heating
+HEATING_SLOPE = 0.5  # °C/s of change counts as heating or cooling
+FINISHING_PROGRESS = 95.0
+
+
+class PollScheduler:
+    """
+    Picks how long the printer drivers wait between status polls.
+
+    The interval depends on what the printer is doing: short while heating or
+    close to finishing a print, long while idle or offline. wake() cuts the
+    current wait short so a poll happens right after a command is executed.
+    Intervals are read from the [poll_intervals] section of batch-link.cfg.
+    """
+
+    def __init__(self, config, default_interval):
+        defaults = {
+            'heating': 1,
+            'finishing': 1,
+            'printing': default_interval,
+            'paused': default_interval,
+            'idle': 10,
+            'offline': 15,
+        }
+        self.intervals = {
+            state: config.getfloat('poll_intervals', state.upper(), fallback=fallback)
+            for state, fallback in defaults.items()
+        }
+        self._wake_event = asyncio.Event()
+        self._last_sample = None  # (time, nozzle temperature, bed temperature)
+        self.last_state = None
+
+    def _temperature_slope(self, updates):
+        now = time.time()
+        nozzle = updates.get('nozzle_temperature')
+        bed = updates.get('bed_temperature')
+        slope = 0.0
+        if self._last_sample and nozzle is not None and bed is not None:
+            last_time, last_nozzle, last_bed = self._last_sample
+            elapsed = now - last_time
+            if elapsed > 0 and last_nozzle is not None and last_bed is not None:
+                slope = max(abs(nozzle - last_nozzle), abs(bed - last_bed)) / elapsed
+        self._last_sample = (now, nozzle, bed)
+        return slope
+
+    @staticmethod
+    def _is_away_from_target(actual, target):
+        try:
+            return target > 0 and abs(target - actual) > HEATING_TOLERANCE
+        except TypeError:
+            return False
+
+    def classify(self, updates):
+        """Reduce the current printer updates to one of the poll interval states."""
+        status = (updates.get('status') or '').lower() or None
+        slope = self._temperature_slope(updates)
+
+        if status in OFFLINE_STATES:
+            return 'offline'
+        if (slope >= HEATING_SLOPE
+                or self._is_away_from_target(updates.get('nozzle_temperature'), updates.get('nozzle_temperature_target'))
+                or self._is_away_from_target(updates.get('bed_temperature'), updates.get('bed_temperature_target'))):
+            return 'heating'
+        if status == 'printing':
+            if (updates.get('progress') or 0) >= FINISHING_PROGRESS:
+                return 'finishing'
+            return 'printing'
+        if status in ('paused', 'pausing'):
+            return 'paused'
+        return 'idle'
+
+    def next_interval(self, updates):
+        state = self.classify(updates)
+        if state != self.last_state:
+            logging.info(f"[POLL] Printer is {state}, polling every {self.intervals[state]}s")
+            self.last_state = state
+        return self.intervals[state]
+
+    def wake(self):
+        """Poll again right away, e.g. after a command was sent to the printer."""
+        self._wake_event.set()
+
+    async def wait(self, updates):
+        """Sleep until the next poll is due or wake() is called."""
+        try:
+            await asyncio.wait_for(self._wake_event.wait(), timeout=self.next_interval(updates))
+        except asyncio.TimeoutError:
+            pass
+        self._wake_event.clear()
@@ -0,0 +1,152 @@
+import base64
+import bisect
+import sys
+from array import array
+
+COLUMNS = ('nozzle', 'nozzle_target', 'bed', 'bed_target')
+MISSING = -32768  # Packed value for a sample the printer did not report
+
+
+def _b64(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+
+class TemperatureHistory:
+    """
+    Fixed-size ring buffer of timestamped nozzle and bed temperatures.
+
+    Samples are stored column-wise in preallocated arrays (8 bytes for the
+    timestamp, 4 per temperature), so a full day at one sample per second
+    costs about 2MB no matter how long the print runs, and the oldest samples
+    are overwritten once it is full. Unlike printer_update, every sample is
+    kept, not only changes past the 0.7°C deadband.
+    """
+
+    def __init__(self, capacity, min_interval=1.0):
+        self.capacity = capacity
+        self.min_interval = min_interval
+        self.times = array('d', bytes(8 * capacity))
+        self.values = {column: array('f', bytes(4 * capacity)) for column in COLUMNS}
+        self.start = 0  # Physical index of the oldest sample
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _physical(self, logical):
+        return (self.start + logical) % self.capacity
+
+    def _time_at(self, logical):
+        return self.times[self._physical(logical)]
+
+    @property
+    def last_time(self):
+        return self._time_at(self.count - 1) if self.count else None
+
+    def record(self, timestamp, nozzle, nozzle_target, bed, bed_target):
+        """Add a sample, skipping it if it arrives sooner than min_interval after the last one."""
+        last = self.last_time
+        if last is not None and timestamp - last < self.min_interval:
+            return False
+        if self.count < self.capacity:
+            index = self._physical(self.count)
+            self.count += 1
+        else:
+            index = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.times[index] = timestamp
+        for column, value in zip(COLUMNS, (nozzle, nozzle_target, bed, bed_target)):
+            self.values[column][index] = float('nan') if value is None else value
+        return True
+
+    def _first_after(self, since):
+        """Logical index of the first sample newer than since"""
+        if since is None:
+            return 0
+        # Timestamps are ascending in logical order, so the ring can be bisected in place
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._time_at(middle) <= since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _slice(self, values, first, last):
+        """Copy logical samples [first, last) of one column out of the ring, oldest first"""
+        start, end = self._physical(first), self._physical(last - 1) + 1
+        if start < end:
+            return values[start:end]
+        return values[start:] + values[:end]
+
+    def pack(self, since=None, limit=None):
+        """
+        Samples newer than since, oldest first, as a packed batch.
+
+        Timestamps are uint32 deciseconds from start and temperatures int16
+        decidegrees (MISSING when unknown), each column little-endian and
+        base64 encoded. until is the timestamp of the last packed sample, to
+        pass back as since for the next batch.
+        """
+        first = self._first_after(since)
+        last = self.count if limit is None else min(self.count, first + limit)
+        if first >= last:
+            return None
+        times = self._slice(self.times, first, last)
+        start = times[0]
+        packed = {'t': array('I', [round((t - start) * 10) for t in times])}
+        for column in COLUMNS:
+            packed[column] = array('h', [
+                MISSING if v != v else max(-32767, min(32767, round(v * 10)))
+                for v in self._slice(self.values[column], first, last)
+            ])
+        return {
+            'encoding': 'columns+le+base64',
+            'start': start,
+            'until': times[-1],
+            'count': last - first,
+            'remaining': self.count - last,
+            **{name: _b64(values) for name, values in packed.items()},
+        }
+
+    def downsample(self, buckets, since=None, until=None):
+        """
+        Min, max and average per column for buckets equal time slices. Empty
+        buckets are None. There are never more buckets than samples in the window.
+        """
+        first = self._first_after(since)
+        if first >= self.count or buckets < 1:
+            return None
+        times = self._slice(self.times, first, self.count)
+        start = times[0]
+        end = until if until is not None else times[-1]
+        buckets = max(1, min(buckets, bisect.bisect_right(times, end)))
+        width = max((end - start) / buckets, 1e-6)
+        # Sample index where each bucket starts, the last bucket also takes samples at end
+        bounds = [bisect.bisect_left(times, start + width * i) for i in range(buckets)]
+        bounds.append(bisect.bisect_right(times, end))
+
+        series = {}
+        for column in COLUMNS:
+            values = self._slice(self.values[column], first, self.count)
+            mins, maxs, avgs = [], [], []
+            for low, high in zip(bounds, bounds[1:]):
+                bucket = values[low:high]
+                total = sum(bucket)
+                if total != total:  # NaN, the printer did not report some samples
+                    bucket = [v for v in bucket if v == v]
+                    total = sum(bucket)
+                if not bucket:
+                    mins.append(None)
+                    maxs.append(None)
+                    avgs.append(None)
+                    continue
+                mins.append(round(min(bucket), 1))
+                maxs.append(round(max(bucket), 1))
+                avgs.append(round(total / len(bucket), 1))
+            series[column] = {'min': mins, 'max': maxs, 'avg': avgs}
+        return {'start': start, 'bucket_seconds': width, 'buckets': buckets, **series}
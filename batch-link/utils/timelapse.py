@@ -0,0 +1,164 @@
+import glob
+import io
+import logging
+import os
+import struct
+
+try:
+    from PIL import Image  # Optional, enables pixel-based duplicate detection
+except ImportError:
+    Image = None
+
+# One index record per frame: byte offset and length in the .mjpeg file,
+# capture timestamp and layer number (-1 when unknown), little-endian
+INDEX_RECORD = struct.Struct('<QIdi')
+THUMBNAIL_SIZE = (16, 16)
+
+
+def _thumbnail(jpeg):
+    try:
+        with Image.open(io.BytesIO(jpeg)) as image:
+            image.draft('L', (THUMBNAIL_SIZE[0] * 8, THUMBNAIL_SIZE[1] * 8))  # Let the JPEG decoder downscale
+            return image.convert('L').resize(THUMBNAIL_SIZE).tobytes()
+    except Exception as e:
+        logging.warning(f"[TIMELAPSE] Could not decode frame: {e}")
+        return None
+
+
+class TimelapseWriter:
+    """
+    Builds one timelapse container per recording, a frame at a time.
+
+    Frames are appended to <recording>.mjpeg, a plain concatenation of the
+    JPEGs that ffmpeg reads as an MJPEG stream, and located by fixed-size
+    records in <recording>.idx. Frames that look the same as the last kept
+    one are skipped: with Pillow installed by comparing 16x16 grayscale
+    thumbnails, otherwise by JPEG size alone. Once the recordings in
+    output_dir take more than quota_bytes, the oldest ones are deleted.
+
+    Every method blocks on disk, run them in an executor.
+    """
+
+    def __init__(self, output_dir, quota_bytes, duplicate_threshold=2.0, size_threshold=0.002):
+        self.output_dir = output_dir
+        self.quota_bytes = quota_bytes
+        self.duplicate_threshold = duplicate_threshold  # Mean grayscale difference, 0-255
+        self.size_threshold = size_threshold  # Relative JPEG size difference, without Pillow
+        self.recording = None
+        self.container = None
+        self.index = None
+        self.last_signature = None
+        self.used_bytes = None  # Running total of output_dir, recomputed when the quota is hit
+        self.over_quota = False  # The current recording alone fills the quota, stop adding to it
+        self.frames = 0
+        self.skipped = 0
+        self.evicted = 0
+
+    def _paths(self, recording):
+        base = os.path.join(self.output_dir, recording)
+        return base + '.mjpeg', base + '.idx'
+
+    def _recordings(self):
+        """Recording names, oldest first"""
+        names = {os.path.splitext(os.path.basename(p))[0] for p in glob.glob(os.path.join(self.output_dir, '*.mjpeg'))}
+        return sorted(names)
+
+    def _disk_usage(self):
+        total = 0
+        for recording in self._recordings():
+            for path in self._paths(recording):
+                try:
+                    total += os.path.getsize(path)
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def start(self, recording):
+        self.close()
+        os.makedirs(self.output_dir, exist_ok=True)
+        container_path, index_path = self._paths(recording)
+        self.container = open(container_path, 'ab')
+        self.index = open(index_path, 'ab')
+        self.recording = recording
+        self.last_signature = None
+        self.over_quota = False
+        if self.used_bytes is None:
+            self.used_bytes = self._disk_usage()
+        logging.info(f"[TIMELAPSE] Recording into {container_path}")
+
+    def close(self):
+        for f in (self.container, self.index):
+            if f:
+                f.close()
+        self.container = self.index = None
+        self.recording = None
+
+    def _signature(self, jpeg):
+        if Image is not None:
+            return _thumbnail(jpeg)
+        return len(jpeg)
+
+    def _is_duplicate(self, signature):
+        last = self.last_signature
+        if last is None or signature is None or type(last) is not type(signature):
+            return False
+        if isinstance(signature, bytes):
+            difference = sum(abs(a - b) for a, b in zip(signature, last)) / len(signature)
+            return difference < self.duplicate_threshold
+        return abs(signature - last) / max(last, 1) < self.size_threshold
+
+    def append(self, recording, jpeg, timestamp, layer=None, skip_duplicates=True):
+        """Append a frame to recording, returning False if it was skipped as a duplicate"""
+        if recording != self.recording:
+            self.start(recording)
+        if self.over_quota:
+            return False
+
+        signature = self._signature(jpeg)
+        if skip_duplicates and self._is_duplicate(signature):
+            self.skipped += 1
+            return False
+        self.last_signature = signature
+
+        offset = self.container.tell()
+        self.container.write(jpeg)
+        self.container.flush()
+        self.index.write(INDEX_RECORD.pack(offset, len(jpeg), timestamp, -1 if layer is None else layer))
+        self.index.flush()
+        self.frames += 1
+        self.used_bytes += len(jpeg) + INDEX_RECORD.size
+        if self.used_bytes > self.quota_bytes:
+            self._enforce_quota()
+        return True
+
+    def _enforce_quota(self):
+        self.used_bytes = self._disk_usage()
+        for recording in self._recordings():
+            if self.used_bytes <= self.quota_bytes:
+                break
+            if recording == self.recording:
+                continue
+            for path in self._paths(recording):
+                try:
+                    self.used_bytes -= os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self.evicted += 1
+            logging.info(f"[TIMELAPSE] Quota reached, deleted recording {recording}")
+        if self.used_bytes > self.quota_bytes:
+            self.over_quota = True
+            logging.warning(f"[TIMELAPSE] Recording {self.recording} alone fills the quota, no more frames will be added")
+
+    def stats(self):
+        return {'frames': self.frames, 'skipped': self.skipped, 'evicted': self.evicted, 'used_bytes': self.used_bytes}
+
+
+def read_index(index_path):
+    """Yield (offset, length, timestamp, layer) for every frame of a recording"""
+    with open(index_path, 'rb') as f:
+        while True:
+            record = f.read(INDEX_RECORD.size)
+            if len(record) < INDEX_RECORD.size:
+                return
+            yield INDEX_RECORD.unpack(record)
@@ -0,0 +1,532 @@
+import asyncio
+import aiohttp
+import hashlib
+import logging
+import os
+import re
+import time
+import uuid
+import zlib
+
+try:
+    import zstandard  # Optional, enables .zst and zstd-encoded downloads
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024 * 4  # 4MB chunks
+DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (compatible; PiPrinter/1.0)',
+    'Accept-Encoding': 'gzip, deflate, zstd' if zstandard else 'gzip, deflate',
+}
+
+DOWNLOAD_RETRIES = 5  # Consecutive failed attempts without progress before a download gives up
+RETRY_BASE_DELAY = 1  # Seconds, doubled on every consecutive failure
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+PARALLEL_MIN_PART = 16 * 1024 * 1024  # Ranges smaller than this are not worth their own connection
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+HASH_ALGORITHMS = {32: 'md5', 40: 'sha1', 64: 'sha256'}  # By hex digest length
+
+# Compressed files are recognised by Content-Encoding, then file suffix, then Content-Type
+COMPRESSED_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+COMPRESSED_TYPES = {'application/gzip': 'gzip', 'application/x-gzip': 'gzip', 'application/zstd': 'zstd'}
+DECOMPRESS_SLICE = 64 * 1024  # Compressed input per decompression step
+DECOMPRESS_MAX_OUTPUT = 1024 * 1024  # Decompressed zlib output per step, bounds memory on highly compressed input
+DECOMPRESS_ERRORS = (zlib.error,) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+class TransferVerificationError(aiohttp.ClientError):
+    """The downloaded file does not match the length or hash it should have."""
+
+
+class UnsupportedEncodingError(aiohttp.ClientError):
+    """The file is compressed in a format batch-link cannot decompress here."""
+
+
+def compression_from_name(name):
+    """The compression a file or URL path suffix implies, or None"""
+    path = name.split('?', 1)[0].lower()
+    return next((encoding for suffix, encoding in COMPRESSED_SUFFIXES.items() if path.endswith(suffix)), None)
+
+
+def strip_compression_suffix(filename):
+    """part.gcode.gz -> part.gcode, the name the printer should see"""
+    for suffix in COMPRESSED_SUFFIXES:
+        if filename.lower().endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+class StreamDecompressor:
+    """
+    Decompresses a gzip, zlib/deflate or zstd stream chunk by chunk.
+
+    decompress() yields the output in pieces. Input is fed in small slices,
+    and zlib output is also capped at DECOMPRESS_MAX_OUTPUT per step, so a
+    chunk of highly compressed G-code never expands into memory all at once.
+    zstandard has no such cap: each input slice comes out whole, which bounds
+    memory for ordinary G-code but not for a deliberately crafted stream.
+    Corrupt input raises TransferVerificationError. With encoding None chunks
+    pass through untouched.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.zlib = self.zstd = None
+        if encoding in ('gzip', 'x-gzip', 'deflate'):
+            self.zlib = zlib.decompressobj(zlib.MAX_WBITS | 32)  # Detects the gzip or zlib header
+        elif encoding == 'zstd':
+            if zstandard is None:
+                raise UnsupportedEncodingError("zstd compressed download, but the zstandard package is not installed")
+            self.zstd = zstandard.ZstdDecompressor().decompressobj()
+        elif encoding not in (None, 'identity'):
+            raise UnsupportedEncodingError(f"Unsupported compression {encoding}")
+
+    def _errors(self, steps):
+        try:
+            yield from steps
+        except DECOMPRESS_ERRORS as e:
+            raise TransferVerificationError(f"Corrupt {self.encoding} stream: {e}") from e
+
+    def decompress(self, chunk):
+        return self._errors(self._decompress(chunk))
+
+    def finish(self):
+        """Yield what is left, raising if the compressed stream ended early"""
+        return self._errors(self._finish())
+
+    def _decompress(self, chunk):
+        if self.zlib is None and self.zstd is None:
+            yield chunk
+            return
+        for start in range(0, len(chunk), DECOMPRESS_SLICE):
+            data = chunk[start:start + DECOMPRESS_SLICE]
+            if self.zstd is not None:
+                piece = self.zstd.decompress(data)
+                if piece:
+                    yield piece
+                continue
+            while data:
+                if self.zlib.eof:
+                    # Concatenated gzip members, as produced by parallel compressors
+                    data = self.zlib.unused_data + data
+                    self.zlib = zlib.decompressobj(zlib.MAX_WBITS | 32)
+                piece = self.zlib.decompress(data, DECOMPRESS_MAX_OUTPUT)
+                data = self.zlib.unconsumed_tail
+                if piece:
+                    yield piece
+                elif not data:
+                    break
+
+    def _finish(self):
+        if self.zlib is not None:
+            while True:
+                piece = self.zlib.decompress(b'', DECOMPRESS_MAX_OUTPUT)
+                if not piece:
+                    break
+                yield piece
+            if not self.zlib.eof:
+                raise TransferVerificationError("Compressed stream is truncated")
+        elif self.zstd is not None and not getattr(self.zstd, 'eof', True):
+            raise TransferVerificationError("Compressed stream is truncated")
+
+
+async def probe_etag(session, url, timeout=10):
+    """Return the ETag of url from a HEAD request, or None if the server doesn't provide one."""
+    try:
+        async with session.head(url, headers=DOWNLOAD_HEADERS, timeout=timeout, allow_redirects=True) as response:
+            if response.status < 300:
+                return response.headers.get('ETag')
+            logging.info(f"HEAD {url} returned {response.status}, no ETag available")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.info(f"Could not probe ETag for {url}: {e}")
+    return None
+
+
+def expected_digest(file_hash):
+    """
+    (algorithm, hex digest) for a server-supplied hash, either 'sha256:<hex>'
+    or a bare hex digest recognised by its length. None if it can't be checked.
+    """
+    if not file_hash or not isinstance(file_hash, str):
+        return None
+    algorithm, _, digest = file_hash.strip().rpartition(':')
+    digest = digest.lower()
+    algorithm = algorithm.lower().replace('-', '') or HASH_ALGORITHMS.get(len(digest))
+    if algorithm not in hashlib.algorithms_available or not re.fullmatch(r'[0-9a-f]+', digest):
+        return None
+    return algorithm, digest
+
+
+def _fsync_and_close(f):
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _preallocate(f, size):
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except (AttributeError, OSError):
+        f.truncate(size)  # Sparse, but still lets every range write at its own offset
+
+
+def _hash_file(f, algorithm):
+    hasher = hashlib.new(algorithm)
+    f.seek(0)
+    for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+        hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _verify(size, expected_size, digests, expected):
+    """digests are the candidates, the hash may be of the file as printed or as transferred"""
+    if expected_size is not None and size != expected_size:
+        raise TransferVerificationError(f"Downloaded {size} bytes, expected {expected_size}")
+    if expected and expected[1] not in digests:
+        raise TransferVerificationError(f"{expected[0]} mismatch: got {digests[0]}, expected {expected[1]}")
+
+
+def _encoding(url, state):
+    if state.get('encoding', 'identity') != 'identity':
+        return state['encoding']
+    return compression_from_name(url) or COMPRESSED_TYPES.get(state.get('content_type'))
+
+
+def _file_changed(state, response):
+    """Whether response carries a different ETag or Last-Modified than the file download started with"""
+    for key, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified')):
+        recorded, current = state.get(key), response.headers.get(header)
+        if recorded and current and recorded != current:
+            return True
+    return False
+
+
+async def _fetch_range(session, url, sink, start=0, end=None, timeout=60, retries=DOWNLOAD_RETRIES,
+                       chunk_size=CHUNK_SIZE, state=None, max_rate=None, on_restart=None):
+    """
+    GET bytes [start, end) of url, or from start to the end of the file when
+    end is None, passing every chunk to await sink(offset, chunk) in order.
+
+    A dropped connection, timeout or retryable status is retried after a
+    backoff, resuming with a Range request from the first byte not yet
+    received. If the server ignores the Range the bytes already received are
+    skipped. Any response carrying another ETag or Last-Modified than state
+    recorded means the file changed on the server, and so does a whole file
+    sent back on resume without validators to prove it is the same one:
+    the bytes received so far, by this call or by the parallel ranges
+    sharing state, are useless. With on_restart the sink is reset by await
+    on_restart() and the download starts over, otherwise
+    TransferVerificationError is raised. The retry budget resets whenever
+    data arrives, so a slow but moving transfer never gives up. state
+    collects the total size and ETag reported by the server. max_rate caps the average bytes per second, for
+    transfers that should not compete for the link. Returns the offset reached.
+    """
+    state = {} if state is None else state
+    position = start
+    failures = 0
+    started = time.monotonic()
+    while True:
+        headers = dict(DOWNLOAD_HEADERS)
+        if position or end is not None:
+            headers['Range'] = f"bytes={position}-{'' if end is None else end - 1}"
+            if state.get('etag') and not state['etag'].startswith('W/'):
+                headers['If-Range'] = state['etag']  # A changed file comes back whole, not spliced
+        try:
+            async with session.get(url, headers=headers, timeout=timeout) as response:
+                if response.status == 416 and state.get('total') is not None and position >= state['total']:
+                    return position
+                response.raise_for_status()
+                resumed = position > start
+                unproven = resumed and response.status != 206 and not (state.get('etag') or state.get('last_modified'))
+                if _file_changed(state, response) or unproven:
+                    if on_restart is None:
+                        raise TransferVerificationError(f"{url} changed on the server at {position} bytes")
+                    logging.warning(f"Download of {url} cannot resume at {position} bytes, the file changed; starting over")
+                    await on_restart()
+                    state.clear()
+                    position = start
+                    if resumed and response.status == 206:
+                        continue  # Ask again for the file from the start
+                skip = 0
+                if response.status == 206:
+                    match = CONTENT_RANGE.fullmatch(response.headers.get('Content-Range', ''))
+                    if not match or int(match.group(1)) != position:
+                        raise TransferVerificationError(f"Unexpected Content-Range {response.headers.get('Content-Range')}")
+                    if match.group(3) != '*':
+                        state['total'] = int(match.group(3))
+                else:
+                    skip = position  # The server sent the whole file
+                    if response.content_length is not None:
+                        state['total'] = response.content_length
+                encoding = response.headers.get('Content-Encoding', 'identity').lower()
+                if state.setdefault('encoding', encoding) != encoding:
+                    # Resumed bytes of a different representation cannot be spliced on
+                    raise TransferVerificationError(f"Content-Encoding changed from {state['encoding']} to {encoding} on resume")
+                state.setdefault('content_type', response.content_type)
+                state.setdefault('etag', response.headers.get('ETag'))
+                state.setdefault('last_modified', response.headers.get('Last-Modified'))
+                state['ranges'] = response.status == 206 or response.headers.get('Accept-Ranges') == 'bytes'
+
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk, skip = chunk[dropped:], skip - dropped
+                        if not chunk:
+                            continue
+                    if end is not None and position + len(chunk) > end:
+                        chunk = chunk[:end - position]
+                    await sink(position, chunk)
+                    position += len(chunk)
+                    failures = 0
+                    if max_rate:
+                        ahead = (position - start) / max_rate - (time.monotonic() - started)
+                        if ahead > 0:
+                            await asyncio.sleep(ahead)
+                    if end is not None and position >= end:
+                        return position
+
+                expected_end = end if end is not None else state.get('total')
+                if expected_end is not None and position < expected_end:
+                    raise aiohttp.ClientPayloadError(f"Response ended at {position} of {expected_end} bytes")
+                return position
+        except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, aiohttp.ClientResponseError, asyncio.TimeoutError) as e:
+            if isinstance(e, aiohttp.ClientResponseError) and e.status not in RETRYABLE_STATUS:
+                raise
+            failures += 1
+            if failures > retries:
+                raise
+            delay = RETRY_BASE_DELAY * 2 ** (failures - 1)
+            logging.warning(f"Download interrupted at {position} bytes ({e!r}), resuming in {delay}s ({failures}/{retries})")
+            await asyncio.sleep(delay)
+
+
+async def download_to_file(session, url, file_path, on_progress=None, timeout=60, on_chunk=None,
+                           file_hash=None, retries=DOWNLOAD_RETRIES, parallel=1, parallel_min_part=PARALLEL_MIN_PART,
+                           stats=None, max_rate=None):
+    """
+    Stream a download straight to disk without holding the file in memory.
+
+    Every chunk is written to a hidden temp file next to file_path as it
+    arrives, and handed to on_chunk if given. Dropped connections resume
+    from the last byte written instead of starting over. With parallel > 1
+    and a server that supports ranges, a large file is split into that many
+    ranges fetched concurrently into a preallocated temp file; on_chunk is
+    not called then, as chunks arrive out of order.
+
+    Gzip, deflate and zstd compressed files (by Content-Encoding, .gz/.zst
+    suffix or Content-Type) are decompressed as they stream in, so only the
+    plain G-code touches the disk. Those are always fetched sequentially.
+    max_rate limits a sequential download to that many bytes per second.
+
+    If the file changes on the server while a dropped download resumes, the
+    temp file is truncated and the download starts over instead of splicing
+    two versions together.
+
+    Before the temp file is fsynced and atomically renamed over file_path,
+    its length is checked against what the server announced and its hash
+    against file_hash when given (of either the compressed or the plain
+    file), so readers never see a partial or corrupt file. Returns the
+    number of bytes written; stats, if given, receives the bytes transferred
+    and the compression used.
+    """
+    loop = asyncio.get_running_loop()
+    directory, name = os.path.split(file_path)
+    # Unique, so two downloads to the same name (a prefetch and a print) never share a temp file
+    tmp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}.part")
+    start_time = time.time()
+    expected = expected_digest(file_hash)
+    hasher = hashlib.new(expected[0]) if expected else None
+    wire_hasher = hashlib.new(expected[0]) if expected else None
+    state = {}
+    received = 0
+    last_log_time = time.time()
+
+    def report(size):
+        nonlocal received, last_log_time
+        received += size
+        if on_progress:
+            on_progress(received, state.get('total') or 0)
+        current_time = time.time()
+        if current_time - last_log_time > 5:
+            elapsed = current_time - start_time
+            speed = received / elapsed / 1024 / 1024 if elapsed > 0 else 0
+            logging.info(f'Downloaded {received/(1024*1024):.1f}MB of {(state.get("total") or 0)/(1024*1024):.1f}MB ({speed:.2f} MB/s)')
+            last_log_time = current_time
+
+    f = await loop.run_in_executor(None, open, tmp_path, 'w+b')
+    try:
+        parts = None
+        if parallel > 1 and not compression_from_name(url):
+            # One byte tells whether the server does ranges and how large the file is
+            await _fetch_range(session, url, lambda offset, chunk: asyncio.sleep(0), 0, 1, timeout, retries, state=state)
+            total = state.get('total')
+            if state.get('ranges') and total and total >= 2 * parallel_min_part and not _encoding(url, state):
+                count = min(parallel, total // parallel_min_part)
+                bounds = [total * i // count for i in range(count + 1)]
+                parts = list(zip(bounds, bounds[1:]))
+
+        if parts:
+            logging.info(f"Downloading {state['total']/(1024*1024):.1f}MB as {len(parts)} parallel ranges")
+            await loop.run_in_executor(None, _preallocate, f, state['total'])
+
+            async def write_at(offset, chunk):
+                await loop.run_in_executor(None, os.pwrite, f.fileno(), chunk, offset)
+                report(len(chunk))
+
+            workers = [
+                asyncio.create_task(_fetch_range(session, url, write_at, start, end, timeout, retries, state=state))
+                for start, end in parts
+            ]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for worker in workers:
+                    worker.cancel()
+            wire_bytes = bytes_written = received
+            digests = (await loop.run_in_executor(None, _hash_file, f, expected[0]),) if expected else ()
+        else:
+            decompressor = None
+            bytes_written = 0
+
+            def write(pieces):
+                nonlocal bytes_written
+                pieces = list(pieces)  # Decompression runs here, off the event loop
+                for piece in pieces:
+                    f.write(piece)
+                    bytes_written += len(piece)
+                    if hasher:
+                        hasher.update(piece)
+                return pieces
+
+            async def append(offset, chunk):
+                nonlocal decompressor
+                if decompressor is None:
+                    decompressor = StreamDecompressor(_encoding(url, state))
+                if wire_hasher:
+                    wire_hasher.update(chunk)
+                for piece in await loop.run_in_executor(None, write, decompressor.decompress(chunk)):
+                    if on_chunk:
+                        on_chunk(piece)
+                report(len(chunk))
+
+            def truncate():
+                f.seek(0)
+                f.truncate()
+
+            async def restart():
+                # on_chunk already saw the old prefix; a streaming analysis then fails its length check
+                nonlocal decompressor, bytes_written, received, hasher, wire_hasher
+                await loop.run_in_executor(None, truncate)
+                decompressor = None
+                bytes_written = received = 0
+                if expected:
+                    hasher, wire_hasher = hashlib.new(expected[0]), hashlib.new(expected[0])
+
+            wire_bytes = await _fetch_range(session, url, append, timeout=timeout, retries=retries, state=state,
+                                            max_rate=max_rate, on_restart=restart)
+            if decompressor is not None:
+                for piece in await loop.run_in_executor(None, write, decompressor.finish()):
+                    if on_chunk:
+                        on_chunk(piece)
+            digests = (hasher.hexdigest(), wire_hasher.hexdigest()) if expected else ()
+
+        _verify(wire_bytes, state.get('total'), digests, expected)
+        await loop.run_in_executor(None, _fsync_and_close, f)
+        await loop.run_in_executor(None, os.replace, tmp_path, file_path)
+    except BaseException:
+        f.close()
+        await loop.run_in_executor(None, _remove_quietly, tmp_path)
+        raise
+
+    if stats is not None:
+        stats.update({'bytes': bytes_written, 'wire_bytes': wire_bytes, 'encoding': _encoding(url, state)})
+    return bytes_written
+
+
+PIPE_CHUNK_SIZE = 1024 * 256  # 256KB chunks
+PIPE_QUEUE_SIZE = 8  # Chunks buffered between download and upload
+
+
+async def download_to_queue(session, url, queue, on_progress=None, timeout=60, on_chunk=None,
+                            file_hash=None, retries=DOWNLOAD_RETRIES, stats=None, max_rate=None):
+    """
+    Stream a download into a bounded asyncio.Queue for a concurrent consumer.
+
+    Blocks whenever the queue is full, so memory stays bounded to
+    PIPE_QUEUE_SIZE chunks. Dropped connections resume where they left off,
+    the consumer never notices, unless the file changed on the server in the
+    meantime, which fails the download as what was queued cannot be taken
+    back. Compressed files are decompressed on the
+    way, so the consumer always gets plain G-code. A None sentinel marks
+    the end of the stream, and is only queued once length and hash checked
+    out; if the download fails the exception is queued so the consumer
+    aborts too. max_rate limits the download to that many bytes per second.
+    Returns the number of bytes queued; stats, if given, receives the bytes
+    transferred and the compression used.
+    """
+    expected = expected_digest(file_hash)
+    hasher = hashlib.new(expected[0]) if expected else None
+    wire_hasher = hashlib.new(expected[0]) if expected else None
+    state = {}
+    decompressor = None
+    wire_bytes = 0
+    bytes_queued = 0
+
+    async def put_pieces(pieces):
+        nonlocal bytes_queued
+        for piece in pieces:
+            await queue.put(piece)
+            if hasher:
+                hasher.update(piece)
+            if on_chunk:
+                on_chunk(piece)
+            bytes_queued += len(piece)
+
+    async def put(offset, chunk):
+        nonlocal decompressor, wire_bytes
+        if decompressor is None:
+            decompressor = StreamDecompressor(_encoding(url, state))
+        if wire_hasher:
+            wire_hasher.update(chunk)
+        await put_pieces(decompressor.decompress(chunk))
+        wire_bytes += len(chunk)
+        if on_progress:
+            on_progress(wire_bytes, state.get('total') or 0)
+
+    try:
+        await _fetch_range(session, url, put, timeout=timeout, retries=retries, chunk_size=PIPE_CHUNK_SIZE, state=state,
+                           max_rate=max_rate)
+        if decompressor is not None:
+            await put_pieces(decompressor.finish())
+        digests = (hasher.hexdigest(), wire_hasher.hexdigest()) if expected else ()
+        _verify(wire_bytes, state.get('total'), digests, expected)
+    except Exception as e:
+        await queue.put(e)
+        raise
+
+    await queue.put(None)
+    if stats is not None:
+        stats.update({'bytes': bytes_queued, 'wire_bytes': wire_bytes, 'encoding': _encoding(url, state)})
+    return bytes_queued
+
+
+async def iter_queue(queue, on_progress=None):
+    """Yield chunks from a download_to_queue producer until its end sentinel."""
+    bytes_consumed = 0
+    while True:
+        chunk = await queue.get()
+        if chunk is None:
+            return
+        if isinstance(chunk, Exception):
+            raise chunk
+        bytes_consumed += len(chunk)
+        if on_progress:
+            on_progress(bytes_consumed)
+        yield chunk
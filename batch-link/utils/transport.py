@@ -0,0 +1,44 @@
+import logging
+import socket
+from urllib.parse import urlsplit
+
+DEFAULT_PRINTER_URL = 'http://localhost'
+DEFAULT_OCTOPRINT_BACKEND_URL = 'http://127.0.0.1:5000'
+
+
+def _is_reachable(url):
+    parts = urlsplit(url)
+    try:
+        with socket.create_connection((parts.hostname, parts.port or 80), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+
+def resolve_printer_transport(config, driver):
+    """
+    Decide which URL reaches the local printer API.
+
+    PRINTER_TRANSPORT in connection_settings is one of:
+      tcp  - always use PRINTER_URL (default http://localhost)
+      auto - when PRINTER_URL is not set, prefer OctoPrint's backend port
+             (OCTOPRINT_BACKEND_URL) if it is available, skipping the haproxy
+             front end, and fall back to http://localhost otherwise. An
+             explicit PRINTER_URL is always used as is.
+    Moonraker's Unix socket speaks its own JSON-RPC framing rather than HTTP,
+    so Klipper printers always go through PRINTER_URL.
+    """
+    settings = config['connection_settings']
+    transport = settings.get('PRINTER_TRANSPORT', 'tcp').strip().lower()
+    printer_url = settings.get('PRINTER_URL', DEFAULT_PRINTER_URL).strip().rstrip('/')
+
+    if transport == 'auto' and driver == 'OCTOPRINT' and 'PRINTER_URL' not in settings:
+        backend_url = settings.get('OCTOPRINT_BACKEND_URL', DEFAULT_OCTOPRINT_BACKEND_URL).strip().rstrip('/')
+        if _is_reachable(backend_url):
+            logging.info(f"[TRANSPORT] Found OctoPrint backend, using {backend_url}")
+            return backend_url
+    elif transport not in ('tcp', 'auto'):
+        logging.warning(f"[TRANSPORT] Unknown PRINTER_TRANSPORT={transport}, using tcp")
+
+    logging.info(f"[TRANSPORT] Using {printer_url}")
+    return printer_url
@@ -0,0 +1,323 @@
+"""
+Local stand-ins for everything batch-link talks to: the remote websocket
+server, OctoPrint, Moonraker and the host serving G-code downloads.
+
+Every fake records what it received with a time.monotonic() timestamp, so the
+harness can measure latencies against the moment it triggered something.
+"""
+import asyncio
+import hashlib
+import json
+import time
+
+import websockets
+from aiohttp import web
+
+
+class FakeRemote:
+    """The batch-link server side of the remote websocket."""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.websocket = None
+        self.authenticated = asyncio.Event()
+        self.frames = []  # (received_at, frame)
+        self._frame_added = asyncio.Event()
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}"
+
+    async def start(self):
+        self.server = await websockets.serve(self._handler, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handler(self, websocket, path=None):
+        self.websocket = websocket
+        async for raw in websocket:
+            frame = json.loads(raw)
+            self.frames.append((time.monotonic(), frame))
+            self._frame_added.set()
+            if frame.get('action') == 'auth':
+                self.authenticated.set()
+
+    async def send(self, action, content):
+        """Send a command to the agent, returning when it was sent"""
+        sent_at = time.monotonic()
+        await self.websocket.send(json.dumps({'action': action, 'content': content}))
+        return sent_at
+
+    async def wait_for_frame(self, predicate, since, timeout):
+        """Wait for the first frame received after since that matches predicate"""
+        deadline = time.monotonic() + timeout
+        while True:
+            for received_at, frame in self.frames:
+                if received_at >= since and predicate(frame):
+                    return received_at, frame
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self._frame_added.clear()
+            try:
+                await asyncio.wait_for(self._frame_added.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+
+class FakePrinter:
+    """Shared plumbing for the fake printer HTTP APIs."""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.runner = None
+        self.requests = []  # (received_at, method, path)
+        self._request_added = asyncio.Event()
+        self.bed_temperature = 21.0
+        self.nozzle_temperature = 22.0
+        self.uploads = []  # (finished_at, filename, size)
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def routes(self):
+        raise NotImplementedError
+
+    @web.middleware
+    async def _record(self, request, handler):
+        self.requests.append((time.monotonic(), request.method, request.path))
+        self._request_added.set()
+        return await handler(request)
+
+    async def start(self):
+        app = web.Application(middlewares=[self._record], client_max_size=1024 ** 3)
+        app.add_routes(self.routes())
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def wait_for_request(self, method, path, since, timeout):
+        """Wait for the first request to method/path received after since"""
+        deadline = time.monotonic() + timeout
+        while True:
+            for received_at, req_method, req_path in self.requests:
+                if received_at >= since and req_method == method and req_path == path:
+                    return received_at
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self._request_added.clear()
+            try:
+                await asyncio.wait_for(self._request_added.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    def set_bed_temperature(self, value):
+        self.bed_temperature = value
+
+    async def _ok(self, request):
+        return web.Response(status=204)
+
+
+class FakeOctoPrint(FakePrinter):
+    """OctoPrint REST API, file uploads and the SockJS push API."""
+
+    def routes(self):
+        return [
+            web.post('/api/login', self._login),
+            web.get('/api/printer', self._printer),
+            web.get('/api/job', self._job),
+            web.post('/api/job', self._ok),
+            web.post('/api/connection', self._ok),
+            web.post('/api/printer/command', self._ok),
+            web.post('/api/printer/tool', self._ok),
+            web.post('/api/printer/bed', self._ok),
+            web.post('/api/printer/printhead', self._ok),
+            web.post('/api/files/local', self._upload),
+            web.get('/api/files/local/{name}', self._file_info),
+            web.post('/api/files/local/{name}', self._ok),
+            web.delete('/api/files/local/{name}', self._ok),
+            web.get('/sockjs/websocket', self._push_api),
+        ]
+
+    async def _login(self, request):
+        return web.json_response({'name': 'bench', 'session': 'bench-session'})
+
+    async def _printer(self, request):
+        return web.json_response({
+            'state': {'text': 'Operational'},
+            'temperature': {
+                'bed': {'actual': self.bed_temperature, 'target': 0.0},
+                'tool0': {'actual': self.nozzle_temperature, 'target': 0.0},
+            },
+        })
+
+    async def _job(self, request):
+        return web.json_response({
+            'state': 'Operational',
+            'job': {'file': {'name': None}},
+            'progress': {'completion': None, 'printTime': None, 'printTimeLeft': None},
+        })
+
+    async def _upload(self, request):
+        reader = await request.multipart()
+        filename, size = None, 0
+        async for part in reader:
+            if part.name == 'file':
+                filename = part.filename
+                while True:
+                    chunk = await part.read_chunk(256 * 1024)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+        self.uploads.append((time.monotonic(), filename, size))
+        self._request_added.set()
+        return web.json_response({'files': {'local': {'path': filename}}}, status=201)
+
+    async def wait_for_upload(self, since, timeout):
+        """Wait for an upload that finished after since, returning when it did"""
+        deadline = time.monotonic() + timeout
+        while True:
+            for finished_at, _, _ in self.uploads:
+                if finished_at >= since:
+                    return finished_at
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self._request_added.clear()
+            try:
+                await asyncio.wait_for(self._request_added.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    async def _file_info(self, request):
+        for _, filename, size in self.uploads:
+            if filename == request.match_info['name']:
+                return web.json_response({'name': filename, 'size': size})
+        return web.Response(status=404)
+
+    async def _push_api(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_str('o')
+        async for _ in ws:
+            pass
+        return ws
+
+
+class FakeMoonraker(FakePrinter):
+    """Moonraker REST API and JSON-RPC websocket with status subscriptions."""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__(host, port)
+        self.subscribers = set()
+
+    def routes(self):
+        return [
+            web.get('/printer/objects/query', self._query),
+            web.post('/printer/gcode/script', self._rpc_ok),
+            web.post('/printer/emergency_stop', self._rpc_ok),
+            web.post('/printer/print/start', self._rpc_ok),
+            web.post('/printer/print/cancel', self._rpc_ok),
+            web.post('/printer/print/pause', self._rpc_ok),
+            web.post('/printer/print/resume', self._rpc_ok),
+            web.post('/printer/restart', self._rpc_ok),
+            web.get('/websocket', self._websocket),
+        ]
+
+    def status(self):
+        return {
+            'extruder': {'temperature': self.nozzle_temperature, 'target': 0.0},
+            'heater_bed': {'temperature': self.bed_temperature, 'target': 0.0},
+            'print_stats': {'state': 'standby', 'filename': '', 'print_duration': 0.0},
+            'virtual_sdcard': {'progress': 0.0, 'file_position': 0},
+        }
+
+    async def _query(self, request):
+        return web.json_response({'result': {'status': self.status()}})
+
+    async def _rpc_ok(self, request):
+        return web.json_response({'result': 'ok'})
+
+    async def _websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        try:
+            async for raw in ws:
+                msg = json.loads(raw.data)
+                if msg.get('method') == 'printer.objects.subscribe':
+                    self.subscribers.add(ws)
+                    await ws.send_json({'jsonrpc': '2.0', 'id': msg['id'], 'result': {'status': self.status()}})
+        finally:
+            self.subscribers.discard(ws)
+        return ws
+
+    def set_bed_temperature(self, value):
+        super().set_bed_temperature(value)
+        notification = {
+            'jsonrpc': '2.0',
+            'method': 'notify_status_update',
+            'params': [{'heater_bed': {'temperature': value}}, time.time()],
+        }
+        for ws in list(self.subscribers):
+            asyncio.ensure_future(ws.send_json(notification))
+
+
+class FakeFileHost:
+    """Serves generated G-code of any size without holding it in memory."""
+
+    LINE = b'G1 X100.000 Y100.000 E0.04000 F1800 ; benchmark filler\n'
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def file_url(self, size_bytes, tag):
+        return f"{self.url}/files/{tag}.gcode?size={size_bytes}"
+
+    async def start(self):
+        app = web.Application()
+        app.add_routes([web.route('*', '/files/{name}', self._serve)])
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def _serve(self, request):
+        size = int(request.query['size'])
+        etag = hashlib.sha1(f"{request.match_info['name']}:{size}".encode()).hexdigest()
+        headers = {'Content-Length': str(size), 'ETag': f'"{etag}"', 'Content-Type': 'text/x-gcode'}
+        if request.method == 'HEAD':
+            return web.Response(headers=headers)
+
+        response = web.StreamResponse(headers=headers)
+        await response.prepare(request)
+        block = self.LINE * (256 * 1024 // len(self.LINE))
+        remaining = size
+        while remaining > 0:
+            chunk = block[:remaining]
+            await response.write(chunk)
+            remaining -= len(chunk)
+        await response.write_eof()
+        return response
@@ -0,0 +1,317 @@
+"""
+End-to-end benchmarks for batch-link against local stand-ins.
+
+Starts a fake remote server, a fake printer (OctoPrint or Moonraker) and a
+G-code file host, runs batch-link.py as a subprocess pointed at them through
+BATCH_LINK_CONFIG, and reports:
+
+  - command-to-printer latency per remote action
+  - update propagation delay from a printer state change to the server
+  - print_file transfer throughput and the agent's peak RSS while it runs
+  - agent CPU time per hour while idle
+
+Usage:
+    python benchmarks/run.py [--driver octoprint|klipper|all] [--iterations 10]
+                             [--transfer-mb 100] [--idle-seconds 60]
+                             [--json results.json] [--baseline results.json]
+
+With --baseline the run fails (exit code 1) when a latency p95, the transfer
+throughput, peak RSS or idle CPU is worse than the baseline by more than
+--tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from fakes import FakeFileHost, FakeMoonraker, FakeOctoPrint, FakeRemote
+
+AGENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'batch-link')
+
+# action, content, and the printer request it must cause
+COMMANDS = {
+    'OCTOPRINT': [
+        ('emergency_stop', {}, 'POST', '/api/printer/command'),
+        ('pause_print', {}, 'POST', '/api/job'),
+        ('resume_print', {}, 'POST', '/api/job'),
+        ('stop_print', {}, 'POST', '/api/job'),
+        ('cmd', 'G28', 'POST', '/api/printer/command'),
+        ('heat_printer', {}, 'POST', '/api/printer/tool'),
+        ('move_x:10_y:0_z:0', {}, 'POST', '/api/printer/printhead'),
+    ],
+    'KLIPPER': [
+        ('emergency_stop', {}, 'POST', '/printer/emergency_stop'),
+        ('pause_print', {}, 'POST', '/printer/print/pause'),
+        ('resume_print', {}, 'POST', '/printer/print/resume'),
+        ('stop_print', {}, 'POST', '/printer/print/cancel'),
+        ('cmd', 'G28', 'POST', '/printer/gcode/script'),
+        ('heat_printer', {}, 'POST', '/printer/gcode/script'),
+        ('move_x:10_y:0_z:0', {}, 'POST', '/printer/gcode/script'),
+    ],
+}
+FAKE_PRINTERS = {'OCTOPRINT': FakeOctoPrint, 'KLIPPER': FakeMoonraker}
+
+
+def summarize(samples):
+    """Latency samples in seconds to n/p50/p95/max in milliseconds"""
+    if not samples:
+        return {'n': 0, 'p50': None, 'p95': None, 'max': None}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {'n': len(ordered), 'p50': pick(0.5), 'p95': pick(0.95), 'max': ordered[-1] * 1000}
+
+
+def read_proc_status(pid, field):
+    """A kB value from /proc/<pid>/status, e.g. VmRSS or VmHWM"""
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return None
+
+
+def read_cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime and stime are fields 14 and 15, counted after the ") "
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def write_config(path, driver, remote, printer, workdir):
+    with open(path, 'w') as f:
+        f.write(f"""[connection_settings]
+RECONNECT_INTERVAL=1
+REMOTE_WS_URL={remote.url}
+PRINTER_URL={printer.url}
+PRINTER_TRANSPORT=tcp
+KLIPPER_WEBSOCKET=true
+STATE_DIR={os.path.join(workdir, 'state')}
+PRINTER_DATA_DIR={os.path.join(workdir, 'printer_data')}
+
+[printer_details]
+DRIVER={driver}
+UUID=bench-{driver.lower()}
+API_KEY=bench
+
+[gcode_cache]
+ENABLED=true
+
+[offline_journal]
+ENABLED=false
+
+[metrics]
+PORT=0
+""")
+
+
+class Bench:
+    def __init__(self, driver, args, workdir):
+        self.driver = driver
+        self.args = args
+        self.workdir = workdir
+        self.remote = FakeRemote()
+        self.printer = FAKE_PRINTERS[driver]()
+        self.file_host = FakeFileHost()
+        self.agent = None
+
+    async def start(self):
+        for fake in (self.remote, self.printer, self.file_host):
+            await fake.start()
+        config_path = os.path.join(self.workdir, 'batch-link.cfg')
+        write_config(config_path, self.driver, self.remote, self.printer, self.workdir)
+        self.log = open(os.path.join(self.workdir, 'agent.log'), 'w')
+        self.agent = subprocess.Popen(
+            [sys.executable, 'batch-link.py'],
+            cwd=AGENT_DIR,
+            env={**os.environ, 'BATCH_LINK_CONFIG': config_path},
+            stdout=self.log,
+            stderr=subprocess.STDOUT,
+        )
+        await asyncio.wait_for(self.remote.authenticated.wait(), 30)
+        # Let the first poll, subscription and printer_update settle
+        await asyncio.sleep(3)
+
+    async def stop(self):
+        if self.agent and self.agent.poll() is None:
+            self.agent.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.agent.wait, 10)
+            except subprocess.TimeoutExpired:
+                self.agent.kill()
+        self.log.close()
+        for fake in (self.file_host, self.printer, self.remote):
+            await fake.stop()
+
+    async def command_latency(self):
+        results = {}
+        for action, content, method, path in COMMANDS[self.driver]:
+            samples = []
+            for _ in range(self.args.iterations):
+                sent_at = await self.remote.send(action, content)
+                received_at = await self.printer.wait_for_request(method, path, sent_at, timeout=10)
+                if received_at is not None:
+                    samples.append(received_at - sent_at)
+                await asyncio.sleep(0.2)
+            results[action] = summarize(samples)
+        return results
+
+    async def update_propagation(self):
+        samples = []
+        for i in range(self.args.iterations):
+            value = 30.0 + 2 * i
+            changed_at = time.monotonic()
+            self.printer.set_bed_temperature(value)
+            hit = await self.remote.wait_for_frame(
+                lambda frame: frame.get('action') in ('printer_update', 'printer_update_delta')
+                and frame.get('content', {}).get('bed_temperature') == value,
+                changed_at,
+                timeout=30,
+            )
+            if hit is not None:
+                samples.append(hit[0] - changed_at)
+        return summarize(samples)
+
+    async def transfer(self):
+        size = self.args.transfer_mb * 1024 * 1024
+        pid = self.agent.pid
+        baseline_rss = read_proc_status(pid, 'VmRSS')
+        peak_rss = baseline_rss
+        done = asyncio.Event()
+
+        async def sample_rss():
+            nonlocal peak_rss
+            while not done.is_set():
+                peak_rss = max(peak_rss, read_proc_status(pid, 'VmRSS'))
+                await asyncio.sleep(0.02)
+
+        sampler = asyncio.create_task(sample_rss())
+        url = self.file_host.file_url(size, f'bench-{int(time.time())}')
+        sent_at = await self.remote.send('print', {'file_name': 'bench.gcode', 'url': url})
+        if self.driver == 'KLIPPER':
+            finished_at = await self.printer.wait_for_request('POST', '/printer/print/start', sent_at, timeout=600)
+        else:
+            finished_at = await self.printer.wait_for_upload(sent_at, timeout=600)
+        done.set()
+        await sampler
+
+        if finished_at is None:
+            return {'size_mb': self.args.transfer_mb, 'seconds': None, 'mb_per_s': None}
+        seconds = finished_at - sent_at
+        return {
+            'size_mb': self.args.transfer_mb,
+            'seconds': seconds,
+            'mb_per_s': self.args.transfer_mb / seconds,
+            'baseline_rss_mb': baseline_rss / 1024,
+            'peak_rss_mb': peak_rss / 1024,
+        }
+
+    async def idle_cpu(self):
+        pid = self.agent.pid
+        start_cpu, start = read_cpu_seconds(pid), time.monotonic()
+        await asyncio.sleep(self.args.idle_seconds)
+        cpu = read_cpu_seconds(pid) - start_cpu
+        elapsed = time.monotonic() - start
+        return {
+            'seconds': elapsed,
+            'cpu_seconds_per_hour': cpu / elapsed * 3600,
+            'cpu_percent': cpu / elapsed * 100,
+        }
+
+    async def run(self):
+        await self.start()
+        try:
+            # Idle first, before transfers leave caches and buffers behind
+            return {
+                'idle': await self.idle_cpu(),
+                'commands': await self.command_latency(),
+                'updates': await self.update_propagation(),
+                'transfer': await self.transfer(),
+            }
+        finally:
+            await self.stop()
+
+
+def format_ms(value):
+    return '-' if value is None else f'{value:.1f}'
+
+
+def print_report(results):
+    for driver, result in results.items():
+        print(f'\n== {driver} ==')
+        print(f"{'command':<22}{'n':>4}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        for action, stats in result['commands'].items():
+            print(f"{action:<22}{stats['n']:>4}{format_ms(stats['p50']):>10}{format_ms(stats['p95']):>10}{format_ms(stats['max']):>10}")
+        stats = result['updates']
+        print(f"{'update propagation':<22}{stats['n']:>4}{format_ms(stats['p50']):>10}{format_ms(stats['p95']):>10}{format_ms(stats['max']):>10}")
+        transfer = result['transfer']
+        if transfer['seconds'] is None:
+            print(f"transfer {transfer['size_mb']}MB: did not finish")
+        else:
+            print(
+                f"transfer {transfer['size_mb']}MB: {transfer['seconds']:.2f}s, {transfer['mb_per_s']:.1f} MB/s, "
+                f"RSS {transfer['baseline_rss_mb']:.1f}MB -> peak {transfer['peak_rss_mb']:.1f}MB"
+            )
+        idle = result['idle']
+        print(f"idle CPU: {idle['cpu_seconds_per_hour']:.1f} s/hour ({idle['cpu_percent']:.2f}%)")
+
+
+def find_regressions(results, baseline, tolerance):
+    """Compare against a previous --json output, returning what got worse"""
+    regressions = []
+
+    def check(name, current, previous, higher_is_worse=True):
+        if current is None or previous is None or previous == 0:
+            return
+        change = (current - previous) / previous if higher_is_worse else (previous - current) / previous
+        if change > tolerance:
+            regressions.append(f'{name}: {previous:.2f} -> {current:.2f}')
+
+    for driver, result in results.items():
+        previous = baseline.get(driver)
+        if previous is None:
+            continue
+        for action, stats in result['commands'].items():
+            check(f'{driver} {action} p95 ms', stats['p95'], previous['commands'].get(action, {}).get('p95'))
+        check(f'{driver} update propagation p95 ms', result['updates']['p95'], previous['updates']['p95'])
+        check(f'{driver} transfer MB/s', result['transfer'].get('mb_per_s'), previous['transfer'].get('mb_per_s'), higher_is_worse=False)
+        check(f'{driver} peak RSS MB', result['transfer'].get('peak_rss_mb'), previous['transfer'].get('peak_rss_mb'))
+        check(f'{driver} idle CPU s/hour', result['idle']['cpu_seconds_per_hour'], previous['idle']['cpu_seconds_per_hour'])
+    return regressions
+
+
+async def main(args):
+    drivers = ['OCTOPRINT', 'KLIPPER'] if args.driver == 'all' else [args.driver.upper()]
+    results = {}
+    for driver in drivers:
+        with tempfile.TemporaryDirectory(prefix=f'batch-link-bench-{driver.lower()}-') as workdir:
+            results[driver] = await Bench(driver, args, workdir).run()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--driver', choices=['octoprint', 'klipper', 'all'], default='all')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--transfer-mb', type=int, default=100)
+    parser.add_argument('--idle-seconds', type=float, default=60)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='fail if results regress against this --json output')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression, default 0.2')
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        if regressions:
+            print('\nRegressions:\n  ' + '\n  '.join(regressions))
+            sys.exit(1)